@@ -4,6 +4,16 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import contextlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
 
 from . import mock
 
@@ -30,3 +40,37 @@ class NoopMock(mock.NonCallableMock):
     def __init__(self, *args, **kwargs):
         kwargs.setdefault('spec_set', object)
         return super(NoopMock, self).__init__(*args, **kwargs)
+
+
+class UnixKeyHandler(socketserver.StreamRequestHandler):
+    # Each request is b'DELAY WORD'.  Answer WORD uppercased after DELAY
+    # seconds.
+    def handle(self):
+        delay_s, _, word = self.rfile.read().partition(b' ')
+        time.sleep(float(delay_s))
+        self.wfile.write(word.upper())
+
+
+class UnixKeyServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # Clients that time out close their connections early.
+        pass
+
+
+@contextlib.contextmanager
+def unix_key_server():
+    tmpdir = tempfile.mkdtemp(prefix='xgtest')
+    path = os.path.join(tmpdir, 'keys.sock')
+    server = UnixKeyServer(path, UnixKeyHandler)
+    thread = threading.Thread(target=server.serve_forever, args=(0.01,))
+    thread.daemon = True
+    thread.start()
+    try:
+        yield path
+    finally:
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(tmpdir)
@@ -31,6 +31,10 @@ class FakeMultiProcessWriter(object):
         done_procs = [p for p in self.procs if p.done_writing()]
         self.procs.difference_update(done_procs)
 
+    def write_until_readable(self, read_fd, timeout=None):
+        self.write_ready(timeout)
+        return True
+
     def writing_count(self):
         return len(self.procs)
 
@@ -50,6 +54,9 @@ class FakePoll(object):
                  eventmask=select.POLLIN | select.POLLOUT | select.POLLPRI):
         self._fds[fd] = eventmask
 
+    def modify(self, fd, eventmask):
+        self._fds[fd] = eventmask
+
     def unregister(self, fd):
         del self._fds[fd]
 
@@ -59,7 +66,8 @@ class FakePoll(object):
         assert self._fds, "FakePoll checked when no fds registered"
         return_count = len(self._fds) if (self.return_count is None) else self.return_count
         return [(fd, self._fds[fd])
-                for _, fd in zip(range(return_count), self._fds)]
+                for _, fd in zip(range(return_count),
+                                 (fd for fd in self._fds if self._fds[fd]))]
 
 
 class FakePopen(object):
@@ -139,6 +147,9 @@ class FakeProcessWriter(object):
     def done_writing(self):
         return self._success is not None
 
+    def waiting_for_input(self):
+        return False
+
     def poll(self):
         return self.returncode
 
@@ -122,6 +122,366 @@ class ArgumentParserTestCase(unittest.TestCase, ExitTestHelper):
     def test_null_exclusive_with_eof(self):
         self.test_delimiter_exclusive_with_eof('-0')
 
+    def test_sorted_input(self, switches=['--sorted-input'], expected='error'):
+        arglist = self.build_arglist(switches + ['_', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.sorted_input, expected)
+
+    def test_sorted_input_rerun(self):
+        self.test_sorted_input(['--sorted-input-rerun'], 'rerun')
+
+    def test_sorted_input_default(self):
+        self.test_sorted_input([], None)
+
+    def test_sorted_input_modes_exclusive(self):
+        arglist = self.build_arglist(['--sorted-input', '--sorted-input-rerun', '_', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_sorted_input_exclusive_with_stream(self):
+        arglist = self.build_arglist(['--sorted-input', '--stream', '_', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_args_via_file(self):
+        arglist = self.build_arglist(['--args-via-file', '_', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertTrue(args.args_via_file)
+
+    def test_args_via_file_exclusive_with_stream(self):
+        arglist = self.build_arglist(['--args-via-file', '--stream', '_', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_batch_group_code(self):
+        arglist = self.build_arglist(['--batch-group-code', 'map(len, _)', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertTrue(args.batch_group_code)
+
+    def test_group_workers(self):
+        arglist = self.build_arglist(['--group-workers', '4', '_', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.group_workers, 4)
+
+    def test_group_workers_exclusive_with_parse_workers(self):
+        arglist = self.build_arglist(['--group-workers', '2', '--parse-workers', '2',
+                                      '_', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_group_workers_exclusive_with_memoize(self):
+        arglist = self.build_arglist(['--group-workers', '2', '--memoize-group-code',
+                                      '_', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_group_threads(self):
+        arglist = self.build_arglist(['--group-threads', '8', '_', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.group_threads, 8)
+
+    def test_group_threads_exclusive_with_group_workers(self):
+        arglist = self.build_arglist(['--group-threads', '2', '--group-workers', '2',
+                                      '_', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_group_threads_exclusive_with_batch(self):
+        arglist = self.build_arglist(['--group-threads', '2', '--batch-group-code',
+                                      'map(len, _)', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_group_threads_exclusive_with_memoize(self):
+        arglist = self.build_arglist(['--group-threads', '2', '--memoize-group-code',
+                                      '_', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_async_group_code_default_limit(self):
+        arglist = self.build_arglist(['--async-group-code', '_', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.async_group_code, 64)
+        self.assertEqual(args.group_code, '_')
+
+    def test_async_group_code_limit(self):
+        arglist = self.build_arglist(['--async-group-code=8', '_', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.async_group_code, 8)
+
+    def test_async_group_code_limit_separate(self):
+        arglist = self.build_arglist(['--async-group-code', '8', '_', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.async_group_code, 8)
+        self.assertEqual(args.group_code, '_')
+        self.assertEqual(args.command, ['echo'])
+
+    def test_query_socket(self):
+        arglist = self.build_arglist(['--async-group-code', '--query-socket', 'a.sock',
+                                      '--query-socket=b.sock', '_', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.query_socket, ['a.sock', 'b.sock'])
+
+    def test_query_socket_requires_async_group_code(self):
+        arglist = self.build_arglist(['--query-socket', 'a.sock', '_', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_async_group_code_exclusive_with_group_threads(self):
+        arglist = self.build_arglist(['--async-group-code', '--group-threads', '2',
+                                      '_', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_async_group_code_exclusive_with_batch(self):
+        arglist = self.build_arglist(['--async-group-code', '--batch-group-code',
+                                      'map(len, _)', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_group_by(self):
+        arglist = self.build_arglist(['--group-by', 'field:,:2', 'echo', 'x'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.group_by, 'field:,:2')
+        self.assertIsNone(args.group_code)
+        self.assertEqual(args.command, ['echo', 'x'])
+
+    def test_group_by_without_command(self):
+        arglist = self.build_arglist(['--group-by', 'ext'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertIsNone(args.group_code)
+        self.assertEqual(args.command, [])
+
+    def test_group_by_invalid(self):
+        arglist = self.build_arglist(['--group-by', 'regex:(', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_group_by_exclusive_with_group_code_options(self):
+        arglist = self.build_arglist(['--group-by', 'ext', '--batch-group-code', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_group_code_required(self):
+        self.assertParseError(self.build_arglist([]))
+
+    def test_keyed_input_default(self):
+        arglist = self.build_arglist(['--keyed-input', 'echo', 'x'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.keyed_input, '\t')
+        self.assertEqual(args.delimiter, '\n')
+        self.assertIsNone(args.group_code)
+        self.assertEqual(args.command, ['echo', 'x'])
+
+    def test_keyed_input_separator(self):
+        arglist = self.build_arglist(['--keyed-input=\\x1f', '--null', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.keyed_input, '\x1f')
+        self.assertEqual(args.delimiter, '\0')
+
+    def test_keyed_input_separator_not_separate(self):
+        arglist = self.build_arglist(['--keyed-input', ',', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.keyed_input, '\t')
+        self.assertEqual(args.command, [',', 'echo'])
+
+    def test_keyed_input_empty_separator(self):
+        self.assertParseError(self.build_arglist(['--keyed-input=', 'echo']))
+
+    def test_keyed_input_exclusive_with_group_by(self):
+        arglist = self.build_arglist(['--keyed-input', '--group-by', 'ext', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_keyed_input_exclusive_with_key_cache(self):
+        arglist = self.build_arglist(['--keyed-input', '--key-cache', 'k.db', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_group_cmd(self):
+        arglist = self.build_arglist(['--group-cmd', 'file', '-b', ';', 'echo', 'x'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.group_cmd, ['file', '-b'])
+        self.assertIsNone(args.group_code)
+        self.assertEqual(args.command, ['echo', 'x'])
+
+    def test_group_cmd_unterminated(self):
+        self.assertParseError(self.build_arglist(['--group-cmd', 'file', 'echo']))
+
+    def test_group_cmd_empty(self):
+        self.assertParseError(self.build_arglist(['--group-cmd', ';', 'echo']))
+
+    def test_group_cmd_exclusive_with_group_by(self):
+        arglist = self.build_arglist(['--group-by', 'ext', '--group-cmd', 'cat', ';', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_group_cmd_exclusive_with_group_code_options(self):
+        arglist = self.build_arglist(['--group-cmd', 'cat', ';', '--group-threads', '2',
+                                      'echo'])
+        self.assertParseError(arglist)
+
+    def test_group_cmd_exclusive_with_key_cache(self):
+        arglist = self.build_arglist(['--group-cmd', 'cat', ';', '--key-cache', 'k.db',
+                                      'echo'])
+        self.assertParseError(arglist)
+
+    def test_group_cmd_exclusive_with_stream(self):
+        arglist = self.build_arglist(['--group-cmd', 'cat', ';', '--stream', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_max_procs_default(self):
+        args, _ = xg.ArgumentParser().parse_args(self.build_arglist())
+        self.assertEqual(args.max_procs, 1)
+
+    @unittest.skipIf(PY_MAJVER < 3, "--serve requires Python 3")
+    def test_serve(self):
+        arglist = self.build_arglist([], serve='/tmp/xg.sock')
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.serve, '/tmp/xg.sock')
+        self.assertIsNone(args.group_code)
+        self.assertGreaterEqual(args.max_procs, 1)
+
+    @unittest.skipIf(PY_MAJVER < 3, "--serve requires Python 3")
+    def test_serve_max_procs(self):
+        arglist = self.build_arglist(['-P', '3'], serve='/tmp/xg.sock')
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.max_procs, 3)
+
+    def test_serve_exclusive_with_group_code(self):
+        self.assertParseError(self.build_arglist(serve='/tmp/xg.sock'))
+
+    def test_serve_exclusive_with_group_by(self):
+        arglist = self.build_arglist(['--group-by', 'ext', 'echo'], serve='/tmp/xg.sock')
+        self.assertParseError(arglist)
+
+    def test_serve_exclusive_with_connect(self):
+        arglist = self.build_arglist([], serve='/tmp/xg.sock', connect='/tmp/xg.sock')
+        self.assertParseError(arglist)
+
+    @unittest.skipIf(PY_MAJVER < 3, "--connect requires Python 3")
+    def test_connect(self):
+        arglist = self.build_arglist(connect='/tmp/xg.sock')
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.connect, '/tmp/xg.sock')
+        self.assertEqual(args.group_code, '_')
+
+    def test_stat_cache(self):
+        arglist = self.build_arglist(['--stat-cache', 'os.path.getsize', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertTrue(args.stat_cache)
+
+    def test_stat_cache_exclusive_with_group_by(self):
+        arglist = self.build_arglist(['--stat-cache', '--group-by', 'ext', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_stat_cache_exclusive_with_group_workers(self):
+        arglist = self.build_arglist(['--stat-cache', '--group-workers', '2', 'len', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_stat_cache_exclusive_with_parse_workers(self):
+        arglist = self.build_arglist(['--stat-cache', '--parse-workers', '2', 'len', 'echo'])
+        self.assertParseError(arglist)
+
+    @unittest.skipIf(PY_MAJVER < 3, "--expand-dirs requires Python 3")
+    def test_expand_dirs(self):
+        arglist = self.build_arglist(['--expand-dirs', '--expand-depth', '2',
+                                      '--expand-name', '*.py', 'len', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertTrue(args.expand_dirs)
+        self.assertEqual(args.expand_depth, 2)
+        self.assertEqual(args.expand_name, '*.py')
+        self.assertEqual(args.expand_threads, 4)
+        self.assertTrue(args.stat_cache)
+
+    @unittest.skipIf(PY_MAJVER < 3, "--expand-dirs requires Python 3")
+    def test_expand_dirs_group_by_no_stat_cache(self):
+        arglist = self.build_arglist(['--expand-dirs', '--group-by', 'ext', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertFalse(args.stat_cache)
+
+    def test_expand_options_require_expand_dirs(self):
+        self.assertParseError(self.build_arglist(['--expand-follow', 'len', 'echo']))
+
+    def test_expand_depth_positive(self):
+        arglist = self.build_arglist(['--expand-dirs', '--expand-depth', '0', 'len', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_expand_dirs_exclusive_with_keyed_input(self):
+        arglist = self.build_arglist(['--expand-dirs', '--keyed-input', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_key_cache(self):
+        arglist = self.build_arglist(['--key-cache', 'keys.db', '_', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.key_cache, 'keys.db')
+
+    def test_memoize_group_code_default_size(self):
+        arglist = self.build_arglist(['--memoize-group-code', '_', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.memoize_group_code, 65536)
+        self.assertEqual(args.group_code, '_')
+
+    def test_memoize_group_code_size(self):
+        arglist = self.build_arglist(['--memoize-group-code=1k', '_', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.memoize_group_code, 1024)
+
+    def test_memoize_group_code_size_separate(self):
+        arglist = self.build_arglist(['--memoize-group-code', '100', 'os.path.dirname',
+                                      'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.memoize_group_code, 100)
+        self.assertEqual(args.group_code, 'os.path.dirname')
+        self.assertEqual(args.command, ['echo'])
+
+    def test_memoize_group_code_size_separate_suffix(self):
+        arglist = self.build_arglist(['--memoize-group-code', '1k', '_', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.memoize_group_code, 1024)
+        self.assertEqual(args.group_code, '_')
+
+    def test_memoize_group_code_after_valued_option(self):
+        arglist = self.build_arglist(['--encoding', 'ascii', '--memoize-group-code',
+                                      '_', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.memoize_group_code, 65536)
+        self.assertEqual(args.encoding, 'ascii')
+
+    def test_memoize_group_code_not_set(self):
+        arglist = self.build_arglist(['_', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertIsNone(args.memoize_group_code)
+
+    def test_key_cache_exclusive_with_parse_workers(self):
+        arglist = self.build_arglist(['--key-cache', 'keys.db', '--parse-workers', '2',
+                                      'len', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_memoize_group_code_exclusive_with_parse_workers(self):
+        arglist = self.build_arglist(['--memoize-group-code', '--parse-workers', '2',
+                                      'len', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_memoize_group_code_exclusive_with_batch(self):
+        arglist = self.build_arglist(['--memoize-group-code', '--batch-group-code',
+                                      'map(len, _)', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_parse_workers(self):
+        arglist = self.build_arglist(['--parse-workers', '4', '_', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.parse_workers, 4)
+
+    def test_parse_workers_exclusive_with_stream(self):
+        arglist = self.build_arglist(['--parse-workers', '2', '--stream', '_', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_parse_workers_exclusive_with_sorted_input(self):
+        arglist = self.build_arglist(['--parse-workers', '2', '--sorted-input', '_', 'echo'])
+        self.assertParseError(arglist)
+
+    def test_memory_limit(self, size_s='100', expected=100):
+        arglist = self.build_arglist(['--memory-limit', size_s, '_', 'echo'])
+        args, _ = xg.ArgumentParser().parse_args(arglist)
+        self.assertEqual(args.memory_limit, expected)
+
+    def test_memory_limit_kilobytes(self):
+        self.test_memory_limit('4K', 4096)
+
+    def test_memory_limit_megabytes(self):
+        self.test_memory_limit('2MiB', 2 * 1024 * 1024)
+
+    def test_memory_limit_gigabytes(self):
+        self.test_memory_limit('1g', 1024 ** 3)
+
+    def test_memory_limit_invalid(self):
+        self.assertParseError(self.build_arglist(['--memory-limit', 'lots', '_', 'echo']))
+
     def test_xargs_options(self):
         arglist = self.build_arglist(['-E', 'EOF', '-I', '{}', '_', 'echo'])
         args, xargs_opts = xg.ArgumentParser().parse_args(arglist)
@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import contextlib
+import os
+import time
+import unittest
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+import xargs_groupby as xg
+from . import mock
+from .helpers import ExceptionWrapperTestHelper, unix_key_server
+
+class DelayedKeys(object):
+    # A stand-in for group code that returns futures, which tracks how many
+    # are waiting at once.
+    def __init__(self, delay):
+        self.delay = delay
+        self.loop = None
+        self.waiting = 0
+        self.max_waiting = 0
+
+    def func(self, arg):
+        future = self.loop.create_future()
+        self.waiting += 1
+        self.max_waiting = max(self.waiting, self.max_waiting)
+        self.loop.call_later(self.delay, self._resolve, future, len(arg))
+        return future
+
+    def _resolve(self, future, key):
+        self.waiting -= 1
+        future.set_result(key)
+
+    @contextlib.contextmanager
+    def fast_calls(self):
+        yield self.func
+
+    runtime_error = staticmethod(xg.UserExpression.runtime_error)
+
+
+@unittest.skipIf(asyncio is None, "asyncio not available")
+class AsyncUserExpressionTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
+    def setUp(self):
+        server = unix_key_server()
+        self.socket_path = server.__enter__()
+        self.addCleanup(server.__exit__, None, None, None)
+
+    def tearDown(self):
+        try:
+            self.expr.close()
+        except AttributeError:
+            pass
+
+    def query_expr(self, concurrency, delay_s='0', guard_s='True', timeout_s=None):
+        # Group code that asks the test server for each argument's key.
+        query_s = 'asyncio.unix_query({!r}, "{{}} {{}}".format({}, s).encode())'.format(
+            self.socket_path, delay_s)
+        if timeout_s is not None:
+            query_s = 'asyncio.wait_for({}, {})'.format(query_s, timeout_s)
+        self.expr = xg.AsyncUserExpression(
+            'lambda s: {} and {}'.format(guard_s, query_s), concurrency,
+            query_sockets=[self.socket_path])
+
+    def delayed_expr(self, concurrency, delay=0.01):
+        delayed_keys = DelayedKeys(delay)
+        self.expr = xg.AsyncUserExpression('len', concurrency,
+                                           lambda expr_s: delayed_keys)
+        self.expr.group_keys([])
+        delayed_keys.loop = self.expr._loop
+        return delayed_keys
+
+    def test_group_keys_in_order(self):
+        self.query_expr(4, '0.01 * (len(s) % 3)')
+        args = ['aaa', 'b', 'cc', 'dddd', 'e']
+        self.assertEqual(self.expr.group_keys(args), [arg.upper().encode() for arg in args])
+
+    def test_plain_keys(self):
+        self.expr = xg.AsyncUserExpression('len', 4)
+        self.assertEqual(self.expr.group_keys(['a', 'bb']), [1, 2])
+
+    def test_single_call(self):
+        self.query_expr(4)
+        self.assertEqual(self.expr('abc'), b'ABC')
+
+    def test_concurrency_limit(self):
+        delayed_keys = self.delayed_expr(3)
+        self.assertEqual(self.expr.group_keys(['a', 'bb'] * 5), [1, 2] * 5)
+        self.assertEqual(delayed_keys.max_waiting, 3)
+
+    def test_waits_overlap(self, args_count=40, delay=0.05):
+        self.delayed_expr(args_count, delay)
+        start_time = time.time()
+        self.expr.group_keys(['a'] * args_count)
+        self.assertLess(time.time() - start_time, delay * args_count / 4)
+
+    def test_queries_overlap(self, args_count=20, delay=0.1):
+        self.query_expr(args_count, repr(delay))
+        start_time = time.time()
+        self.expr.group_keys(['a'] * args_count)
+        self.assertLess(time.time() - start_time, delay * args_count / 4)
+
+    def test_batch_size_covers_concurrency(self):
+        self.assertEqual(xg.AsyncUserExpression('len', 1000).BATCH_SIZE, 4000)
+        self.assertEqual(xg.AsyncUserExpression('len', 2).BATCH_SIZE,
+                         xg.AsyncUserExpression.BATCH_SIZE)
+
+    def test_call_error(self):
+        self.query_expr(4, guard_s='1 // len(s)')
+        with self.assertRaisesWrapped(ZeroDivisionError, xg.UserExpressionRuntimeError, ''):
+            self.expr.group_keys(['a', '', 'b'])
+
+    def test_await_error(self):
+        self.query_expr(4, '0.5', timeout_s='0.01 * (s != "b")')
+        with self.assertRaisesWrapped(asyncio.TimeoutError,
+                                      xg.UserExpressionRuntimeError, 'b'):
+            self.expr.group_keys(['a', 'b', 'c'])
+
+    def test_query_error(self):
+        missing_path = self.socket_path + 'x'
+        self.expr = xg.AsyncUserExpression(
+            'lambda s: asyncio.unix_query({!r}, s.encode())'.format(missing_path), 4,
+            query_sockets=[missing_path])
+        with self.assertRaisesWrapped(EnvironmentError, xg.UserExpressionRuntimeError, 'a'):
+            self.expr.group_keys(['a'])
+
+    def test_unlisted_socket_not_usable(self):
+        self.expr = xg.AsyncUserExpression(
+            'lambda s: asyncio.unix_query({!r}, b"0 " + s.encode())'.format(
+                self.socket_path), 4)
+        with self.assertRaisesWrapped(ValueError, xg.UserExpressionRuntimeError, 'a'):
+            self.expr.group_keys(['a'])
+
+    def test_listed_socket_by_other_path(self):
+        self.query_expr(4)
+        self.expr.query_sockets = xg.UnixQuery.allowed_paths(
+            [os.path.join(os.path.dirname(self.socket_path), '.', 'keys.sock')])
+        self.assertEqual(self.expr.group_keys(['a']), [b'A'])
+
+    def test_sockets_only_allowed_during_batches(self):
+        self.query_expr(4)
+        self.expr.group_keys(['a'])
+        with self.assertRaises(ValueError):
+            xg.UnixQuery.start(self.socket_path, b'0 a')
+
+    def test_query_needs_bytes(self):
+        self.expr = xg.AsyncUserExpression(
+            'lambda s: asyncio.unix_query({!r}, s)'.format(self.socket_path), 4,
+            query_sockets=[self.socket_path])
+        with self.assertRaisesWrapped(TypeError, xg.UserExpressionRuntimeError, 'a'):
+            self.expr.group_keys(['a'])
+
+    def test_runs_again_after_error(self):
+        self.query_expr(4, guard_s='1 // len(s)')
+        with self.assertRaises(xg.UserExpressionRuntimeError):
+            self.expr.group_keys([''])
+        self.assertEqual(self.expr.group_keys(['a']), [b'A'])
+
+    def test_prepper_order_matches_serial(self):
+        args = list(map('{}x'.format, range(300)))
+        self.expr = xg.AsyncUserExpression(
+            'lambda s: asyncio.unix_query({!r}, "0 {{}}".format(int(s[:-1]) % 7).encode())'
+            .format(self.socket_path), 16, query_sockets=[self.socket_path])
+        prepper = xg.InputPrepper(self.expr, None, 'utf-8')
+        prepper.add(args)
+        serial_prepper = xg.InputPrepper(
+            xg.UserExpression('lambda s: "{}".format(int(s[:-1]) % 7).encode()'),
+            None, 'utf-8')
+        serial_prepper.add(args)
+        for key in serial_prepper:
+            self.assertEqual(list(prepper[key]), list(serial_prepper[key]))
+
+    def test_use_key_cache(self):
+        key_cache = mock.Mock(name='KeyCache')
+        self.expr = xg.AsyncUserExpression('len', 2)
+        orig_func = self.expr.func
+        self.expr.use_key_cache(key_cache)
+        key_cache.wrap_batch.assert_called_with(orig_func)
+
+    def test_close(self):
+        self.expr = xg.AsyncUserExpression('len', 2)
+        self.expr.group_keys(['a'])
+        loop = self.expr._loop
+        self.expr.close()
+        self.assertTrue(loop.is_closed())
+        self.expr.close()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+import xargs_groupby as xg
+from .helpers import ExceptionWrapperTestHelper
+
+class BatchUserExpressionTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
+    def test_group_keys(self):
+        expr = xg.BatchUserExpression('lambda args: args[::-1]')
+        self.assertEqual(expr.group_keys(['a', 'b']), ['b', 'a'])
+
+    def test_lazy_keys(self):
+        expr = xg.BatchUserExpression('lambda args: map(len, args)')
+        self.assertEqual(expr.group_keys(['a', 'bb', 'c']), [1, 2, 1])
+
+    def test_comprehension_keys(self):
+        expr = xg.BatchUserExpression('lambda xs: [len(x) for x in xs]')
+        self.assertEqual(expr.group_keys(['a', 'bb']), [1, 2])
+
+    def test_single_call(self):
+        expr = xg.BatchUserExpression('lambda args: map(len, args)')
+        self.assertEqual(expr('abc'), 3)
+
+    def test_error_reported_for_failing_arg(self):
+        expr = xg.BatchUserExpression('lambda args: map(int, args)')
+        with self.assertRaisesWrapped(ValueError, xg.UserExpressionRuntimeError, 'x'):
+            expr.group_keys(['1', '2', 'x', '4'])
+
+    def test_batch_error_reported_for_first_arg(self):
+        expr = xg.BatchUserExpression('lambda args: args if len(args) < 3 else 1 // 0')
+        with self.assertRaisesWrapped(ZeroDivisionError, xg.UserExpressionRuntimeError, 'a'):
+            expr.group_keys(['a', 'b', 'c'])
+
+    def test_wrong_keys_count(self):
+        expr = xg.BatchUserExpression('lambda args: args[:1]')
+        with self.assertRaisesWrapped(ValueError, xg.UserExpressionRuntimeError, 'a'):
+            expr.group_keys(['a', 'b'])
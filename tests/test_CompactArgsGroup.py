@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import array
+import unittest
+
+import xargs_groupby as xg
+
+class CompactArgsGroupTestCase(unittest.TestCase):
+    def group_from(self, args):
+        group = xg.CompactArgsGroup()
+        for arg in args:
+            group.append(arg)
+        return group
+
+    def assertGroupHas(self, group, expected):
+        self.assertEqual(len(group), len(expected))
+        self.assertEqual([bytes(arg) for arg in group], expected)
+
+    def test_empty(self):
+        self.assertGroupHas(xg.CompactArgsGroup(), [])
+
+    def test_args_kept_separate(self, args=[b'ab', b'c', b'def']):
+        self.assertGroupHas(self.group_from(args), args)
+
+    def test_empty_args(self):
+        self.test_args_kept_separate([b'', b'a', b'', b''])
+
+    def test_args_stored_together(self):
+        group = self.group_from([b'ab', b'cd'])
+        self.assertEqual(bytes(group.args_bytes), b'abcd')
+        self.assertEqual(list(group.ends), [2, 4])
+
+    def test_append_memoryview(self):
+        group = self.group_from([memoryview(b'abc')[1:]])
+        self.assertGroupHas(group, [b'bc'])
+
+    def test_wide_ends(self):
+        group = self.group_from([b'ab'])
+        group.ends = array.array(str('B'), group.ends)
+        group.args_bytes.extend(b'\0' * 300)
+        group.append(b'c')
+        self.assertEqual(group.ends.typecode, 'Q')
+        self.assertEqual(list(group.ends), [2, 303])
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import sys
+import unittest
+
+import xargs_groupby as xg
+from .helpers import ExceptionWrapperTestHelper
+
+def python_command(source):
+    return [sys.executable, '-c', source]
+
+# Write each line's length, with Python's default block buffering.
+LENGTHS_SOURCE = """import sys
+for line in sys.stdin:
+    sys.stdout.write('{}\\n'.format(len(line) - 1))
+"""
+
+class CoprocessKeysTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
+    def assertKeys(self, coprocess, args_bytes, expected):
+        self.assertEqual(list(coprocess.stream_keys(args_bytes)), expected)
+
+    def test_text_keys(self):
+        coprocess = xg.CoprocessKeys(python_command(LENGTHS_SOURCE), encoding='utf-8')
+        self.assertKeys(coprocess, [b'a', b'bcd', b''], ['1', '3', '0'])
+
+    def test_bytes_keys(self):
+        coprocess = xg.CoprocessKeys(python_command(LENGTHS_SOURCE), True, 'utf-8')
+        self.assertKeys(coprocess, [b'ab', b'c'], [b'2', b'1'])
+
+    def test_no_arguments(self):
+        coprocess = xg.CoprocessKeys(python_command(LENGTHS_SOURCE), encoding='utf-8')
+        self.assertKeys(coprocess, [], [])
+
+    def test_large_input_does_not_deadlock(self):
+        # Enough data to fill both pipes many times over.
+        args_bytes = [str(n).encode('ascii') * 8 for n in range(50000)]
+        coprocess = xg.CoprocessKeys(python_command(LENGTHS_SOURCE), encoding='utf-8')
+        keys = list(coprocess.stream_keys(args_bytes))
+        self.assertEqual(keys, ['{}'.format(len(arg)) for arg in args_bytes])
+
+    def test_last_key_without_newline(self):
+        command = python_command(
+            "import sys; sys.stdout.write('\\n'.join(sys.stdin.read().split()))")
+        coprocess = xg.CoprocessKeys(command, encoding='utf-8')
+        self.assertKeys(coprocess, [b'a', b'b'], ['a', 'b'])
+
+    def test_arguments_are_read_lazily(self):
+        read_args = []
+        def iter_args():
+            for arg in [b'a', b'b']:
+                read_args.append(arg)
+                yield arg
+        coprocess = xg.CoprocessKeys(['cat'], encoding='utf-8')
+        keys = coprocess.stream_keys(iter_args())
+        self.assertEqual(read_args, [])
+        self.assertEqual(list(keys), ['a', 'b'])
+
+    def test_newline_in_argument(self):
+        coprocess = xg.CoprocessKeys(['cat'], encoding='utf-8')
+        with self.assertRaises(xg.UserArgumentsError):
+            list(coprocess.stream_keys([b'a\nb']))
+
+    def assertCommandError(self, command, args_bytes):
+        coprocess = xg.CoprocessKeys(command, encoding='utf-8')
+        with self.assertRaises(xg.UserCommandError) as exc_check:
+            list(coprocess.stream_keys(args_bytes))
+        self.assertEqual(exc_check.exception.args[0], command[0])
+        return exc_check.exception
+
+    def test_too_few_keys(self):
+        error = self.assertCommandError(['head', '-n', '1'], [b'a', b'b'])
+        self.assertIn("1 keys for 2 arguments", error.__cause__.args[0])
+
+    def test_too_many_keys(self):
+        error = self.assertCommandError(
+            python_command("import sys; sys.stdin.read(); print('a'); print('b')"), [b'a'])
+        self.assertIn("more keys", error.__cause__.args[0])
+
+    def test_failure_status(self):
+        error = self.assertCommandError(python_command("import sys; sys.exit(2)"), [b'a'])
+        self.assertIn("status 2", error.__cause__.args[0])
+
+    def test_stops_reading(self):
+        args_bytes = [b'x' * 1024] * 1024
+        error = self.assertCommandError(python_command("print('a')"), args_bytes)
+        self.assertIn("stopped reading", error.__cause__.args[0])
+
+    def test_command_not_found(self):
+        self.assertCommandError(['xgtest-nonexistent-command'], [b'a'])
+
+
+class CoprocessInputPrepperTestCase(unittest.TestCase):
+    class FakeCoprocessKeys(object):
+        def __init__(self):
+            self.args_bytes = []
+
+        def stream_keys(self, args_bytes):
+            for arg_bytes in args_bytes:
+                self.args_bytes.append(arg_bytes)
+                yield arg_bytes[:1].decode('utf-8')
+
+    def test_prepper_groups_by_streamed_keys(self):
+        group_func = self.FakeCoprocessKeys()
+        prepper = xg.InputPrepper(group_func, None, 'utf-8')
+        prepper.add(['ab', 'ba', 'ac', b'bd'])
+        self.assertEqual({key: prepper[key] for key in prepper},
+                         {'a': [b'ab', b'ac'], 'b': [b'ba', b'bd']})
+        self.assertEqual(group_func.args_bytes, [b'ab', b'ba', b'ac', b'bd'])
+
+    def test_streaming_prepper(self):
+        prepper = xg.StreamingInputPrepper(self.FakeCoprocessKeys(), None, 'utf-8')
+        prepper.add(['ab', 'ba', 'ac'])
+        keys = list(prepper)
+        self.assertEqual(keys, ['a', 'b'])
+        self.assertEqual(list(prepper['a']), [b'ab', b'ac'])
@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import errno
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import xargs_groupby as xg
+from . import mock
+
+@unittest.skipUnless(hasattr(os, 'scandir'), "DirectoryExpander requires os.scandir")
+class DirectoryExpanderTestCase(unittest.TestCase):
+    TREE_FILES = ['1.txt', 'a/2.py', 'a/b/3.txt', 'a/b/c/4.py', 'x/5.txt']
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='xgtest')
+        self.addCleanup(shutil.rmtree, self.root)
+        for rel_path in self.TREE_FILES:
+            path = self.path(rel_path)
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                pass
+            open(path, 'w').close()
+
+    def path(self, rel_path=None):
+        if rel_path is None:
+            return self.root
+        return os.path.join(self.root, *rel_path.split('/'))
+
+    def expand(self, roots=None, **kwargs):
+        if roots is None:
+            roots = [self.root]
+        expander = xg.DirectoryExpander(roots, **kwargs)
+        return [os.fsdecode(path) for path in expander]
+
+    def assertExpandsTo(self, rel_paths, roots=None, **kwargs):
+        self.assertEqual(sorted(self.expand(roots, **kwargs)),
+                         sorted(self.path(rel_path) for rel_path in rel_paths))
+
+    def test_all_files(self):
+        self.assertExpandsTo(self.TREE_FILES)
+
+    def test_bytes_root(self):
+        self.assertExpandsTo(self.TREE_FILES, [os.fsencode(self.root)])
+
+    def test_yields_bytes(self):
+        paths = list(xg.DirectoryExpander([self.root]))
+        self.assertTrue(all(isinstance(path, bytes) for path in paths))
+
+    def test_shallow_files_first(self):
+        paths = self.expand(threads_count=1)
+        self.assertEqual(paths[-1], self.path('a/b/c/4.py'))
+
+    def test_max_depth(self):
+        self.assertExpandsTo(['1.txt', 'a/2.py', 'x/5.txt'], max_depth=2)
+
+    def test_max_depth_one(self):
+        self.assertExpandsTo(['1.txt'], max_depth=1)
+
+    def test_name_pattern(self):
+        self.assertExpandsTo(['1.txt', 'a/b/3.txt', 'x/5.txt'], name_pattern='*.txt')
+
+    def test_non_directory_passes_through(self):
+        self.assertExpandsTo(['1.txt', 'nonexistent'],
+                             [self.path('1.txt'), self.path('nonexistent')])
+
+    def test_symlink_not_followed(self):
+        os.symlink(self.path('a'), self.path('x/link'))
+        self.assertExpandsTo(self.TREE_FILES + ['x/link'])
+
+    def test_symlink_followed(self):
+        os.symlink(self.path('a/b'), self.path('x/link'))
+        self.assertExpandsTo(self.TREE_FILES + ['x/link/3.txt', 'x/link/c/4.py'],
+                             follow_symlinks=True)
+
+    def test_symlink_loop_followed_once(self):
+        os.symlink(self.path(), self.path('x/loop'))
+        self.assertExpandsTo(self.TREE_FILES, follow_symlinks=True)
+
+    def expand_with_errors(self, bad_rel_paths, error_num=errno.EACCES, **kwargs):
+        bad_paths = set(os.fsencode(self.path(rel_path)) for rel_path in bad_rel_paths)
+        stderr = io.StringIO()
+        expander = xg.DirectoryExpander([self.root], stderr=stderr, **kwargs)
+        orig_scan = expander._scan
+        def scan(dir_path):
+            if dir_path in bad_paths:
+                raise OSError(error_num, os.strerror(error_num), dir_path)
+            return orig_scan(dir_path)
+        expander._scan = scan
+        paths = sorted(os.fsdecode(path) for path in expander)
+        return expander, paths, stderr.getvalue()
+
+    def test_unreadable_directory(self):
+        expander, paths, stderr_s = self.expand_with_errors([None])
+        self.assertEqual(paths, [])
+        self.assertEqual(expander.errors_count, 1)
+        self.assertIn(self.root, stderr_s)
+        self.assertIn(os.strerror(errno.EACCES), stderr_s)
+
+    def test_unreadable_subdirectory_skipped(self):
+        expander, paths, stderr_s = self.expand_with_errors(['a/b', 'x'])
+        self.assertEqual(paths, [self.path(rel_path) for rel_path in ['1.txt', 'a/2.py']])
+        self.assertEqual(expander.errors_count, 2)
+        self.assertEqual(len(stderr_s.splitlines()), 2)
+        self.assertIn(self.path('a/b'), stderr_s)
+
+    def test_vanished_subdirectory_skipped(self):
+        expander, paths, stderr_s = self.expand_with_errors(['a'], errno.ENOENT)
+        self.assertEqual(paths, [self.path(rel_path) for rel_path in ['1.txt', 'x/5.txt']])
+        self.assertEqual(expander.errors_count, 1)
+        self.assertIn(os.strerror(errno.ENOENT), stderr_s)
+
+    def test_no_errors(self):
+        expander, _, stderr_s = self.expand_with_errors([])
+        self.assertEqual(expander.errors_count, 0)
+        self.assertEqual(stderr_s, '')
+
+    def test_vanished_root_followed(self):
+        stderr = io.StringIO()
+        expander = xg.DirectoryExpander([self.root], follow_symlinks=True, stderr=stderr)
+        # The root is removed after it's found to be a directory.
+        with mock.patch('os.path.isdir', return_value=True), \
+             mock.patch('os.stat', side_effect=OSError(errno.ENOENT, "gone")):
+            self.assertEqual(list(expander), [])
+        self.assertEqual(expander.errors_count, 1)
+
+    def test_stat_cache_entries(self, decode_paths=True):
+        stat_cache = mock.Mock(name='StatCache')
+        self.expand(name_pattern='*.py', stat_cache=stat_cache, decode_paths=decode_paths)
+        expected = [self.path(rel_path) for rel_path in ['a/2.py', 'a/b/c/4.py']]
+        if not decode_paths:
+            expected = list(map(os.fsencode, expected))
+        cached_paths = [call[0][0] for call in stat_cache.add_entry.call_args_list]
+        self.assertEqual(sorted(cached_paths), sorted(expected))
+        for call in stat_cache.add_entry.call_args_list:
+            self.assertEqual(os.fsdecode(call[0][1].path), os.fsdecode(call[0][0]))
+
+    def test_stat_cache_entries_bytes(self):
+        self.test_stat_cache_entries(False)
@@ -39,6 +39,7 @@ class ExceptHookTestCase(unittest.TestCase, ExitTestHelper):
         xg.UserCommandError: "error running {!r}",
         xg.UserExpressionCompileError: "error compiling group code {!r}",
         xg.UserExpressionRuntimeError: "group code raised an error on argument {!r}",
+        xg.UserKeyCacheError: "error using key cache {!r}",
     }
     ENVIRONMENT_ERRNOS = tuple(errno.errorcode)
     SIGINT_EXIT_CODE = 128 + signal.SIGINT
@@ -179,6 +180,20 @@ class ExceptHookTestCase(unittest.TestCase, ExitTestHelper):
         exception.__cause__ = self.new_environment_error(OSError, None, None, filename)
         self.check_environment_error_report(exception, header, wrapper_msg, filename)
 
+    def test_empty_cause_reported_by_type(self):
+        stderr, excepthook = self.new_excepthook()
+        exception = xg.UserExpressionRuntimeError('test')
+        exception.__cause__ = TimeoutError() if (sys.version_info.major >= 3) else KeyError()
+        self.assertExitFrom(exception, excepthook, 3)
+        self.assertErrorHeadline(stderr, self.USER_ERRORS[type(exception)].format('test'),
+                                 type(exception.__cause__).__name__)
+
+    def test_stderr_flushed_before_exit(self):
+        stderr, excepthook = self.new_excepthook()
+        stderr.flush = mock.Mock(name='flush')
+        self.assertExitFrom(self.new_error(xg.UserArgumentsError), excepthook, 3)
+        stderr.flush.assert_called_with()
+
     def test_keyboard_interrupt_callback(self):
         _, excepthook = self.new_excepthook(show_tb=False)
         exception = KeyboardInterrupt("callback test")
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+import xargs_groupby as xg
+from . import mock
+
+class ExpressionCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = xg.ExpressionCache()
+        self.builder = self.new_builder('UserExpression')
+
+    def new_builder(self, name):
+        builder = mock.Mock(name=name)
+        builder.compile.side_effect = lambda s: mock.sentinel.code
+        return builder
+
+    def test_reuses_code(self):
+        self.cache.get(self.builder, 'len')
+        self.cache.get(self.builder, 'len')
+        self.builder.compile.assert_called_once_with('len')
+
+    def test_builds_expression_each_time(self):
+        self.cache.get(self.builder, 'len')
+        self.cache.get(self.builder, 'len')
+        self.builder.assert_called_with('len', mock.sentinel.code)
+        self.assertEqual(self.builder.call_count, 2)
+
+    def test_compile_only(self):
+        self.assertIs(self.cache.compile(self.builder, 'len'), mock.sentinel.code)
+        self.builder.assert_not_called()
+        self.cache.get(self.builder, 'len')
+        self.builder.compile.assert_called_once_with('len')
+
+    def test_separate_by_constructor(self):
+        other_builder = self.new_builder('BatchUserExpression')
+        self.cache.get(self.builder, 'len')
+        self.cache.get(other_builder, 'len')
+        other_builder.compile.assert_called_once_with('len')
+
+    def test_constructor(self):
+        constructor = self.cache.constructor(self.builder)
+        constructor('len')
+        self.cache.get(self.builder, 'len')
+        self.builder.compile.assert_called_once_with('len')
+
+    def test_compile_error_not_cached(self):
+        self.builder.compile.side_effect = xg.UserExpressionCompileError('(')
+        with self.assertRaises(xg.UserExpressionCompileError):
+            self.cache.get(self.builder, '(')
+        with self.assertRaises(xg.UserExpressionCompileError):
+            self.cache.get(self.builder, '(')
+        self.assertEqual(self.builder.compile.call_count, 2)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.MAX_SIZE = 2
+        self.cache.get(self.builder, 'a')
+        self.cache.get(self.builder, 'b')
+        self.cache.get(self.builder, 'a')
+        self.cache.get(self.builder, 'c')
+        self.builder.compile.reset_mock()
+        self.cache.get(self.builder, 'a')
+        self.builder.compile.assert_not_called()
+        self.cache.get(self.builder, 'b')
+        self.builder.compile.assert_called_once_with('b')
+
+    def test_real_expression_evaluated_per_get(self):
+        first = self.cache.get(xg.UserExpression, 'len')
+        second = self.cache.get(xg.UserExpression, 'len')
+        self.assertIsNot(first, second)
+        self.assertEqual(second('abc'), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
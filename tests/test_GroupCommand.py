@@ -29,8 +29,8 @@ class GroupCommandTestCase(unittest.TestCase):
         self.assertIsNot(gcmd.command('t'), gcmd.command('t'))
 
     def test_key_string(self, subcommand=['echo', '{}'], expected=['echo', 'key'],
-                        key_string='{}', group_key='key'):
-        gcmd = xg.GroupCommand(subcommand, key_string)
+                        key_string='{}', group_key='key', encoding='utf-8'):
+        gcmd = xg.GroupCommand(subcommand, key_string, encoding)
         self.assertEqual(gcmd.command(group_key), expected)
 
     def test_key_string_ending(self):
@@ -45,3 +45,10 @@ class GroupCommandTestCase(unittest.TestCase):
 
     def test_one_char_key_string(self):
         self.test_key_string(['echo', '!!'], ['echo', 'keykey'], '!')
+
+    def test_bytes_key(self):
+        self.test_key_string(['echo', '<{}>'], ['echo', '<key>'], group_key=b'key')
+
+    def test_bytes_key_encoding(self):
+        self.test_key_string(['echo', '<{}>'], ['echo', '<caf\xe9>'],
+                             group_key='caf\xe9'.encode('latin-1'), encoding='latin-1')
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+import xargs_groupby as xg
+
+class InputKeysTestCase(unittest.TestCase):
+    def test_split_text_record(self):
+        input_keys = xg.InputKeys('\t', 'utf-8')
+        self.assertEqual(input_keys.split_record('k\ta\tb'), ('k', 'a\tb'))
+
+    def test_split_bytes_record(self):
+        input_keys = xg.InputKeys('→', 'utf-8')
+        self.assertEqual(input_keys.split_record('k→a'.encode('utf-8')), (b'k', b'a'))
+
+    def test_split_mapped_record(self):
+        input_keys = xg.InputKeys('::', 'utf-8')
+        key, arg = input_keys.split_record(xg.MappedArg(b'key::arg', 10))
+        self.assertEqual((key, arg, arg.offset), (b'key', b'arg', 15))
+
+    def test_empty_key(self):
+        input_keys = xg.InputKeys(',', 'utf-8')
+        self.assertEqual(input_keys.split_record(',a'), ('', 'a'))
+
+    def test_missing_separator(self):
+        input_keys = xg.InputKeys('\t', 'utf-8')
+        with self.assertRaises(xg.UserArgumentsError) as exc_check:
+            input_keys.split_record(b'no key')
+        self.assertIn("'no key'", exc_check.exception.args[0])
+
+
+class KeyedInputPrepperTestCase(unittest.TestCase):
+    RECORDS = ['s1\ta', 's2\tb', 's1\tc']
+    EXPECTED = {'s1': [b'a', b'c'], 's2': [b'b']}
+
+    def test_prepper_groups_by_input_keys(self):
+        prepper = xg.InputPrepper(xg.InputKeys('\t', 'utf-8'), None, 'utf-8')
+        prepper.add(self.RECORDS)
+        self.assertEqual({key: prepper[key] for key in prepper}, self.EXPECTED)
+
+    def test_bytes_records_get_text_keys(self):
+        prepper = xg.InputPrepper(xg.InputKeys('\t', 'utf-8'), None, 'utf-8')
+        prepper.add([record.encode('utf-8') for record in self.RECORDS])
+        self.assertEqual({key: prepper[key] for key in prepper}, self.EXPECTED)
+
+    def test_bytes_keys(self):
+        prepper = xg.InputPrepper(xg.InputKeys('\t', 'utf-8'), None, 'utf-8',
+                                  decode_args=False)
+        prepper.add(self.RECORDS)
+        self.assertEqual(sorted(prepper), [b's1', b's2'])
+
+    def test_delimiter_excludes_only_arguments(self):
+        prepper = xg.InputPrepper(xg.InputKeys('\0', 'latin-1'), None, 'latin-1')
+        prepper.add(['k\0a'])
+        self.assertEqual(prepper['k'], [b'a'])
+        self.assertEqual(prepper.delimiter(), b'\0'[0])
+
+    def test_sorted_prepper(self):
+        prepper = xg.SortedInputPrepper(xg.InputKeys('\t', 'utf-8'), None, 'utf-8',
+                                        on_repeat='rerun')
+        prepper.add(self.RECORDS)
+        actual = [(key, prepper[key]) for key in prepper]
+        self.assertEqual(actual, [('s1', [b'a']), ('s2', [b'b']), ('s1', [b'c'])])
+
+    def test_streaming_prepper(self):
+        prepper = xg.StreamingInputPrepper(xg.InputKeys('\t', 'utf-8'), None, 'utf-8')
+        prepper.add(self.RECORDS)
+        keys = list(prepper)
+        self.assertEqual(keys, ['s1', 's2'])
+        self.assertEqual({key: list(prepper[key]) for key in keys}, self.EXPECTED)
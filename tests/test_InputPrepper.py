@@ -11,6 +11,7 @@ import unittest
 from operator import itemgetter, methodcaller
 
 import xargs_groupby as xg
+from . import mock
 
 class InputPrepperTestCase(unittest.TestCase):
     ENCODING = 'latin-1'
@@ -93,3 +94,194 @@ class InputPrepperTestCase(unittest.TestCase):
             delimiter = prepper.delimiter(key)
             bad_range = self.USABLE_DELIMITER_BYTES[width * index:width * (index + 1)]
             self.assertNotIn(delimiter, bad_range)
+
+    def test_bytes_args_stored_as_is(self):
+        keys = []
+        prepper = self.InputPrepper(lambda s: keys.append(s) or s[0], encoding='utf-8')
+        prepper.add([b'\xc3\xa4b', b'\xffc'])
+        self.assertPrepperHasExactly(prepper, {
+            'ä': [b'\xc3\xa4b'],
+            '\udcff': [b'\xffc'],
+        })
+        self.assertEqual(keys, ['äb', '\udcffc'])
+
+    def test_bytes_args_not_decoded(self):
+        prepper = xg.InputPrepper(lambda b: b[:1], None, 'utf-8', decode_args=False)
+        prepper.add([b'\xffa', b'\xffb', b'c'])
+        self.assertPrepperHasExactly(prepper, {
+            b'\xff': [b'\xffa', b'\xffb'],
+            b'c': [b'c'],
+        })
+
+    def test_text_args_encoded_for_group(self):
+        prepper = xg.InputPrepper(lambda b: b[:2], None, 'utf-8', decode_args=False)
+        prepper.add(['äa'])
+        self.assertPrepperHasExactly(prepper, {b'\xc3\xa4': [b'\xc3\xa4a']})
+
+    def test_merge_groups(self):
+        prepper = self.InputPrepper(methodcaller('lower'))
+        prepper.add(['a', 'B'])
+        other = self.InputPrepper(methodcaller('lower'))
+        other.add(['A', 'c'])
+        prepper.merge(*other.export())
+        self.assertPrepperHasExactly(prepper, {
+            'a': [b'a', b'A'],
+            'b': [b'B'],
+            'c': [b'c'],
+        })
+        self.assertEqual(list(prepper), ['a', 'b', 'c'])
+
+    def test_merge_delimiter_state(self):
+        prepper = self.InputPrepper()
+        prepper.add([self.USABLE_DELIMITERS[:-2]])
+        other = self.InputPrepper()
+        other.add([self.USABLE_DELIMITERS[-2]])
+        prepper.merge(*other.export())
+        self.assertEqual(prepper.delimiter(), bytes(self.USABLE_DELIMITER_BYTES)[-1])
+
+    def test_merge_switches_to_delimiter_per_group(self):
+        width = 128
+        inputs = [self.USABLE_DELIMITERS[:width], self.USABLE_DELIMITERS[width:]]
+        prepper = self.InputPrepper()
+        prepper.add(inputs[:1])
+        other = self.InputPrepper()
+        other.add(inputs[1:])
+        prepper.merge(*other.export())
+        with self.assertRaises(ValueError):
+            prepper.delimiter()
+        for index, key in enumerate(inputs):
+            delimiter = prepper.delimiter(key)
+            bad_range = self.USABLE_DELIMITER_BYTES[width * index:width * (index + 1)]
+            self.assertNotIn(delimiter, bad_range)
+
+    def test_merge_from_prepper_with_delimiter_per_group(self):
+        width = 128
+        inputs = [self.USABLE_DELIMITERS[:width], self.USABLE_DELIMITERS[width:]]
+        prepper = self.InputPrepper()
+        prepper.add(['\0'])
+        other = self.InputPrepper()
+        other.add(inputs)
+        prepper.merge(*other.export())
+        self.assertNotEqual(prepper.delimiter('\0'), b'\0'[0])
+        self.assertNotIn(prepper.delimiter(inputs[1]), self.USABLE_DELIMITER_BYTES[width:])
+
+    def test_merge_without_rescan(self):
+        prepper = self.InputPrepper(lambda s: s[0])
+        prepper.add(['ab'])
+        other = self.InputPrepper(lambda s: s[0])
+        other.add(['ac', 'bd', 'ae', 'bf'])
+        with mock.patch.object(prepper, '_exclude_delimiter',
+                               wraps=prepper._exclude_delimiter) as exclude:
+            prepper.merge(*other.export())
+        self.assertEqual(exclude.call_count, 2)
+        self.assertEqual(prepper.delimiter(), b'\0'[0])
+        self.assertNotIn(prepper.delimiter('a'), b'abce')
+
+    def test_merge_error_when_group_covers_all_bytes(self):
+        prepper = self.InputPrepper(lambda s: 'key')
+        prepper.add([self.USABLE_DELIMITERS[:-1]])
+        other = self.InputPrepper(lambda s: 'key')
+        other.add([self.USABLE_DELIMITERS[-1]])
+        with self.assertRaises(xg.UserArgumentsError):
+            prepper.merge(*other.export())
+
+
+class DelimiterFinderTestCase(unittest.TestCase):
+    ALL_BYTES = bytes(bytearray(range(256)))
+
+    def test_lowest_absent_byte(self):
+        finder = xg.InputPrepper.DelimiterFinder()
+        self.assertEqual(finder.delimiter(), self.ALL_BYTES[0])
+        finder.exclude(self.ALL_BYTES[:10])
+        self.assertEqual(finder.delimiter(), self.ALL_BYTES[10])
+
+    def test_update_returns_new_bytes(self):
+        finder = xg.InputPrepper.DelimiterFinder()
+        self.assertEqual(finder.update(b'abca'), b'abca')
+        self.assertEqual(finder.update(b'cabd'), b'd')
+        self.assertEqual(finder.update(b'dcba'), b'')
+
+    def test_repeated_bytes_not_full(self):
+        finder = xg.InputPrepper.DelimiterFinder()
+        for index in range(255):
+            finder.exclude(self.ALL_BYTES[index:index + 1] * 3)
+        self.assertEqual(finder.delimiter(), self.ALL_BYTES[255])
+
+    def test_error_when_full(self):
+        finder = xg.InputPrepper.DelimiterFinder()
+        finder.exclude(self.ALL_BYTES[128:] * 2)
+        with self.assertRaises(xg.UserArgumentsError):
+            finder.exclude(self.ALL_BYTES[:128])
+
+    def test_update_when_full(self):
+        finder = xg.InputPrepper.DelimiterFinder()
+        finder.update(self.ALL_BYTES)
+        self.assertIsNone(finder.delimiter())
+
+
+class BatchGroupFunction(object):
+    BATCH_SIZE = 3
+
+    def __init__(self):
+        self.batches = []
+
+    def __call__(self, arg):
+        raise AssertionError("group function called with one argument")
+
+    def group_keys(self, args):
+        self.batches.append(args)
+        return [arg[:1] for arg in args]
+
+
+class BatchInputPrepperTestCase(unittest.TestCase):
+    ARGS = ['ab', 'b', 'ac', 'bd', 'a', 'c', 'ae']
+    EXPECTED = {
+        'a': [b'ab', b'ac', b'a', b'ae'],
+        'b': [b'b', b'bd'],
+        'c': [b'c'],
+    }
+
+    def test_add_in_batches(self):
+        group_func = BatchGroupFunction()
+        prepper = xg.InputPrepper(group_func, None, 'utf-8')
+        prepper.add(self.ARGS)
+        self.assertEqual({key: prepper[key] for key in prepper}, self.EXPECTED)
+        self.assertEqual(group_func.batches,
+                         [self.ARGS[:3], self.ARGS[3:6], self.ARGS[6:]])
+
+    def test_batches_get_bytes(self):
+        group_func = BatchGroupFunction()
+        prepper = xg.InputPrepper(group_func, None, 'utf-8', decode_args=False)
+        prepper.add(['a', b'b'])
+        self.assertEqual(group_func.batches, [[b'a', b'b']])
+
+    def test_bytes_batches_decoded(self):
+        group_func = BatchGroupFunction()
+        prepper = xg.InputPrepper(group_func, None, 'utf-8')
+        prepper.add([b'a\xc3\xa9', b'b\xff'])
+        self.assertEqual(group_func.batches, [['a\xe9', b'b\xff'.decode('utf-8', xg.DECODE_ERRORS)]])
+        self.assertEqual(prepper['a'], [b'a\xc3\xa9'])
+        self.assertEqual(prepper['b'], [b'b\xff'])
+
+    def test_mixed_batches(self):
+        group_func = BatchGroupFunction()
+        prepper = xg.InputPrepper(group_func, None, 'utf-8')
+        prepper.add(['ab', b'b', 'ac'])
+        self.assertEqual(group_func.batches, [['ab', 'b', 'ac']])
+        self.assertEqual(prepper['a'], [b'ab', b'ac'])
+
+    def test_sorted_prepper_batches(self):
+        group_func = BatchGroupFunction()
+        prepper = xg.SortedInputPrepper(group_func, None, 'utf-8', on_repeat='rerun')
+        prepper.add(['a1', 'a2', 'b1', 'a3'])
+        actual = [(key, prepper[key]) for key in prepper]
+        self.assertEqual(actual, [('a', [b'a1', b'a2']), ('b', [b'b1']), ('a', [b'a3'])])
+        self.assertEqual(len(group_func.batches), 2)
+
+    def test_streaming_prepper_batches(self):
+        group_func = BatchGroupFunction()
+        prepper = xg.StreamingInputPrepper(group_func, None, 'utf-8')
+        prepper.add(self.ARGS)
+        keys = list(prepper)
+        self.assertEqual(keys, ['a', 'b', 'c'])
+        self.assertEqual({key: list(prepper[key]) for key in keys}, self.EXPECTED)
@@ -7,6 +7,7 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import io
+import random
 import unittest
 
 import xargs_groupby as xg
@@ -55,5 +56,109 @@ class InputShlexerTestCase(unittest.TestCase):
     def test_eof_before_escaped_newline_treated_literally(self):
         self.assertTokensFrom('a\nEOF\\\nb', ['a', 'EOF\nb'], 'EOF')
 
+    def test_long_line_read_in_pieces(self):
+        source = ' '.join('arg{}'.format(n) for n in range(1000))
+        in_stream = io.StringIO(source)
+        in_stream.readline = mock.Mock(wraps=in_stream.readline)
+        shlexer = xg.InputShlexer(in_stream, None)
+        shlexer.READ_SIZE = 64
+        self.assertEqual(list(shlexer), source.split())
+        for call in in_stream.readline.call_args_list:
+            self.assertEqual(call[0], (64,))
+
+    def test_long_quoted_line_read_in_pieces(self, read_size=16):
+        source = 'a "b c" d\\ e ' * 30 + '"unclosed\nf g\\'
+        shlexer = xg.InputShlexer(io.StringIO(source), None)
+        shlexer.READ_SIZE = read_size
+        self.assertEqual(list(shlexer), ['a', 'b c', 'd e'] * 30 + ['f', 'g'])
+
     def test_eof_after_escaped_newline_treated_literally(self):
         self.assertTokensFrom('a\\\nEOF\nb', ['a\nEOF', 'b'], 'EOF')
+
+
+class SlowInputShlexer(xg.InputShlexer):
+    # The original implementation: read whole lines, and tokenize them
+    # all with shlex.
+    def __iter__(self):
+        pre_lines = []
+        for line in self.in_stream:
+            if line.endswith('\\\n'):
+                pre_lines.append(line)
+                continue
+            elif pre_lines:
+                pre_lines.append(line)
+                line = ''.join(pre_lines)
+                pre_lines = []
+            if line == self.eof_line:
+                break
+            for token in self._shlex_tokens(line):
+                yield token
+        for token in self._shlex_tokens(''.join(pre_lines)):
+            yield token
+
+
+class InputShlexerFastPathTestCase(unittest.TestCase):
+    # Generate lots of random input, and check that the str.split() fast path
+    # gives the same results as running everything through shlex.
+    CHARS = ['a', 'b', 'E', 'O', 'F', ' ', '  ', '\t', '\r', '\n', '\n',
+             '\\', '\\\n', "'", '"', '\x0b', '\x0c', '\x1c', '\x85',
+             '\u3000', '→', '\0', 'EOF\n']
+    EOF_STRS = [None, 'EOF', 'a']
+
+    def setUp(self):
+        self.random = random.Random(8008)
+
+    def random_source(self, max_len=40):
+        return ''.join(self.random.choice(self.CHARS)
+                       for _ in range(self.random.randint(0, max_len)))
+
+    def assertSameTokens(self, source, eof_str, read_size=None):
+        shlexer = xg.InputShlexer(io.StringIO(source), eof_str)
+        if read_size is not None:
+            shlexer.READ_SIZE = read_size
+        fast_tokens = list(shlexer)
+        slow_tokens = list(SlowInputShlexer(io.StringIO(source), eof_str))
+        self.assertEqual(fast_tokens, slow_tokens,
+                         "tokens differ for {!r} with eof_str {!r}".format(
+                             source, eof_str))
+
+    def test_random_input(self):
+        for _ in range(2000):
+            self.assertSameTokens(self.random_source(),
+                                  self.random.choice(self.EOF_STRS))
+
+    def test_random_input_without_specials(self):
+        self.CHARS = [c for c in self.CHARS if not any(s in c for s in '\\\'"')]
+        for _ in range(500):
+            self.assertSameTokens(self.random_source(),
+                                  self.random.choice(self.EOF_STRS))
+
+    def test_random_input_small_reads(self):
+        for _ in range(2000):
+            self.assertSameTokens(self.random_source(80),
+                                  self.random.choice(self.EOF_STRS),
+                                  self.random.randint(1, 12))
+
+    def test_random_long_tokens_small_reads(self):
+        self.CHARS = ['a', 'b', 'c', ' ', '\n', '\\', '"']
+        self.CHARS.extend(['word'] * 20)
+        for _ in range(500):
+            self.assertSameTokens(self.random_source(60), None,
+                                  self.random.randint(1, 6))
+
+    def test_fast_path_used_for_plain_lines(self):
+        shlexer = xg.InputShlexer(io.StringIO(), None)
+        self.assertIsNone(shlexer._needs_shlex('a b\tc\r\n'))
+        for char in ['\\', "'", '"', '\x0b', '\u3000']:
+            self.assertTrue(shlexer._needs_shlex('a{}b\n'.format(char)))
+
+    def test_args_ready(self):
+        shlexer = xg.InputShlexer(io.StringIO('a b\nc\n'), None)
+        tokens = iter(shlexer)
+        self.assertFalse(shlexer.args_ready())
+        self.assertEqual(next(tokens), 'a')
+        self.assertTrue(shlexer.args_ready())
+        self.assertEqual(next(tokens), 'b')
+        self.assertFalse(shlexer.args_ready())
+        self.assertEqual(next(tokens), 'c')
+        self.assertFalse(shlexer.args_ready())
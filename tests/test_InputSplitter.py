@@ -25,10 +25,14 @@ class InputSplitterCharacterTestCase(unittest.TestCase):
             delimiter = self.DELIMITER
         if source is None:
             source = self.source_from_tokens(expected, delimiter)
-        in_stream = io.StringIO(source)
+        in_stream = self.stream_type(source)
         splitter = xg.InputSplitter(in_stream, delimiter)
         self.assertEqual(list(splitter), expected)
 
+    @staticmethod
+    def stream_type(source):
+        return io.StringIO(source)
+
     # These test cases represent xargs' observed behavior.  Try:
     # echo -en 'STR' | xargs -d DELIM python3 -c 'import sys; print(sys.argv)'
 
@@ -77,3 +81,81 @@ class InputSplitterMultiCharacterTestCase(InputSplitterCharacterTestCase):
 
     def test_splits_with_partial_overlap(self):
         self.assertTokens(['AAB', 'ADAAB' 'AD'])
+
+    def test_splits_across_reads(self):
+        with mock.patch.object(xg.InputSplitter, 'READ_SIZE', 3):
+            self.assertTokens(['AAB', 'A', 'CCA', 'BA'])
+
+
+class InputSplitterBytesTestCase(InputSplitterCharacterTestCase):
+    DELIMITER = b'\0'
+
+    @staticmethod
+    def stream_type(source):
+        return io.BytesIO(source)
+
+    def source_from_tokens(self, tokens, delimiter=None):
+        if delimiter is None:
+            delimiter = self.DELIMITER
+        return delimiter.join(tokens)
+
+    def test_easy_split(self):
+        self.assertTokens([b'foo', b'bar', b'baz'])
+
+    def test_no_delimiter(self):
+        self.assertTokens([b'A' * 50])
+
+    def test_whitespace_not_special(self):
+        self.assertTokens([b'one two', b'three\tfour', b'five\nsix'])
+
+    def test_adjacent_delimiters(self):
+        self.assertTokens([b'quux', b'', b'qix', b'', b'quack'])
+
+    def test_leading_delimiter(self):
+        self.assertTokens([b'', b'one', b'two'])
+
+    def test_trailing_delimiter(self):
+        expected = [b'penultimate', b'ultimate']
+        source = self.source_from_tokens(expected) + self.DELIMITER
+        self.assertTokens(expected, source)
+
+    def test_undecodable_bytes(self):
+        self.assertTokens([b'\xff\xfe', b'\x80'])
+
+
+class InputSplitterMultiByteDelimiterTestCase(InputSplitterBytesTestCase):
+    DELIMITER = '♥'.encode('utf-8')
+
+    def test_splits_across_reads(self):
+        with mock.patch.object(xg.InputSplitter, 'READ_SIZE', 2):
+            self.assertTokens([b'ab', b'c', b'def'])
+
+
+class InputSplitterStreamingTestCase(unittest.TestCase):
+    def test_reads_available_input(self):
+        in_stream = mock.Mock(name='in_stream')
+        in_stream.read1.side_effect = [b'a\nb', b'\n', b'']
+        self.assertEqual(list(xg.InputSplitter(in_stream, b'\n')), [b'a', b'b'])
+        in_stream.read1.assert_called_with(xg.InputSplitter.READ_SIZE)
+        self.assertFalse(in_stream.read.called)
+
+    def test_args_ready(self):
+        splitter = xg.InputSplitter(io.BytesIO(b'a\nb\nc'), b'\n')
+        args = iter(splitter)
+        self.assertFalse(splitter.args_ready())
+        with mock.patch.object(xg.InputSplitter, 'READ_SIZE', 4):
+            self.assertEqual(next(args), b'a')
+            self.assertTrue(splitter.args_ready())
+            self.assertEqual(next(args), b'b')
+            self.assertFalse(splitter.args_ready())
+            self.assertEqual(next(args), b'c')
+            self.assertFalse(splitter.args_ready())
+
+    def test_input_fd(self):
+        in_stream = mock.Mock(name='in_stream')
+        in_stream.fileno.return_value = 5
+        self.assertEqual(xg.InputSplitter(in_stream, b'\n').input_fd(), 5)
+
+    def test_no_input_fd_without_read1(self):
+        splitter = xg.InputSplitter(io.StringIO('a\n'), '\n')
+        self.assertIsNone(splitter.input_fd())
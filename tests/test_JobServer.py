@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+import xargs_groupby as xg
+from . import mock
+
+class JobServerRequestTestCase(unittest.TestCase):
+    def test_request_round_trip(self, cwd=b'/tmp', arglist=[b'len', b'echo', b''],
+                                environ={b'HOME': b'/root', b'EQ': b'a=b'}):
+        header, payload = xg.JobServer.encode_request(cwd, arglist, environ)
+        self.assertEqual(xg.JobServer.HEADER.unpack(header)[0], len(payload))
+        self.assertEqual(xg.JobServer.decode_request(payload), (cwd, arglist, environ))
+
+    def test_request_no_environment(self):
+        self.test_request_round_trip(environ={})
+
+    def test_request_no_arguments(self):
+        self.test_request_round_trip(arglist=[])
+
+    def test_request_missing_fields(self):
+        with self.assertRaises(ValueError):
+            xg.JobServer.decode_request(b'/tmp')
+
+    def test_request_bad_count(self):
+        with self.assertRaises(ValueError):
+            xg.JobServer.decode_request(b'/tmp\0two\0len')
+
+    def test_request_too_few_arguments(self):
+        with self.assertRaises(ValueError):
+            xg.JobServer.decode_request(b'/tmp\x003\0len\0echo')
+
+    def test_request_bad_environment(self):
+        with self.assertRaises(ValueError):
+            xg.JobServer.decode_request(b'/tmp\x001\0len\0HOME')
+
+
+class JobServerWarmTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = xg.JobServer('/nonexistent/xg.sock', 1)
+        self.server.expression_cache = mock.Mock(name='ExpressionCache')
+
+    def test_warm_compiles_group_code(self):
+        self.server._warm(['len', 'echo'])
+        self.server.expression_cache.compile.assert_called_once_with(
+            xg.UserExpression, 'len')
+
+    def test_warm_batch_group_code(self):
+        self.server._warm(['--batch-group-code', 'len', 'echo'])
+        self.server.expression_cache.compile.assert_called_once_with(
+            xg.BatchUserExpression, 'len')
+
+    def test_warm_does_not_evaluate(self):
+        self.server.expression_cache = xg.ExpressionCache()
+        self.server._warm(['{}["x"].get', 'echo'])
+        self.server._warm(['json.load(io.open("nonexistent.json")).get', 'echo'])
+
+    def test_warm_ignores_compile_errors(self):
+        self.server.expression_cache.compile.side_effect = ValueError
+        self.server._warm(['len', 'echo'])
+
+    def test_warm_ignores_bad_arguments(self):
+        self.server._warm(['--nonexistent-option'])
+        self.server.expression_cache.compile.assert_not_called()
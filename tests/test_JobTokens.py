@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+import xargs_groupby as xg
+
+class JobTokensTestCase(unittest.TestCase):
+    def setUp(self):
+        self.job_tokens = xg.JobTokens(2)
+
+    def tearDown(self):
+        self.job_tokens.close()
+
+    def test_take_up_to_count(self):
+        self.assertTrue(self.job_tokens.take())
+        self.assertTrue(self.job_tokens.take(block=True))
+        self.assertFalse(self.job_tokens.take())
+        self.assertEqual(self.job_tokens.held, 2)
+
+    def test_put_returns_token(self):
+        self.test_take_up_to_count()
+        self.job_tokens.put()
+        self.assertEqual(self.job_tokens.held, 1)
+        self.assertTrue(self.job_tokens.take())
+        self.assertFalse(self.job_tokens.take())
+
+    def test_put_all(self):
+        self.test_take_up_to_count()
+        self.job_tokens.put_all()
+        self.assertEqual(self.job_tokens.held, 0)
+        self.test_take_up_to_count()
+
+    def test_put_all_none_held(self):
+        self.job_tokens.put_all()
+        self.test_take_up_to_count()
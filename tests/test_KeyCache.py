@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import xargs_groupby as xg
+from . import mock
+from .helpers import ExceptionWrapperTestHelper
+
+class KeyCacheTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='xgtest')
+        self.db_path = os.path.join(self.tmpdir, 'keys.db')
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def group_func(self, arg):
+        self.calls.append(arg)
+        return len(arg)
+
+    def batch_func(self, args):
+        self.calls.extend(args)
+        return list(map(len, args))
+
+    def run_cache(self, args, code_s='len', wrap_name='wrap', func=None):
+        if func is None:
+            func = self.group_func if (wrap_name == 'wrap') else self.batch_func
+        key_cache = xg.KeyCache(self.db_path, code_s)
+        func = getattr(key_cache, wrap_name)(func)
+        if wrap_name == 'wrap':
+            keys = list(map(func, args))
+        else:
+            keys = func(args)
+        key_cache.close()
+        return key_cache, keys
+
+    def test_keys_reused_across_runs(self):
+        self.run_cache(['a', 'bb'])
+        del self.calls[:]
+        key_cache, keys = self.run_cache(['bb', 'a', 'ccc'])
+        self.assertEqual(keys, [2, 1, 3])
+        self.assertEqual(self.calls, ['ccc'])
+        self.assertEqual((key_cache.hits, key_cache.misses), (2, 1))
+
+    def test_keys_reused_within_run(self):
+        key_cache, keys = self.run_cache(['a', 'a', 'a'])
+        self.assertEqual(keys, [1, 1, 1])
+        self.assertEqual(self.calls, ['a'])
+
+    def test_keys_separate_by_code(self):
+        self.run_cache(['a'], 'len')
+        del self.calls[:]
+        self.run_cache(['a'], 'lambda s: len(s)')
+        self.assertEqual(self.calls, ['a'])
+
+    def test_bytes_and_str_args_separate(self):
+        self.run_cache(['a'])
+        del self.calls[:]
+        self.run_cache([b'a'])
+        self.assertEqual(self.calls, [b'a'])
+
+    def test_undecodable_arg(self):
+        arg = b'a\xff'.decode('utf-8', xg.DECODE_ERRORS)
+        self.run_cache([arg])
+        del self.calls[:]
+        _, keys = self.run_cache([arg])
+        self.assertEqual(keys, [len(arg)])
+        self.assertEqual(self.calls, [])
+
+    def test_changed_file_regrouped(self):
+        file_path = os.path.join(self.tmpdir, 'arg')
+        with open(file_path, 'w') as arg_file:
+            arg_file.write('a')
+        self.run_cache([file_path])
+        with open(file_path, 'w') as arg_file:
+            arg_file.write('abc')
+        del self.calls[:]
+        key_cache, _ = self.run_cache([file_path])
+        self.assertEqual(self.calls, [file_path])
+        self.assertEqual(key_cache.misses, 1)
+
+    def test_unchanged_file_reused(self):
+        file_path = os.path.join(self.tmpdir, 'arg')
+        with open(file_path, 'w') as arg_file:
+            arg_file.write('a')
+        self.run_cache([file_path])
+        del self.calls[:]
+        self.run_cache([file_path])
+        self.assertEqual(self.calls, [])
+
+    def test_unpicklable_keys_not_stored(self):
+        func = lambda arg: self.group_func(arg) and (lambda: arg)
+        self.run_cache(['a'], func=func)
+        del self.calls[:]
+        self.run_cache(['a'], func=func)
+        self.assertEqual(self.calls, ['a'])
+
+    def test_group_errors_propagate(self):
+        key_cache = xg.KeyCache(self.db_path, 'int')
+        func = key_cache.wrap(int)
+        with self.assertRaises(ValueError):
+            func('x')
+        key_cache.close()
+
+    def test_flushes_in_batches(self):
+        with mock.patch.object(xg.KeyCache, 'FLUSH_SIZE', 2):
+            key_cache = xg.KeyCache(self.db_path, 'len')
+            func = key_cache.wrap(self.group_func)
+            for arg in ['a', 'bb', 'ccc']:
+                func(arg)
+            db = sqlite3.connect(self.db_path)
+            try:
+                self.assertEqual(
+                    db.execute("SELECT COUNT(*) FROM group_keys").fetchone()[0], 2)
+            finally:
+                db.close()
+            key_cache.close()
+
+    def test_batch_only_misses_computed(self):
+        self.run_cache(['a', 'ccc'], wrap_name='wrap_batch')
+        del self.calls[:]
+        key_cache, keys = self.run_cache(['a', 'bb', 'ccc', 'dddd'], wrap_name='wrap_batch')
+        self.assertEqual(keys, [1, 2, 3, 4])
+        self.assertEqual(self.calls, ['bb', 'dddd'])
+
+    def test_batch_all_hits(self):
+        self.run_cache(['a', 'bb'], wrap_name='wrap_batch')
+        del self.calls[:]
+        _, keys = self.run_cache(['bb', 'a'], wrap_name='wrap_batch')
+        self.assertEqual(keys, [2, 1])
+        self.assertEqual(self.calls, [])
+
+    def test_batch_wrong_key_count_passed_through(self):
+        self.run_cache(['a'], wrap_name='wrap_batch')
+        _, keys = self.run_cache(['a', 'bb', 'ccc'], wrap_name='wrap_batch',
+                                 func=lambda args: [1])
+        self.assertEqual(keys, [1])
+
+    def test_open_error(self):
+        bad_path = os.path.join(self.tmpdir, 'nonexistent', 'keys.db')
+        with self.assertRaisesWrapped(sqlite3.Error, xg.UserKeyCacheError, bad_path):
+            xg.KeyCache(bad_path, 'len')
+
+    def test_database_error_raised_from_close(self):
+        key_cache = xg.KeyCache(self.db_path, 'len')
+        func = key_cache.wrap(self.group_func)
+        key_cache._db.execute("DROP TABLE group_keys")
+        self.assertEqual(func('ab'), 2)
+        self.assertEqual(func('ab'), 2)
+        self.assertEqual(len(self.calls), 2)
+        with self.assertRaisesWrapped(sqlite3.Error, xg.UserKeyCacheError, self.db_path):
+            key_cache.close()
+
+
+class UserExpressionKeyCacheTestCase(unittest.TestCase):
+    def test_use_key_cache(self):
+        key_cache = mock.Mock(name='KeyCache')
+        expr = xg.UserExpression('_.upper()')
+        orig_func = expr.func
+        expr.use_key_cache(key_cache)
+        key_cache.wrap.assert_called_with(orig_func)
+        self.assertIs(expr.func, key_cache.wrap())
+
+    def test_batch_use_key_cache(self):
+        key_cache = mock.Mock(name='KeyCache')
+        expr = xg.BatchUserExpression('lambda args: args')
+        orig_func = expr.func
+        expr.use_key_cache(key_cache)
+        key_cache.wrap_batch.assert_called_with(orig_func)
+        self.assertIs(expr.func, key_cache.wrap_batch())
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import random
+import re
+import unittest
+
+import xargs_groupby as xg
+from . import mock
+from .helpers import ExceptionWrapperTestHelper
+
+class KeyExtractorTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
+    # Each extractor should give the same keys as this group code.
+    EQUIVALENT_CODE = {
+        'dirname': 'os.path.dirname',
+        'ext': 'lambda p: os.path.splitext(p)[1]',
+        'component:1': 'lambda p: p.split("/")[1]',
+        'component:-2': 'lambda p: p.split("/")[-2]',
+        'field:.:0': 'lambda p: p.split(".")[0]',
+        'field:a.:-1': 'lambda p: p.split("a.")[-1]',
+        'regex:a(b*)': 'lambda p: re.search("a(b*)", p).group(1)',
+        'regex:[.]a*': 'lambda p: re.search("[.]a*", p).group(0)',
+    }
+    PATH_CHARS = '/.ab\n'
+
+    def random_args(self, count=2000, seed=8018):
+        rng = random.Random(seed)
+        args = []
+        for _ in range(count):
+            length = rng.randint(0, 10)
+            args.append(''.join(rng.choice(self.PATH_CHARS) for _ in range(length)))
+        return args
+
+    @staticmethod
+    def expected_key(expr, arg):
+        try:
+            return expr.func(arg)
+        except Exception:
+            return Exception
+
+    def assertSameKeys(self, spec, group_bytes=False):
+        args = self.random_args()
+        if group_bytes:
+            args = [arg.encode('utf-8') for arg in args]
+        extractor = xg.KeyExtractor(spec, group_bytes, 'utf-8')
+        code_s = self.EQUIVALENT_CODE[spec]
+        if group_bytes:
+            code_s = re.sub(r'("[^"]*")', r'b\1', code_s)
+        expr = xg.UserExpression(code_s)
+        for arg in args:
+            try:
+                key = extractor(arg)
+            except xg.UserExpressionRuntimeError:
+                key = Exception
+            self.assertEqual(key, self.expected_key(expr, arg),
+                             "{} key for {!r}".format(spec, arg))
+        keyable_args = [arg for arg in args if self.expected_key(expr, arg) is not Exception]
+        self.assertEqual(extractor.group_keys(keyable_args),
+                         list(map(expr.func, keyable_args)))
+
+    for spec in EQUIVALENT_CODE:
+        def same_keys_test(self, spec=spec):
+            self.assertSameKeys(spec)
+        def same_bytes_keys_test(self, spec=spec):
+            self.assertSameKeys(spec, True)
+        test_name = 'test_same_keys_' + spec.partition(':')[0]
+        while test_name in locals():
+            test_name += '_'
+        locals()[test_name] = same_keys_test
+        locals()[test_name.replace('_keys_', '_bytes_keys_')] = same_bytes_keys_test
+    del same_keys_test, same_bytes_keys_test, spec, test_name
+
+    def test_regex_no_match_error(self):
+        extractor = xg.KeyExtractor('regex:b')
+        with self.assertRaisesWrapped(ValueError, xg.UserExpressionRuntimeError, 'ac'):
+            extractor.group_keys(['ab', 'ac', 'bc'])
+
+    def test_missing_field_error(self):
+        extractor = xg.KeyExtractor('field:,:2')
+        with self.assertRaisesWrapped(IndexError, xg.UserExpressionRuntimeError, 'a,b'):
+            extractor.group_keys(['a,b,c', 'a,b', 'd'])
+
+    def test_use_key_cache(self):
+        key_cache = mock.Mock(name='KeyCache')
+        extractor = xg.KeyExtractor('dirname')
+        orig_func = extractor.func
+        extractor.use_key_cache(key_cache)
+        key_cache.wrap_batch.assert_called_with(orig_func)
+
+    def test_prepper_groups(self):
+        prepper = xg.InputPrepper(xg.KeyExtractor('ext'), None, 'utf-8')
+        prepper.add(['a.py', 'b.txt', 'c.py'])
+        self.assertEqual(list(prepper['.py']), [b'a.py', b'c.py'])
+        self.assertEqual(list(prepper['.txt']), [b'b.txt'])
+
+
+class KeyExtractorSpecTestCase(unittest.TestCase):
+    def test_parse_spec(self):
+        for spec, expected in [
+                ('dirname', ('dirname', ())),
+                ('ext', ('ext', ())),
+                ('component:-1', ('component', ('/', -1))),
+                ('field:\t:3', ('field', ('\t', 3))),
+                ('field::::1', ('field', ('::', 1))),
+                ('regex:a:(b)', ('regex', ('a:(b)',))),
+        ]:
+            self.assertEqual(xg.KeyExtractor.parse_spec(spec), expected)
+
+    def test_bad_specs(self):
+        for spec in ['basename', 'dirname:1', 'component', 'component:x',
+                     'field:2', 'field:,:x', 'regex:(a)(b)']:
+            with self.assertRaises(ValueError, msg=spec):
+                xg.KeyExtractor.parse_spec(spec)
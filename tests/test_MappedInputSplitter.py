@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import functools
+import mmap
+import pickle
+import tempfile
+import unittest
+
+import xargs_groupby as xg
+from . import mock
+
+class MappedInputSplitterTestCase(unittest.TestCase):
+    DELIMITER = b'\0'
+
+    def setUp(self):
+        self.tempfile = tempfile.TemporaryFile(prefix='xgtest')
+
+    def tearDown(self):
+        self.tempfile.close()
+
+    def mapping_from(self, source):
+        self.tempfile.write(source)
+        self.tempfile.flush()
+        return mmap.mmap(self.tempfile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def assertTokens(self, expected, source=None, delimiter=None):
+        if delimiter is None:
+            delimiter = self.DELIMITER
+        if source is None:
+            source = delimiter.join(expected)
+        mapping = self.mapping_from(source)
+        splitter = xg.MappedInputSplitter(mapping, delimiter)
+        actual = list(splitter)
+        self.assertEqual(actual, expected)
+        for arg in actual:
+            self.assertEqual(mapping[arg.offset:arg.offset + len(arg)], arg)
+
+    def test_easy_split(self):
+        self.assertTokens([b'foo', b'bar', b'baz'])
+
+    def test_no_delimiter(self):
+        self.assertTokens([b'A' * 50])
+
+    def test_adjacent_delimiters(self):
+        self.assertTokens([b'quux', b'', b'qix', b'', b'quack'])
+
+    def test_leading_delimiter(self):
+        self.assertTokens([b'', b'one', b'two'])
+
+    def test_trailing_delimiter(self):
+        expected = [b'penultimate', b'ultimate']
+        self.assertTokens(expected, self.DELIMITER.join(expected) + self.DELIMITER)
+
+    def test_multibyte_delimiter(self):
+        self.assertTokens([b'AAB', b'ADAABAD'], delimiter=b'AC')
+
+    def test_mapped_arg_pickles(self):
+        arg = pickle.loads(pickle.dumps(xg.MappedArg(b'test', 10)))
+        self.assertEqual((arg, arg.offset), (b'test', 10))
+
+    def test_new_group_stores_offsets(self):
+        mapping = self.mapping_from(b'ab\0cd\0ef')
+        splitter = xg.MappedInputSplitter(mapping, self.DELIMITER)
+        group = splitter.new_group()
+        for arg in splitter:
+            if arg != b'cd':
+                group.append(arg)
+        self.assertEqual(len(group), 2)
+        self.assertEqual(list(group.offsets), [0, 6])
+        self.assertEqual([bytes(arg) for arg in group], [b'ab', b'ef'])
+
+
+class FakePool(object):
+    # Run "workers" in this process, one after the other.
+    def __init__(self, processes, initializer, initargs):
+        initializer(*initargs)
+
+    def imap(self, func, iterable):
+        return (func(item) for item in iterable)
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class ParallelMappedInputSplitterTestCase(unittest.TestCase):
+    DELIMITER = b'\0'
+    SOURCE = DELIMITER.join(b'arg' + str(n).encode('ascii') * (n % 7) for n in range(200))
+    ORIG_POOL = staticmethod(xg.ParallelMappedInputSplitter.Pool)
+
+    def setUp(self):
+        self.tempfile = tempfile.TemporaryFile(prefix='xgtest')
+        xg.ParallelMappedInputSplitter.Pool = FakePool
+
+    def tearDown(self):
+        self.tempfile.close()
+        xg.ParallelMappedInputSplitter.Pool = staticmethod(self.ORIG_POOL)
+        xg.ParallelMappedInputSplitter.worker_args = None
+
+    def mapping_from(self, source):
+        self.tempfile.write(source)
+        self.tempfile.flush()
+        return mmap.mmap(self.tempfile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def assertSameAsSerial(self, group_func, source=SOURCE, delimiter=DELIMITER,
+                           workers_count=3):
+        mapping = self.mapping_from(source)
+        results = []
+        for splitter in [xg.MappedInputSplitter(mapping, delimiter),
+                         xg.ParallelMappedInputSplitter(mapping, delimiter, workers_count)]:
+            new_prepper = functools.partial(
+                xg.InputPrepper, group_func, delimiter.decode('ascii'), 'utf-8',
+                new_group=splitter.new_group)
+            prepper = new_prepper()
+            try:
+                add_to = splitter.add_to
+            except AttributeError:
+                prepper.add(splitter)
+            else:
+                add_to(prepper, new_prepper)
+            results.append([(key, [bytes(arg) for arg in prepper[key]], prepper.delimiter(key))
+                            for key in prepper])
+        self.assertEqual(results[0], results[1])
+
+    def test_ranges_end_after_delimiters(self, delimiter=DELIMITER):
+        source = delimiter.join([b'a' * 9, b'', b'b' * 11, b'c', b'd' * 30])
+        mapping = self.mapping_from(source)
+        splitter = xg.ParallelMappedInputSplitter(mapping, delimiter, 4)
+        ranges = list(splitter.ranges())
+        self.assertGreater(len(ranges), 1)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], len(source))
+        for (_, end_index), (start_index, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end_index, start_index)
+            self.assertEqual(source[end_index - len(delimiter):end_index], delimiter)
+
+    def test_ranges_with_multibyte_delimiter(self):
+        self.test_ranges_end_after_delimiters(b'\r\n')
+
+    def test_same_groups_as_serial(self):
+        self.assertSameAsSerial(len)
+
+    def test_same_groups_as_serial_multibyte_delimiter(self):
+        source = b'\r\n'.join([b'\r', b'\n\n', b'\0abc', b'', b'\r\r'] * 10)
+        self.assertSameAsSerial(len, source, b'\r\n')
+
+    def test_same_groups_with_delimiter_per_group(self):
+        all_bytes = bytes(bytearray(range(256)))
+        source = b'\r\n'.join([all_bytes[:128], all_bytes[128:]] * 10)
+        self.assertSameAsSerial(lambda s: s.startswith('\0'), source, b'\r\n', 2)
+
+    def test_overlapping_delimiter_split_serially(self):
+        mapping = self.mapping_from(b'aAAAb')
+        splitter = xg.ParallelMappedInputSplitter(mapping, b'AA', 4)
+        prepper = mock.Mock(name='prepper')
+        new_prepper = mock.Mock(name='new_prepper')
+        splitter.add_to(prepper, new_prepper)
+        prepper.add.assert_called_with(splitter)
+        self.assertFalse(new_prepper.called)
+
+    def test_group_error_reraised_with_cause(self):
+        mapping = self.mapping_from(b'a\0b\0c')
+        splitter = xg.ParallelMappedInputSplitter(mapping, b'\0', 2)
+        group_func = xg.UserExpression('lambda s: 1 // (s != "b")')
+        new_prepper = functools.partial(xg.InputPrepper, group_func, '\0', 'utf-8',
+                                        new_group=splitter.new_group)
+        with self.assertRaises(xg.UserExpressionRuntimeError) as exc_test:
+            splitter.add_to(new_prepper(), new_prepper)
+        self.assertEqual(exc_test.exception.args, ('b',))
+        self.assertIsInstance(exc_test.exception.__cause__, ZeroDivisionError)
+
+    def test_worker_processes(self):
+        xg.ParallelMappedInputSplitter.Pool = staticmethod(self.ORIG_POOL)
+        self.assertSameAsSerial(len)
@@ -114,3 +114,49 @@ class MultiProcessWriterTestCase(unittest.TestCase):
             writer.add(mocks.FakeProcessWriter(0, need_writes=n))
         writer.write_ready()
         self.assertEqual(1, writer.writing_count())
+
+    def test_idle_writer_not_polled(self):
+        proc = mocks.FakeProcessWriter(0, need_writes=2)
+        proc.waiting_for_input = mock.Mock(return_value=True)
+        writer = xg.MultiProcessWriter()
+        writer.add(proc)
+        writer.write_ready()
+        self.poller.modify.assert_called_with(proc.fileno(), 0)
+        self.assertEqual(writer.writing_count(), 1)
+        self.assertEqual(writer.write_ready(0), None)
+        self.assertEqual(proc._need_writes, 1)
+
+    def test_idle_writer_woken_with_input(self):
+        proc = mocks.FakeProcessWriter(0, need_writes=2)
+        proc.waiting_for_input = mock.Mock(return_value=True)
+        writer = xg.MultiProcessWriter()
+        writer.add(proc)
+        writer.write_ready()
+        proc.waiting_for_input.return_value = False
+        writer.write_ready()
+        self.poller.modify.assert_called_with(proc.fileno(), select.POLLOUT)
+        self.assertTrue(proc.success())
+        self.assertEqual(writer.writing_count(), 0)
+
+    def test_write_until_readable(self):
+        proc = mocks.FakeProcessWriter(0, need_writes=1)
+        writer = xg.MultiProcessWriter()
+        writer.add(proc)
+        self.assertTrue(writer.write_until_readable(99))
+        self.poller.register.assert_called_with(99, select.POLLIN)
+        self.poller.unregister.assert_called_with(99)
+        self.assertTrue(proc.success())
+
+    def test_write_until_readable_with_no_procs(self):
+        writer = xg.MultiProcessWriter()
+        self.assertTrue(writer.write_until_readable(99))
+        self.assertEqual(self.poller.poll.call_count, 1)
+
+    def test_write_until_readable_timeout(self):
+        proc = mocks.FakeProcessWriter(0, need_writes=1)
+        writer = xg.MultiProcessWriter()
+        writer.add(proc)
+        self.assertFalse(writer.write_until_readable(99, 5))
+        self.poller.poll.assert_called_with(5)
+        self.poller.unregister.assert_called_with(99)
+        self.assertIsNone(proc.success())
@@ -63,3 +63,33 @@ class NameCheckerTestCase(unittest.TestCase):
     def test_operator_rhs(self):
         used, unknown = xg.NameChecker({}).check(self.build_ast('"test" + right'))
         self.assertEqual(unknown, set(['right']))
+
+    def test_lambda_params_bound(self):
+        used, unknown = xg.NameChecker({}).check(self.build_ast('lambda s, *a, **k: f(s, a, k)'))
+        self.assertEqual(unknown, set(['f']))
+
+    def test_lambda_params_scoped(self):
+        used, unknown = xg.NameChecker({}).check(self.build_ast('(lambda s: s)(s)'))
+        self.assertEqual(unknown, set(['s']))
+
+    def test_lambda_default_outside_scope(self):
+        used, unknown = xg.NameChecker({}).check(self.build_ast('lambda s=s: s'))
+        self.assertEqual(unknown, set(['s']))
+
+    def test_comprehension_targets_bound(self):
+        used, unknown = xg.NameChecker({}).check(
+            self.build_ast('lambda xs: [f(x) for x in xs if x]'))
+        self.assertEqual(unknown, set(['f']))
+
+    def test_nested_comprehension_targets_bound(self):
+        used, unknown = xg.NameChecker({}).check(
+            self.build_ast('{k: v for k, vs in _ for v in vs}'))
+        self.assertEqual(unknown, set(['_']))
+
+    def test_comprehension_first_iter_outside_scope(self):
+        used, unknown = xg.NameChecker({}).check(self.build_ast('[x for x in x]'))
+        self.assertEqual(unknown, set(['x']))
+
+    def test_comprehension_targets_scoped(self):
+        used, unknown = xg.NameChecker({}).check(self.build_ast('(x for x in _) and x'))
+        self.assertEqual(unknown, set(['_', 'x']))
@@ -104,3 +104,14 @@ class PipelineRunnerTestCase(unittest.TestCase):
         runner = xg.PipelineRunner(2)
         runner.run(self.pipelines)
         self.assertPipelinesRun(runner, 3)
+
+    def test_job_tokens_limit_parallel(self):
+        job_tokens = xg.JobTokens(1)
+        self.addCleanup(job_tokens.close)
+        self.setup_pipelines(3, [{'need_writes': 1}])
+        runner = xg.PipelineRunner(3, job_tokens)
+        runner.run(self.pipelines)
+        self.assertPipelinesRun(runner, 3)
+        self.assertEqual(self.writer_fake.writes_max, 1)
+        self.assertEqual(job_tokens.held, 0)
+        self.assertTrue(job_tokens.take())
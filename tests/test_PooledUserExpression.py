@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import contextlib
+import threading
+import time
+import unittest
+
+import xargs_groupby as xg
+from . import mock
+from .helpers import ExceptionWrapperTestHelper
+
+class FakePool(object):
+    # Run "workers" in this process, one after the other.
+    def __init__(self, processes, initializer, initargs):
+        self.processes = processes
+        self.chunks = []
+        initializer(*initargs)
+
+    def imap(self, func, iterable):
+        for item in iterable:
+            self.chunks.append(item)
+            yield func(item)
+
+    def close(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class PooledUserExpressionTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
+    ORIG_POOL = staticmethod(xg.PooledUserExpression.Pool)
+
+    def setUp(self):
+        xg.PooledUserExpression.Pool = FakePool
+
+    def tearDown(self):
+        xg.PooledUserExpression.Pool = staticmethod(self.ORIG_POOL)
+        xg.PooledUserExpression.worker_expr = None
+
+    def test_group_keys_in_order(self):
+        expr = xg.PooledUserExpression('len', 2)
+        args = list(map('a'.__mul__, range(200)))
+        self.assertEqual(expr.group_keys(args), list(range(200)))
+
+    def test_chunks(self):
+        expr = xg.PooledUserExpression('len', 2)
+        expr.group_keys(list(map('a'.__mul__, range(100))))
+        self.assertEqual(list(map(len, expr._pool.chunks)), [64, 36])
+        self.assertEqual(expr._pool.processes, 2)
+
+    def test_batch_size_per_worker(self):
+        self.assertEqual(xg.PooledUserExpression('len', 3).BATCH_SIZE,
+                         xg.PooledUserExpression.CHUNK_SIZE * 12)
+
+    def test_single_call(self):
+        expr = xg.PooledUserExpression('_.upper()', 2)
+        self.assertEqual(expr('abc'), 'ABC')
+
+    def test_batch_constructor(self):
+        expr = xg.PooledUserExpression('lambda args: args[::-1]', 2,
+                                       xg.BatchUserExpression)
+        self.assertEqual(expr.group_keys(['a', 'b']), ['b', 'a'])
+
+    def test_compile_error_before_pool(self):
+        pool = mock.Mock(name='Pool')
+        xg.PooledUserExpression.Pool = pool
+        with self.assertRaises(xg.UserExpressionCompileError):
+            xg.PooledUserExpression('1 +', 2)
+        self.assertFalse(pool.called)
+
+    def test_runtime_error_reraised_with_cause(self):
+        expr = xg.PooledUserExpression('int', 2)
+        with self.assertRaisesWrapped(ValueError, xg.UserExpressionRuntimeError, 'x'):
+            expr.group_keys(['1', '2', 'x'])
+
+    def test_batch_runtime_error_reports_arg(self):
+        expr = xg.PooledUserExpression('lambda args: map(int, args)', 2,
+                                       xg.BatchUserExpression)
+        with self.assertRaisesWrapped(ValueError, xg.UserExpressionRuntimeError, 'x'):
+            expr.group_keys(['1', 'x', '3'])
+
+    def test_prepper_order_matches_serial(self):
+        args = list(map('{}x'.format, range(300)))
+        expr = xg.PooledUserExpression('lambda s: int(s[:-1]) % 7', 3)
+        prepper = xg.InputPrepper(expr, None, 'utf-8')
+        prepper.add(args)
+        serial_prepper = xg.InputPrepper(xg.UserExpression('lambda s: int(s[:-1]) % 7'),
+                                         None, 'utf-8')
+        serial_prepper.add(args)
+        self.assertEqual(sorted(prepper), sorted(serial_prepper))
+        for key in serial_prepper:
+            self.assertEqual(list(prepper[key]), list(serial_prepper[key]))
+
+    def test_use_key_cache(self):
+        key_cache = mock.Mock(name='KeyCache')
+        expr = xg.PooledUserExpression('len', 2)
+        orig_func = expr.func
+        expr.use_key_cache(key_cache)
+        key_cache.wrap_batch.assert_called_with(orig_func)
+        expr.group_keys(['a'])
+        key_cache.wrap_batch().assert_called_with(['a'])
+
+    def test_close(self):
+        expr = xg.PooledUserExpression('len', 2)
+        expr.group_keys(['a'])
+        pool = expr._pool
+        pool.close = mock.Mock(name='close')
+        expr.close()
+        pool.close.assert_called_with()
+        expr.close()
+        self.assertEqual(pool.close.call_count, 1)
+
+    def test_worker_processes(self):
+        xg.PooledUserExpression.Pool = staticmethod(self.ORIG_POOL)
+        expr = xg.PooledUserExpression('len', 2)
+        try:
+            self.assertEqual(expr.group_keys(['a', 'bb', 'ccc']), [1, 2, 3])
+        finally:
+            expr.close()
+
+
+class SleepingExpression(object):
+    # A stand-in for group code that waits on I/O.
+    def __init__(self, delay):
+        self.delay = delay
+        self.thread_names = set()
+
+    def func(self, arg):
+        self.thread_names.add(threading.current_thread().name)
+        time.sleep(self.delay)
+        return len(arg)
+
+    @contextlib.contextmanager
+    def fast_calls(self):
+        yield self.func
+
+    runtime_error = staticmethod(xg.UserExpression.runtime_error)
+
+
+class ThreadedUserExpressionTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
+    def tearDown(self):
+        try:
+            self.expr.close()
+        except AttributeError:
+            pass
+
+    def test_group_keys_in_order(self):
+        self.expr = xg.ThreadedUserExpression('len', 4)
+        args = list(map('a'.__mul__, range(200)))
+        self.assertEqual(self.expr.group_keys(args), list(range(200)))
+
+    def test_runtime_error_reraised_with_cause(self):
+        self.expr = xg.ThreadedUserExpression('int', 2)
+        with self.assertRaisesWrapped(ValueError, xg.UserExpressionRuntimeError, 'x'):
+            self.expr.group_keys(['1', '2', 'x'])
+
+    def test_compile_error(self):
+        with self.assertRaises(xg.UserExpressionCompileError):
+            xg.ThreadedUserExpression('1 +', 2)
+
+    def test_prepper_order_matches_serial(self):
+        args = list(map('{}x'.format, range(300)))
+        self.expr = xg.ThreadedUserExpression('lambda s: int(s[:-1]) % 7', 3)
+        prepper = xg.InputPrepper(self.expr, None, 'utf-8')
+        prepper.add(args)
+        serial_prepper = xg.InputPrepper(xg.UserExpression('lambda s: int(s[:-1]) % 7'),
+                                         None, 'utf-8')
+        serial_prepper.add(args)
+        for key in serial_prepper:
+            self.assertEqual(list(prepper[key]), list(serial_prepper[key]))
+
+    def test_waits_overlap(self, threads_count=8, delay=0.02):
+        sleeper = SleepingExpression(delay)
+        self.expr = xg.ThreadedUserExpression('len', threads_count,
+                                              lambda expr_s: sleeper)
+        args = ['a'] * (self.expr.CHUNK_SIZE * threads_count)
+        start_time = time.time()
+        self.assertEqual(self.expr.group_keys(args), [1] * len(args))
+        elapsed = time.time() - start_time
+        self.assertEqual(len(sleeper.thread_names), threads_count)
+        self.assertLess(elapsed, delay * len(args) / 2)
@@ -16,6 +16,7 @@ from .helpers import ExceptionWrapperTestHelper
 from .mocks import FakePipe, FakePopen
 
 ORIG_SYNC_PROCESS = staticmethod(xg.ProcessWriter.sync_process)
+ORIG_NEW_ARG_FILE = staticmethod(xg.FileProcessWriter.new_arg_file)
 SEPARATOR = b'\0'[0]
 
 Registry = type(xg.ProcessWriter.process_registry)
@@ -108,6 +109,45 @@ class ProcessWriterTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
             self.assertEqual(proc.poll(), 0)
             self.assertFalse(proc.success())
 
+    def test_pending_input_keeps_stdin_open(self):
+        input_seq = xg.StreamingInputPrepper.GroupStream(9)
+        input_seq.append(b'a')
+        with FakePopen.with_returncode(0):
+            proc = xg.ProcessWriter(['cat'], input_seq, SEPARATOR)
+            proc.write(4096)
+            self.assertFalse(proc.done_writing())
+            self.assertTrue(proc.waiting_for_input())
+            self.assertStdin(b'a\0')
+            input_seq.append(b'b')
+            input_seq.finished = True
+            self.assertFalse(proc.waiting_for_input())
+            proc.write(4096)
+            self.assertDone(proc)
+            self.assertStdin(b'a\0b\0')
+
+    def test_pending_input_at_start(self):
+        with FakePopen.with_returncode(0):
+            proc = xg.ProcessWriter(['cat'], [xg.INPUT_PENDING], SEPARATOR)
+            self.assertFalse(proc.done_writing())
+            self.assertFalse(proc.waiting_for_input())
+            proc.write(4096)
+            self.assertDone(proc)
+
+    def test_input_closed_after_io_error(self):
+        closed = []
+        def input_gen():
+            try:
+                while True:
+                    yield b'a'
+            finally:
+                closed.append(True)
+        with FakePopen.with_returncode(8):
+            proc = xg.ProcessWriter(['cat'], input_gen(), SEPARATOR)
+            self.setup_write_error()
+            proc.write(2)
+            self.assertDone(proc, 8)
+        self.assertEqual(closed, [True])
+
     def test_command_not_found_wrapped(self):
         xg.ProcessWriter.Popen = mock.Mock(side_effect=OSError)
         with self.assertRaisesWrapped(OSError, xg.UserCommandError, 'echo'):
@@ -184,3 +224,59 @@ class ProcessWriterSyncTestCase(unittest.TestCase):
         writer1.poll()
         writer2.poll()
         self.assertProcsRegistered(proc1)
+
+
+class FileProcessWriterTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
+    def setUp(self):
+        xg.ProcessWriter.Popen = FakePopen
+        xg.ProcessWriter.process_registry = Registry()
+        xg.ProcessWriter.sync_process = ORIG_SYNC_PROCESS
+        xg.FileProcessWriter.new_arg_file = FakePipe
+
+    def tearDown(self):
+        xg.FileProcessWriter.new_arg_file = ORIG_NEW_ARG_FILE
+
+    def assertStdin(self, expected, index=-1):
+        self.assertEqual(FakePopen.get_stdin(index), expected)
+
+    def test_arguments_written_before_start(self):
+        with FakePopen.with_returncode(0):
+            proc = xg.FileProcessWriter(['cat'], [b'a', b'b'], SEPARATOR)
+            self.assertTrue(proc.done_writing())
+            self.assertStdin(b'a\0b\0')
+            self.assertEqual(proc.poll(), 0)
+            self.assertTrue(proc.success())
+
+    def test_no_separator(self):
+        with FakePopen.with_returncode(0):
+            xg.FileProcessWriter(['cat'], [b'a', b'b'], None)
+            self.assertStdin(b'ab')
+
+    def test_empty_input(self):
+        with FakePopen.with_returncode(0):
+            proc = xg.FileProcessWriter(['cat'], [], None)
+            self.assertStdin(b'')
+            self.assertTrue(proc.done_writing())
+
+    def test_large_input(self):
+        with mock.patch.object(xg.FileProcessWriter, 'WRITE_SIZE', 16), \
+             FakePopen.with_returncode(0):
+            xg.FileProcessWriter(['cat'], [b'abcde'] * 20, SEPARATOR)
+            self.assertStdin(b'abcde\0' * 20)
+
+    def test_error_code(self):
+        with FakePopen.with_returncode(9):
+            proc = xg.FileProcessWriter(['cat'], [b'a'], SEPARATOR)
+            self.assertEqual(proc.poll(), 9)
+            self.assertFalse(proc.success())
+
+    def test_real_arg_file(self):
+        with ORIG_NEW_ARG_FILE.__func__() as arg_file:
+            arg_file.write(b'test')
+            arg_file.seek(0)
+            self.assertEqual(arg_file.read(), b'test')
+
+    def test_command_not_found_wrapped(self):
+        xg.ProcessWriter.Popen = mock.Mock(side_effect=OSError)
+        with self.assertRaisesWrapped(OSError, xg.UserCommandError, 'echo'):
+            xg.FileProcessWriter(['echo', 'hello world'], [b'a'], SEPARATOR)
@@ -6,8 +6,13 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+import io
+import mmap
+import os
 import random
+import shutil
 import sys
+import tempfile
 import unittest
 
 from argparse import Namespace
@@ -22,12 +27,38 @@ class ProgramTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
         # ArgumentParser.parse_args.
         args_dict = {
             'arg_file': None,
+            'async_group_code': None,
+            'args_via_file': False,
+            'batch_group_code': False,
+            'connect': None,
+            'debug': False,
             'delimiter': None,
             'encoding': 'utf-8',
             'eof_str': None,
+            'expand_depth': None,
+            'expand_dirs': False,
+            'expand_follow': False,
+            'expand_name': None,
+            'expand_threads': 4,
+            'group_by': None,
+            'group_bytes': False,
+            'group_cmd': None,
             'group_str': None,
+            'group_threads': 1,
+            'group_workers': 1,
+            'key_cache': None,
+            'keyed_input': None,
             'max_procs': 1,
+            'memoize_group_code': None,
+            'memory_limit': None,
+            'parse_workers': 1,
             'preexec': None,
+            'query_socket': None,
+            'serve': None,
+            'sorted_input': None,
+            'stat_cache': False,
+            'stream': False,
+            'stream_buffer': 1024,
             'group_code': '_.lower()',
             'command': ['echo'],
         }
@@ -50,6 +81,189 @@ class ProgramTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
         code_builder.assert_called_with(code_s)
         self.assertIs(group_func, code_builder())
 
+    def test_batch_group_function(self, code_s='map(len, _)'):
+        program = self.program_from_args(group_code=code_s, batch_group_code=True)
+        code_builder = mock.Mock(name='UserExpression')
+        batch_builder = mock.Mock(name='BatchUserExpression')
+        group_func = program.group_function(code_builder, batch_builder)
+        self.assertFalse(code_builder.called)
+        batch_builder.assert_called_with(code_s)
+        self.assertIs(group_func, batch_builder())
+
+    def test_pooled_group_function(self, code_s='len', batch_group_code=False):
+        program = self.program_from_args(group_code=code_s, group_workers=4,
+                                         batch_group_code=batch_group_code)
+        code_builder = mock.Mock(name='UserExpression')
+        batch_builder = mock.Mock(name='BatchUserExpression')
+        pooled_builder = mock.Mock(name='PooledUserExpression')
+        group_func = program.group_function(code_builder, batch_builder, pooled_builder)
+        expect_builder = batch_builder if batch_group_code else code_builder
+        pooled_builder.assert_called_with(code_s, 4, expect_builder)
+        self.assertFalse(code_builder.called)
+        self.assertIs(group_func, pooled_builder())
+
+    def test_pooled_batch_group_function(self):
+        self.test_pooled_group_function('map(len, _)', True)
+
+    def test_threaded_group_function(self, code_s='len'):
+        program = self.program_from_args(group_code=code_s, group_threads=8)
+        code_builder = mock.Mock(name='UserExpression')
+        threaded_builder = mock.Mock(name='ThreadedUserExpression')
+        group_func = program.group_function(
+            code_builder, threaded_constructor=threaded_builder)
+        threaded_builder.assert_called_with(code_s, 8, code_builder)
+        self.assertIs(group_func, threaded_builder())
+
+    def test_async_group_function(self, code_s='len'):
+        program = self.program_from_args(group_code=code_s, async_group_code=16)
+        code_builder = mock.Mock(name='UserExpression')
+        async_builder = mock.Mock(name='AsyncUserExpression')
+        group_func = program.group_function(code_builder, async_constructor=async_builder)
+        async_builder.assert_called_with(code_s, 16, code_builder, ())
+        self.assertIs(group_func, async_builder())
+
+    def test_async_group_function_query_sockets(self):
+        program = self.program_from_args(async_group_code=4, query_socket=['a.sock'])
+        async_builder = mock.Mock(name='AsyncUserExpression')
+        program.group_function(mock.Mock(name='UserExpression'),
+                               async_constructor=async_builder)
+        self.assertEqual(async_builder.call_args[0][3], ['a.sock'])
+
+    def test_group_by_function(self):
+        program = self.program_from_args(group_code=None, group_by='ext',
+                                         group_bytes=True, encoding='latin-1')
+        code_builder = mock.Mock(name='UserExpression')
+        extractor_builder = mock.Mock(name='KeyExtractor')
+        group_func = program.group_function(
+            code_builder, extractor_constructor=extractor_builder)
+        self.assertFalse(code_builder.called)
+        extractor_builder.assert_called_with('ext', True, 'latin-1')
+        self.assertIs(group_func, extractor_builder())
+
+    def test_keyed_input_function(self):
+        program = self.program_from_args(group_code=None, keyed_input=':',
+                                         encoding='latin-1')
+        code_builder = mock.Mock(name='UserExpression')
+        keys_builder = mock.Mock(name='InputKeys')
+        group_func = program.group_function(code_builder, keys_constructor=keys_builder)
+        self.assertFalse(code_builder.called)
+        keys_builder.assert_called_with(':', 'latin-1')
+        self.assertIs(group_func, keys_builder())
+
+    def test_group_cmd_function(self):
+        program = self.program_from_args(group_code=None, group_cmd=['file', '-b'],
+                                         group_bytes=True, encoding='latin-1')
+        code_builder = mock.Mock(name='UserExpression')
+        coprocess_builder = mock.Mock(name='CoprocessKeys')
+        group_func = program.group_function(
+            code_builder, coprocess_constructor=coprocess_builder)
+        self.assertFalse(code_builder.called)
+        coprocess_builder.assert_called_with(['file', '-b'], True, 'latin-1')
+        self.assertIs(group_func, coprocess_builder())
+
+    def test_group_function_with_key_cache(self):
+        program = self.program_from_args(memoize_group_code=64)
+        code_builder = mock.Mock(name='UserExpression')
+        key_cache = mock.Mock(name='KeyCache')
+        group_func = program.group_function(code_builder, key_cache=key_cache)
+        group_func.use_key_cache.assert_called_with(key_cache)
+        self.assertEqual(group_func.method_calls,
+                         [mock.call.use_key_cache(key_cache), mock.call.memoize(64)])
+
+    def test_group_function_with_stat_cache(self):
+        program = self.program_from_args()
+        code_builder = mock.Mock(name='UserExpression')
+        stat_cache = mock.Mock(name='StatCache')
+        group_func = program.group_function(code_builder, stat_cache=stat_cache)
+        group_func.use_stat_cache.assert_called_with(stat_cache)
+
+    def test_stat_cache(self):
+        program = self.program_from_args(stat_cache=True)
+        cache_class = mock.Mock(name='StatCache')
+        self.assertIs(program.stat_cache(cache_class), cache_class())
+
+    def test_no_stat_cache(self):
+        program = self.program_from_args()
+        cache_class = mock.Mock(name='StatCache')
+        self.assertIsNone(program.stat_cache(cache_class))
+        self.assertFalse(cache_class.called)
+
+    def test_debug_stats_stat_cache(self):
+        program = self.program_from_args(stat_cache=True)
+        stat_cache = mock.Mock(name='StatCache', hits=5, misses=4)
+        group_func = xg.UserExpression('_.lower()')
+        self.assertEqual(list(program.debug_stats(group_func, stat_cache=stat_cache)),
+                         ["stat cache: 5 hits, 4 misses"])
+
+    def test_key_cache(self, path='/tmp/keys.db', code_s='len'):
+        program = self.program_from_args(key_cache=path, group_code=code_s)
+        cache_class = mock.Mock(name='KeyCache')
+        key_cache = program.key_cache(cache_class)
+        cache_class.assert_called_with(path, '--encoding=utf-8 ' + code_s)
+        self.assertIs(key_cache, cache_class())
+
+    def test_key_cache_group_by(self):
+        program = self.program_from_args(key_cache='keys.db', group_code=None,
+                                         group_by='dirname', group_bytes=True)
+        cache_class = mock.Mock(name='KeyCache')
+        program.key_cache(cache_class)
+        cache_class.assert_called_with('keys.db', '--group-by dirname --group-bytes')
+
+    def test_key_cache_modes_not_shared(self):
+        tmpdir = tempfile.mkdtemp(prefix='xgtest')
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, 'keys.db')
+        def cached_key(**opts):
+            program = self.program_from_args(key_cache=path, group_code='len', **opts)
+            key_cache = program.key_cache()
+            key = key_cache.wrap(lambda arg: sorted(opts.items()))('arg')
+            key_cache.close()
+            return key
+        self.assertEqual(cached_key(), [])
+        self.assertEqual(cached_key(encoding='UTF8'), [])
+        for opts in [{'batch_group_code': True}, {'async_group_code': 4},
+                     {'group_bytes': True}, {'encoding': 'latin-1'}]:
+            self.assertEqual(cached_key(**opts), sorted(opts.items()))
+
+    def test_no_key_cache(self):
+        program = self.program_from_args()
+        cache_class = mock.Mock(name='KeyCache')
+        self.assertIsNone(program.key_cache(cache_class))
+        self.assertFalse(cache_class.called)
+
+    def test_debug_stats_key_cache(self):
+        program = self.program_from_args(key_cache='/tmp/keys.db')
+        key_cache = mock.Mock(name='KeyCache', hits=3, misses=2)
+        group_func = xg.UserExpression('_.lower()')
+        self.assertEqual(list(program.debug_stats(group_func, key_cache)),
+                         ["key cache: 3 hits, 2 misses"])
+
+    def test_memoized_group_function(self, code_s='_.lower()'):
+        program = self.program_from_args(group_code=code_s, memoize_group_code=64)
+        code_builder = mock.Mock(name='UserExpression')
+        group_func = program.group_function(code_builder)
+        group_func.memoize.assert_called_with(64)
+
+    def test_group_function_not_memoized(self):
+        program = self.program_from_args()
+        code_builder = mock.Mock(name='UserExpression')
+        group_func = program.group_function(code_builder)
+        self.assertFalse(group_func.memoize.called)
+
+    def test_debug_stats_cache(self):
+        program = self.program_from_args(memoize_group_code=64)
+        group_func = xg.UserExpression('_.lower()')
+        group_func.memoize(64)
+        for arg in ['A', 'a', 'b', 'A']:
+            group_func(arg)
+        self.assertEqual(list(program.debug_stats(group_func)),
+                         ["group code cache: 1 hits, 3 misses"])
+
+    def test_debug_stats_no_cache(self):
+        program = self.program_from_args()
+        group_func = xg.UserExpression('_.lower()')
+        self.assertEqual(list(program.debug_stats(group_func)), [])
+
     def test_input_file(self, arg_file=None, encoding='utf-8'):
         program = self.program_from_args(arg_file=arg_file, encoding=encoding)
         open_func = mock.Mock(name='io.open')
@@ -67,26 +281,103 @@ class ProgramTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
     def test_input_file_encoding(self):
         self.test_input_file(arg_file='/test/file', encoding='latin-1')
 
+    def test_input_file_bytes(self, arg_file=None, delimiter='\0', encoding='utf-8'):
+        program = self.program_from_args(
+            arg_file=arg_file, delimiter=delimiter, encoding=encoding)
+        open_func = mock.Mock(name='io.open')
+        map_func = mock.Mock(name='mmap', side_effect=ValueError)
+        input_file = program.input_file(open_func, map_func)
+        input_source = sys.stdin.fileno() if (arg_file is None) else arg_file
+        open_func.assert_called_with(input_source, mode='rb')
+        self.assertIs(input_file, open_func())
+
+    def test_input_file_bytes_argument(self):
+        self.test_input_file_bytes(arg_file='/test/file', encoding='latin-1')
+
+    def test_input_file_mapped(self):
+        program = self.program_from_args(arg_file='/test/file', delimiter='\0')
+        open_func = mock.Mock(name='io.open')
+        map_func = mock.Mock(name='mmap')
+        input_file = program.input_file(open_func, map_func)
+        map_func.assert_called_with(open_func().fileno(), 0, access=mmap.ACCESS_READ)
+        open_func().close.assert_called_with()
+        self.assertIs(input_file, map_func())
+
+    def test_input_file_stdin_not_mapped(self):
+        program = self.program_from_args(delimiter='\0')
+        map_func = mock.Mock(name='mmap')
+        with mock.patch('sys.stdin', NoopMock(name='stdin', spec_set=['fileno'])):
+            program.input_file(mock.Mock(name='io.open'), map_func)
+        self.assertFalse(map_func.called)
+
+    def test_input_file_text_for_unsplittable_encoding(self):
+        program = self.program_from_args(
+            arg_file='/test/file', delimiter='\0', encoding='utf-16')
+        open_func = mock.Mock(name='io.open')
+        program.input_file(open_func)
+        open_func.assert_called_with('/test/file', encoding='utf-16')
+
+    def test_bytes_delimiter(self, delimiter='\t', encoding='utf-8', expected=b'\t'):
+        program = self.program_from_args(delimiter=delimiter, encoding=encoding)
+        self.assertEqual(program.bytes_delimiter(), expected)
+
+    def test_bytes_delimiter_multibyte(self):
+        self.test_bytes_delimiter('♥', 'utf-8', '♥'.encode('utf-8'))
+
+    def test_bytes_delimiter_unencodable(self):
+        self.test_bytes_delimiter('♥', 'latin-1', None)
+
+    def test_bytes_delimiter_unsplittable_encoding(self):
+        self.test_bytes_delimiter('\t', 'utf-16', None)
+
+    def test_bytes_delimiter_no_delimiter(self):
+        self.test_bytes_delimiter(None, 'utf-8', None)
+
     def test_input_file_open_error(self):
         program = self.program_from_args(arg_file='/test/file')
         open_func = mock.Mock(side_effect=OSError)
         with self.assertRaisesWrapped(OSError, xg.UserArgumentsError):
             program.input_file(open_func)
 
-    def test_input_parser(self, delimiter=None, eof_str=None):
+    def test_input_parser(self, delimiter=None, eof_str=None, encoding='utf-8'):
         parsers = (mock.Mock('shlexer'), mock.Mock('splitter'))
         input_file = NoopMock(name='input_file')
-        program = self.program_from_args(delimiter=delimiter, eof_str=eof_str)
+        program = self.program_from_args(
+            delimiter=delimiter, eof_str=eof_str, encoding=encoding)
         actual_parser = program.input_parser(input_file, *parsers)
         if delimiter is None:
             expected_parser = parsers[0]
             expected_calls = [mock.call(input_file, eof_str)]
         else:
             expected_parser = parsers[1]
-            expected_calls = [mock.call(input_file, delimiter)]
+            expected_calls = [mock.call(input_file, program.bytes_delimiter() or delimiter)]
         expected_parser.assert_has_calls(expected_calls)
         self.assertIs(actual_parser, expected_parser())
 
+    def test_expand_input(self):
+        program = self.program_from_args(
+            expand_dirs=True, expand_depth=2, expand_name='*.py', expand_follow=True,
+            expand_threads=8, encoding='latin-1', group_bytes=True)
+        input_seq = NoopMock(name='input_seq')
+        stat_cache = NoopMock(name='StatCache')
+        expander = mock.Mock(name='DirectoryExpander')
+        expanded = program.expand_input(input_seq, stat_cache, expander)
+        expander.assert_called_with(input_seq, 2, '*.py', True, 8, stat_cache,
+                                    'latin-1', False)
+        self.assertIs(expanded, expander())
+
+    def test_expand_errors_count(self):
+        program = self.program_from_args()
+        self.assertEqual(program.expand_errors_count(mock.Mock(errors_count=2)), 2)
+        self.assertEqual(program.expand_errors_count(NoopMock(name='input_seq')), 0)
+
+    def test_no_expand_input(self):
+        program = self.program_from_args()
+        input_seq = NoopMock(name='input_seq')
+        expander = mock.Mock(name='DirectoryExpander')
+        self.assertIs(program.expand_input(input_seq, None, expander), input_seq)
+        self.assertFalse(expander.called)
+
     def test_input_parser_delimited(self):
         self.test_input_parser(delimiter='\0')
 
@@ -96,6 +387,48 @@ class ProgramTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
     def test_input_parser_useless_eof_str(self):
         self.test_input_parser(delimiter='\t', eof_str='UNUSED')
 
+    def test_input_parser_text_delimited(self):
+        self.test_input_parser(delimiter='\t', encoding='utf-16')
+
+    def test_input_parser_mapped(self):
+        parsers = [mock.Mock(name=name) for name in ['shlexer', 'splitter', 'mapped']]
+        input_file = mock.Mock(name='mapping', spec=mmap.mmap)
+        program = self.program_from_args(delimiter='\0')
+        actual_parser = program.input_parser(input_file, *parsers)
+        parsers[2].assert_called_with(input_file, b'\0')
+        self.assertIs(actual_parser, parsers[2]())
+
+    def test_input_parser_parallel(self):
+        parsers = [mock.Mock(name=name) for name in
+                   ['shlexer', 'splitter', 'mapped', 'parallel']]
+        input_file = mock.Mock(name='mapping', spec=mmap.mmap)
+        program = self.program_from_args(delimiter='\0', parse_workers=3)
+        actual_parser = program.input_parser(input_file, *parsers)
+        parsers[3].assert_called_with(input_file, b'\0', 3)
+        self.assertIs(actual_parser, parsers[3]())
+
+    def test_input_parser_unmapped_not_parallel(self):
+        parsers = [mock.Mock(name=name) for name in
+                   ['shlexer', 'splitter', 'mapped', 'parallel']]
+        input_file = NoopMock(name='input_file')
+        program = self.program_from_args(delimiter='\0', parse_workers=3)
+        actual_parser = program.input_parser(input_file, *parsers)
+        self.assertIs(actual_parser, parsers[1]())
+
+    def test_prep_input_parallel(self):
+        program = self.program_from_args(delimiter='\0')
+        group_func = NoopMock(name='group_func')
+        input_source = mock.Mock(name='input_source')
+        prepper_class = mock.Mock(name='InputPrepper')
+        prepper = program.prep_input(group_func, input_source, prepper_class)
+        self.assertIs(prepper, prepper_class())
+        self.assertFalse(prepper.add.called)
+        add_prepper, new_prepper = input_source.add_to.call_args[0]
+        self.assertIs(add_prepper, prepper)
+        prepper_class.reset_mock()
+        new_prepper()
+        prepper_class.assert_called_with(group_func, '\0', 'utf-8')
+
     def test_prep_input(self, delimiter=None, encoding='utf-8'):
         program = self.program_from_args(delimiter=delimiter, encoding=encoding)
         group_func = NoopMock(name='group_func')
@@ -106,6 +439,54 @@ class ProgramTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
         prepper_class().add.assert_called_with(input_source)
         self.assertIs(prepper, prepper_class())
 
+    def test_prepper_class(self, group_bytes=False):
+        program = self.program_from_args(group_bytes=group_bytes)
+        prepper = program.prepper_class()(len, None, 'utf-8')
+        self.assertIs(type(prepper), xg.InputPrepper)
+        self.assertEqual(prepper.decode_args, not group_bytes)
+        self.assertIs(prepper.new_group, xg.CompactArgsGroup)
+
+    def test_prepper_class_group_bytes(self):
+        self.test_prepper_class(True)
+
+    def test_prepper_class_new_group(self):
+        program = self.program_from_args()
+        new_group = mock.Mock(name='new_group')
+        prepper = program.prepper_class(new_group)(len, None, 'utf-8')
+        prepper.add(['a'])
+        new_group().append.assert_called_with(b'a')
+
+    def test_prepper_class_stream(self):
+        program = self.program_from_args(stream=True, stream_buffer=9)
+        prepper = program.prepper_class()(len, None, 'utf-8')
+        self.assertIsInstance(prepper, xg.StreamingInputPrepper)
+        self.assertEqual(prepper.buffer_size, 9)
+
+    def test_prepper_class_sorted(self, on_repeat='error'):
+        program = self.program_from_args(sorted_input=on_repeat)
+        prepper = program.prepper_class()(len, None, 'utf-8')
+        self.assertIsInstance(prepper, xg.SortedInputPrepper)
+        self.assertEqual(prepper.on_repeat, on_repeat)
+
+    def test_prepper_class_sorted_rerun(self):
+        self.test_prepper_class_sorted('rerun')
+
+    def test_group_storage(self):
+        program = self.program_from_args()
+        self.assertIs(program.group_storage([]), xg.CompactArgsGroup)
+
+    def test_group_storage_from_input(self):
+        input_seq = mock.Mock(name='input_seq')
+        program = self.program_from_args(memory_limit=100)
+        self.assertIs(program.group_storage(input_seq), input_seq.new_group)
+
+    def test_group_storage_with_memory_limit(self):
+        spill_file = mock.Mock(name='SpillFile')
+        program = self.program_from_args(memory_limit=100)
+        new_group = program.group_storage([], spill_file)
+        spill_file.assert_called_with(100)
+        self.assertIs(new_group, spill_file().new_group)
+
     def test_prep_input_io_error(self, source_error=OSError('test')):
         program = self.program_from_args()
         group_func = NoopMock(name='group_func')
@@ -119,15 +500,17 @@ class ProgramTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
         self.test_prep_input_io_error(
             UnicodeDecodeError(str('test'), b'foo', 1, 2, str('test error')))
 
-    def test_command_template(self, group_str=None, preexec=None, command=['echo']):
+    def test_command_template(self, group_str=None, preexec=None, command=['echo'],
+                              encoding='utf-8'):
         group_class = mock.Mock(name='GroupCommand')
         xargs_class = mock.Mock(name='XargsCommand')
-        program = self.program_from_args(preexec=preexec, group_str=group_str, command=command[:])
+        program = self.program_from_args(preexec=preexec, group_str=group_str,
+                                         command=command[:], encoding=encoding)
         templates = program.command_templates(group_class, xargs_class)
         expected_group_calls = []
         if preexec is not None:
-            expected_group_calls.append(mock.call(preexec, group_str))
-        expected_group_calls.append(mock.call(command, group_str))
+            expected_group_calls.append(mock.call(preexec, group_str, encoding))
+        expected_group_calls.append(mock.call(command, group_str, encoding))
         self.assertEqual(len(templates), len(expected_group_calls))
         group_class.assert_has_calls(expected_group_calls)
         self.assertEqual(xargs_class.call_count, 1)
@@ -136,6 +519,9 @@ class ProgramTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
         self.assertIs(group_cmd, group_class())
         xargs_class().set_options.assert_called_with(self.xargs_opts)
 
+    def test_command_template_encoding(self):
+        self.test_command_template(group_str='{}', encoding='latin-1')
+
     def test_command_template_preexec(self):
         self.test_command_template(preexec=['mkdir'])
 
@@ -200,6 +586,29 @@ class ProgramTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
     def test_iter_many_pipelines(self):
         self.test_iter_pipelines('e', 'i', 'o', 'u')
 
+    def test_iter_pipelines_unknown_groups_count(self):
+        input_prepper = mock.MagicMock(name='input_prepper')
+        input_prepper.__iter__.return_value = 'abc'
+        input_prepper.__len__.side_effect = TypeError
+        templates = mock.MagicMock(name='templates')
+        program = self.program_from_args()
+        pipelines = list(program.iter_pipelines(
+            templates, input_prepper, mock.Mock(), mock.Mock()))
+        self.assertEqual(len(pipelines), 3)
+        self.assertFalse(templates[-1].set_parallel.called)
+
+    def test_iter_pipelines_default_class(self, expected=xg.ProcessPipeline, **opts):
+        input_prepper = mock.MagicMock(name='input_prepper')
+        input_prepper.__iter__.return_value = 'a'
+        input_prepper.__len__.return_value = 1
+        program = self.program_from_args(**opts)
+        pipelines = list(program.iter_pipelines(
+            mock.MagicMock(name='templates'), input_prepper, mock.MagicMock()))
+        self.assertIs(type(pipelines[0]), expected)
+
+    def test_iter_pipelines_args_via_file(self):
+        self.test_iter_pipelines_default_class(xg.FileProcessPipeline, args_via_file=True)
+
     def test_iter_pipelines_sets_parallel(self):
         cores_count = random.randint(1, 99)
         groups_count = random.randint(101, 199)
@@ -213,34 +622,87 @@ class ProgramTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
         next(program.iter_pipelines(templates, input_prepper, source_func, pipeline_class))
         templates[-1].set_parallel.assert_called_with(cores_count, groups_count)
 
-    def run_main(self, run_count=8, failures_count=0, **opts):
+    def run_main(self, run_count=8, failures_count=0, stats=[],
+                 expression_cache=None, expand_errors=0, **opts):
         pipeline_runner = mock.Mock(name='PiplineRunner')
         pipeline_runner().run_count.return_value = max(run_count, failures_count)
         pipeline_runner().failures_count.return_value = failures_count
         program = self.program_from_args(**opts)
         prog_mock = mock.Mock(name='program', spec=program)
         prog_mock.args = program.args
-        exitcode = xg.Program.main(prog_mock, pipeline_runner)
+        prog_mock.debug_stats.return_value = iter(stats)
+        prog_mock.expand_errors_count.return_value = expand_errors
+        exitcode = xg.Program.main(prog_mock, pipeline_runner, pipeline_runner,
+                                   expression_cache)
         return pipeline_runner, prog_mock, exitcode
 
     def test_main_connections(self):
         cores_count = random.randint(1, 99)
         pipeline_runner, program, _ = self.run_main(max_procs=cores_count)
-        program.group_function.assert_called_with()
+        program.group_function.assert_called_with(
+            key_cache=program.key_cache(), stat_cache=program.stat_cache())
         program.input_file.assert_called_with()
         program.input_parser.assert_called_with(program.input_file())
+        program.expand_input.assert_called_with(
+            program.input_parser(), program.stat_cache())
         program.prep_input.assert_called_with(
-            program.group_function(), program.input_parser())
+            program.group_function(), program.expand_input())
         program.command_templates.assert_called_with()
         program.iter_pipelines.assert_called_with(
             program.command_templates(), program.prep_input())
         pipeline_runner.assert_called_with(cores_count)
         pipeline_runner().run.assert_called_with(program.iter_pipelines())
 
-    def test_main_exitcode(self, run_count=8, failures_count=0, expected=0):
-        _, _, exitcode = self.run_main(run_count, failures_count)
+    def test_main_expression_cache(self):
+        expression_cache = mock.Mock(name='ExpressionCache')
+        _, program, _ = self.run_main(expression_cache=expression_cache)
+        expression_cache.constructor.assert_any_call(xg.UserExpression)
+        expression_cache.constructor.assert_any_call(xg.BatchUserExpression)
+        program.group_function.assert_called_with(
+            expression_cache.constructor(), expression_cache.constructor(),
+            key_cache=program.key_cache(), stat_cache=program.stat_cache())
+
+    def test_main_stream_runner(self):
+        cores_count = random.randint(1, 99)
+        pipeline_runner, program, _ = self.run_main(max_procs=cores_count, stream=True)
+        pipeline_runner.assert_called_with(cores_count, program.prep_input())
+
+    def test_main_closes_pooled_group_function(self):
+        _, program, _ = self.run_main(group_workers=2)
+        program.group_function().close.assert_called_with()
+
+    def test_main_closes_threaded_group_function(self):
+        _, program, _ = self.run_main(group_threads=2)
+        program.group_function().close.assert_called_with()
+
+    def test_main_closes_key_cache(self):
+        _, program, _ = self.run_main(key_cache='/tmp/keys.db')
+        program.key_cache().close.assert_called_with()
+
+    def test_main_debug_stats(self):
+        with mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            _, program, _ = self.run_main(stats=["test stat"], debug=True)
+        self.assertEqual(stderr.getvalue(), "xargs_groupby: test stat\n")
+        program.debug_stats.assert_called_with(
+            program.group_function(), program.key_cache(), program.stat_cache())
+
+    def test_main_no_debug_stats(self):
+        _, program, _ = self.run_main()
+        self.assertFalse(program.debug_stats.called)
+
+    def test_main_exitcode(self, run_count=8, failures_count=0, expected=0, expand_errors=0):
+        _, _, exitcode = self.run_main(run_count, failures_count,
+                                       expand_errors=expand_errors)
         self.assertEqual(exitcode, expected)
 
+    def test_main_exitcode_with_expand_errors(self):
+        _, program, exitcode = self.run_main(expand_errors=2)
+        self.assertEqual(exitcode, 3)
+        program.expand_errors_count.assert_called_with(program.expand_input())
+
+    def test_main_exitcode_failures_before_expand_errors(self):
+        self.test_main_exitcode(8, 4, 14, 2)
+
     def test_main_exitcode_with_some_failures(self):
         self.test_main_exitcode(8, 4, 14)
 
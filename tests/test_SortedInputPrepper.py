@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+from operator import itemgetter
+
+import xargs_groupby as xg
+
+class SortedInputPrepperTestCase(unittest.TestCase):
+    ENCODING = 'latin-1'
+    USABLE_DELIMITER_BYTES = bytes(bytearray(range(256)))
+    USABLE_DELIMITERS = USABLE_DELIMITER_BYTES.decode(ENCODING)
+
+    def InputPrepper(self, key_func=itemgetter(0), delimiter=None,
+                     on_repeat=xg.SortedInputPrepper.ON_REPEAT_ERROR):
+        return xg.SortedInputPrepper(key_func, delimiter, self.ENCODING, on_repeat=on_repeat)
+
+    def claim_groups(self, prepper):
+        return [(key, prepper[key]) for key in prepper]
+
+    def test_groups_by_key_change(self):
+        prepper = self.InputPrepper()
+        prepper.add(['ab', 'ac', 'bd', 'ce', 'cf'])
+        self.assertEqual(self.claim_groups(prepper), [
+            ('a', [b'ab', b'ac']),
+            ('b', [b'bd']),
+            ('c', [b'ce', b'cf']),
+        ])
+
+    def test_empty_input(self):
+        prepper = self.InputPrepper()
+        prepper.add([])
+        self.assertEqual(list(prepper), [])
+
+    def test_yields_group_before_reading_more(self):
+        def args_source():
+            yield 'ab'
+            yield 'bc'
+            self.fail("read past the end of the first group")
+        prepper = self.InputPrepper()
+        prepper.add(args_source())
+        self.assertEqual(next(iter(prepper)), 'a')
+        self.assertEqual(prepper['a'], [b'ab'])
+
+    def test_claimed_groups_released(self):
+        prepper = self.InputPrepper()
+        prepper.add(['ab', 'bc'])
+        keys = iter(prepper)
+        key = next(keys)
+        prepper[key]
+        next(keys)
+        with self.assertRaises(IndexError):
+            prepper[key]
+
+    def test_repeated_key_error(self):
+        prepper = self.InputPrepper()
+        prepper.add(['ab', 'bc', 'ad'])
+        with self.assertRaises(xg.UserArgumentsError):
+            self.claim_groups(prepper)
+
+    def test_repeated_key_rerun(self):
+        prepper = self.InputPrepper(on_repeat=xg.SortedInputPrepper.ON_REPEAT_RERUN)
+        prepper.add(['ab', 'bc', 'ad', 'ae'])
+        self.assertEqual(self.claim_groups(prepper), [
+            ('a', [b'ab']),
+            ('b', [b'bc']),
+            ('a', [b'ad', b'ae']),
+        ])
+
+    def test_repeated_key_rerun_unclaimed(self):
+        prepper = self.InputPrepper(on_repeat=xg.SortedInputPrepper.ON_REPEAT_RERUN)
+        prepper.add(['ab', 'bc', 'ad'])
+        self.assertEqual(list(prepper), ['a', 'b', 'a'])
+        self.assertEqual(prepper['a'], [b'ab'])
+        self.assertEqual(prepper['a'], [b'ad'])
+
+    def test_no_len(self):
+        prepper = self.InputPrepper()
+        with self.assertRaises(TypeError):
+            len(prepper)
+
+    def test_uses_1byte_delimiter(self):
+        prepper = self.InputPrepper(delimiter='\t')
+        prepper.add(['a\tb'])
+        for key in prepper:
+            prepper[key]
+            self.assertEqual(prepper.delimiter(key), b'\t'[0])
+
+    def test_finds_delimiter_per_group(self):
+        width = 128
+        inputs = [self.USABLE_DELIMITERS[:width], self.USABLE_DELIMITERS[width:]]
+        prepper = self.InputPrepper()
+        prepper.add(inputs)
+        for index, key in enumerate(prepper):
+            prepper[key]
+            delimiter = prepper.delimiter(key)
+            bad_range = self.USABLE_DELIMITER_BYTES[width * index:width * (index + 1)]
+            self.assertNotIn(delimiter, bad_range)
+
+    def test_error_when_group_covers_all_bytes(self):
+        prepper = self.InputPrepper(key_func=len)
+        prepper.add([self.USABLE_DELIMITERS])
+        with self.assertRaises(xg.UserArgumentsError):
+            list(prepper)
+
+    def test_read_error_wrapped(self):
+        def args_source():
+            yield 'ab'
+            raise IOError("test error")
+        prepper = self.InputPrepper()
+        prepper.add(args_source())
+        with self.assertRaises(xg.UserArgumentsError) as exc_check:
+            list(prepper)
+        self.assertIsInstance(exc_check.exception.__cause__, IOError)
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gc
+import tempfile
+import unittest
+
+import xargs_groupby as xg
+from . import mock
+
+class SpillFileTestCase(unittest.TestCase):
+    def setUp(self):
+        self.new_file = mock.Mock(name='TemporaryFile', wraps=tempfile.TemporaryFile)
+
+    def tearDown(self):
+        try:
+            self.spill_file._file.close()
+        except AttributeError:
+            pass
+
+    def SpillFile(self, memory_limit):
+        self.spill_file = xg.SpillFile(memory_limit, self.new_file)
+        return self.spill_file
+
+    def assertGroupHas(self, group, expected):
+        self.assertEqual(len(group), len(expected))
+        self.assertEqual([bytes(arg) for arg in group], expected)
+
+    def test_no_spill_under_limit(self):
+        spill_file = self.SpillFile(1024)
+        group = spill_file.new_group()
+        group.append(b'abc')
+        self.assertFalse(self.new_file.called)
+        self.assertGroupHas(group, [b'abc'])
+
+    def test_spill_over_limit(self):
+        spill_file = self.SpillFile(8)
+        group = spill_file.new_group()
+        group.append(b'abcdefgh')
+        self.assertEqual(self.new_file.call_count, 1)
+        self.assertEqual(len(group.ends), 0)
+        self.assertEqual(spill_file.memory_used, 0)
+        self.assertGroupHas(group, [b'abcdefgh'])
+
+    def test_all_groups_spill_in_order(self):
+        spill_file = self.SpillFile(12)
+        groups = [spill_file.new_group() for _ in range(3)]
+        for index, arg in enumerate([b'a1', b'b1', b'a2', b'', b'c1', b'a3', b'b2']):
+            groups[index % 2].append(arg)
+        groups[2].append(b'c1')
+        self.assertEqual(self.new_file.call_count, 1)
+        self.assertGreater(len(groups[0].spilled_chunks), 1)
+        self.assertGroupHas(groups[0], [b'a1', b'a2', b'c1', b'b2'])
+        self.assertGroupHas(groups[1], [b'b1', b'', b'a3'])
+        self.assertGroupHas(groups[2], [b'c1'])
+
+    def test_groups_can_be_read_interleaved(self):
+        spill_file = self.SpillFile(1)
+        groups = [spill_file.new_group() for _ in range(2)]
+        for arg in [b'a1', b'a2']:
+            groups[0].append(arg)
+        for arg in [b'b1', b'b2']:
+            groups[1].append(arg)
+        iters = [iter(group) for group in groups]
+        actual = [bytes(next(group_iter)) for _ in range(2) for group_iter in iters]
+        self.assertEqual(actual, [b'a1', b'b1', b'a2', b'b2'])
+
+    def test_read_group_not_spilled(self):
+        spill_file = self.SpillFile(8)
+        groups = [spill_file.new_group() for _ in range(2)]
+        groups[0].append(b'a1')
+        self.assertGroupHas(groups[0], [b'a1'])
+        self.assertEqual(spill_file.memory_used, 0)
+        groups[1].append(b'b1234567')
+        self.assertEqual(groups[0].spilled_chunks, [])
+        self.assertEqual(len(groups[1].spilled_chunks), 1)
+        self.assertEqual(list(spill_file.groups), [groups[1]])
+
+    def test_released_group_not_spilled(self):
+        spill_file = self.SpillFile(8)
+        groups = [spill_file.new_group() for _ in range(2)]
+        groups[0].append(b'a1')
+        groups[0].release()
+        self.assertEqual(list(spill_file.groups), [groups[1]])
+        groups[1].append(b'b1')
+        self.assertEqual(spill_file.memory_used, len(b'b1') + groups[1].ends.itemsize)
+        groups[1].append(b'b2345')
+        self.assertEqual(groups[0].spilled_chunks, [])
+        self.assertGroupHas(groups[1], [b'b1', b'b2345'])
+
+    def test_dropped_group_not_tracked(self):
+        spill_file = self.SpillFile(1024)
+        group = spill_file.new_group()
+        group.append(b'a1')
+        del group
+        gc.collect()
+        self.assertEqual(list(spill_file.groups), [])
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import errno
+import os
+import stat
+import unittest
+
+import xargs_groupby as xg
+from . import mock
+
+class StatCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stat_func = mock.Mock(name='stat', wraps=os.stat)
+        self.lstat_func = mock.Mock(name='lstat', wraps=os.lstat)
+        self.stat_cache = xg.StatCache(self.stat_func, self.lstat_func)
+
+    def assertCounts(self, hits, misses):
+        self.assertEqual((self.stat_cache.hits, self.stat_cache.misses), (hits, misses))
+
+    def test_stat_once(self, path=__file__):
+        results = [self.stat_cache.stat(path) for _ in range(3)]
+        self.stat_func.assert_called_once_with(path)
+        self.assertEqual(results, [os.stat(path)] * 3)
+        self.assertCounts(2, 1)
+
+    def test_stat_bytes_path(self):
+        self.test_stat_once(os.fsencode(__file__) if hasattr(os, 'fsencode')
+                            else __file__.encode('utf-8'))
+
+    def test_lstat_cached_separately(self):
+        self.stat_cache.stat(__file__)
+        self.stat_cache.stat(__file__, False)
+        self.stat_cache.stat(__file__, False)
+        self.stat_func.assert_called_once_with(__file__)
+        self.lstat_func.assert_called_once_with(__file__)
+        self.assertCounts(1, 2)
+
+    def test_error_cached(self, path='/_nonexistent/path'):
+        for _ in range(2):
+            with self.assertRaises(EnvironmentError) as exc_check:
+                self.stat_cache.stat(path)
+            self.assertEqual(exc_check.exception.errno, errno.ENOENT)
+            self.assertEqual(exc_check.exception.filename, path)
+        self.stat_func.assert_called_once_with(path)
+        self.assertCounts(1, 1)
+
+    def test_fd_not_cached(self):
+        with open(__file__) as test_file:
+            for _ in range(2):
+                self.stat_cache.stat(test_file.fileno())
+        self.assertEqual(self.stat_func.call_count, 2)
+        self.assertCounts(0, 0)
+
+    def test_mode_without_entry(self):
+        self.assertEqual(self.stat_cache.mode(__file__), os.stat(__file__).st_mode)
+        self.assertCounts(0, 1)
+
+    @unittest.skipUnless(hasattr(os, 'scandir'), "entries require os.scandir")
+    def test_entry_modes(self):
+        test_dir = os.path.dirname(os.path.abspath(__file__))
+        with os.scandir(test_dir) as entries:
+            for entry in entries:
+                self.stat_cache.add_entry(entry.path, entry)
+        self.assertTrue(stat.S_ISREG(self.stat_cache.mode(os.path.abspath(__file__))))
+        self.assertFalse(self.stat_func.called)
+        self.assertFalse(self.lstat_func.called)
+        self.assertCounts(1, 0)
+
+    @unittest.skipUnless(hasattr(os, 'scandir'), "entries require os.scandir")
+    def test_entry_stat(self):
+        path = os.path.abspath(__file__)
+        with os.scandir(os.path.dirname(path)) as entries:
+            entry = next(entry for entry in entries if entry.path == path)
+        self.stat_cache.add_entry(path, entry)
+        self.assertEqual(self.stat_cache.stat(path), os.stat(path))
+        self.assertFalse(self.stat_func.called)
+        self.assertCounts(0, 1)
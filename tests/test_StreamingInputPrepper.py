@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import io
+import os
+import unittest
+
+from operator import itemgetter
+
+import xargs_groupby as xg
+from . import mock
+
+class StreamingInputPrepperTestCase(unittest.TestCase):
+    ENCODING = 'latin-1'
+
+    def InputPrepper(self, key_func=itemgetter(0), delimiter=None, buffer_size=2, **kwargs):
+        return xg.StreamingInputPrepper(key_func, delimiter, self.ENCODING,
+                                        buffer_size=buffer_size, **kwargs)
+
+    def test_add_reads_nothing(self):
+        prepper = self.InputPrepper()
+        prepper.add(['ab', 'cd'])
+        self.assertFalse(prepper.done_reading())
+        self.assertEqual(prepper.new_keys_count(), 0)
+
+    def test_read_stops_at_new_key(self):
+        prepper = self.InputPrepper()
+        prepper.add(['ab', 'ac', 'bd'])
+        prepper.read()
+        self.assertEqual(prepper.new_keys_count(), 1)
+        self.assertEqual(list(prepper['a'].queue), [b'ab'])
+        prepper.read()
+        self.assertEqual(list(prepper['a'].queue), [b'ab', b'ac'])
+        self.assertEqual(prepper.new_keys_count(), 2)
+
+    def test_read_count(self):
+        prepper = self.InputPrepper(buffer_size=9)
+        prepper.add(['aa', 'ab', 'ac', 'ad'])
+        prepper.read(1)
+        prepper.read(2)
+        self.assertEqual(list(prepper['a'].queue), [b'aa', b'ab', b'ac'])
+        self.assertFalse(prepper.done_reading())
+
+    def test_done_reading(self):
+        prepper = self.InputPrepper()
+        prepper.add(['ab'])
+        prepper.read()
+        prepper.read()
+        self.assertTrue(prepper.done_reading())
+        self.assertEqual(list(prepper['a']), [b'ab'])
+
+    def test_group_pending_until_done(self):
+        prepper = self.InputPrepper()
+        prepper.add(['ab'])
+        prepper.read()
+        group = prepper['a']
+        self.assertEqual(next(group), b'ab')
+        self.assertIs(next(group), xg.INPUT_PENDING)
+        prepper.read()
+        with self.assertRaises(StopIteration):
+            next(group)
+
+    def test_iter_yields_keys_in_order(self):
+        prepper = self.InputPrepper()
+        prepper.add(['ab', 'cd', 'ae', 'ef'])
+        self.assertEqual(list(prepper), ['a', 'c', 'e'])
+        self.assertTrue(prepper.done_reading())
+
+    def test_no_len(self):
+        prepper = self.InputPrepper()
+        with self.assertRaises(TypeError):
+            len(prepper)
+
+    def test_blocked_when_started_group_full(self):
+        prepper = self.InputPrepper()
+        prepper.add(['ab', 'ac', 'ad', 'ae', 'af'])
+        prepper.read()
+        group = prepper['a']
+        next(group)
+        self.assertFalse(prepper.blocked())
+        prepper.read()
+        self.assertTrue(prepper.blocked())
+        self.assertEqual(list(group.queue), [b'ac', b'ad'])
+        next(group)
+        self.assertFalse(prepper.blocked())
+
+    def test_unstarted_group_never_blocks(self):
+        prepper = self.InputPrepper()
+        prepper.add(['ab', 'ac', 'ad', 'ae'])
+        prepper.read()
+        prepper.read(9)
+        self.assertFalse(prepper.blocked())
+        self.assertEqual(len(prepper['a'].queue), 4)
+
+    def test_closed_group_discards_input(self):
+        prepper = self.InputPrepper()
+        prepper.add(['ab', 'ac', 'ad'])
+        prepper.read()
+        group = prepper['a']
+        next(group)
+        group.close()
+        prepper.read(9)
+        self.assertFalse(prepper.blocked())
+        self.assertEqual(len(group.queue), 0)
+
+    def test_uses_1byte_delimiter(self):
+        prepper = self.InputPrepper(delimiter='\t')
+        self.assertEqual(prepper.delimiter('a'), b'\t'[0])
+
+    def test_defaults_to_null_delimiter(self):
+        prepper = self.InputPrepper()
+        self.assertEqual(prepper.delimiter('a'), b'\0'[0])
+
+    def test_error_on_null_without_delimiter(self):
+        prepper = self.InputPrepper()
+        prepper.add(['a\0b'])
+        with self.assertRaises(xg.UserArgumentsError):
+            prepper.read()
+
+    def test_null_allowed_with_other_delimiter(self):
+        prepper = self.InputPrepper(delimiter='\n')
+        prepper.add(['a\0b'])
+        prepper.read()
+        self.assertEqual(list(prepper['a'].queue), [b'a\0b'])
+
+    def test_read_error_wrapped(self):
+        prepper = self.InputPrepper()
+        prepper.add(iter(self._raise_io_error()))
+        with self.assertRaises(xg.UserArgumentsError) as exc_check:
+            prepper.read()
+        self.assertIsInstance(exc_check.exception.__cause__, IOError)
+
+    @staticmethod
+    def _raise_io_error():
+        raise IOError("test error")
+        yield
+
+    def test_read_stops_before_waiting_for_input(self):
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, write_fd)
+        with io.open(read_fd, 'rb') as in_stream:
+            prepper = self.InputPrepper(buffer_size=9)
+            prepper.add(xg.InputSplitter(in_stream, b'\n'))
+            os.write(write_fd, b'aa\nab\n')
+            prepper.read(9)
+            prepper.read(9)
+            self.assertEqual(list(prepper['a'].queue), [b'aa', b'ab'])
+            self.assertEqual(prepper.input_fd(), read_fd)
+            os.write(write_fd, b'ac\nad\n')
+            prepper.read(9)
+            self.assertEqual(list(prepper['a'].queue), [b'aa', b'ab', b'ac', b'ad'])
+
+    def test_read_batch_keys_before_waiting_for_input(self):
+        key_func = xg.BatchUserExpression('lambda args: [a[0] for a in args]')
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, write_fd)
+        with io.open(read_fd, 'rb') as in_stream:
+            prepper = self.InputPrepper(key_func, buffer_size=9)
+            prepper.add(xg.InputSplitter(in_stream, b'\n'))
+            os.write(write_fd, b'aa\nab\nba\n')
+            prepper.read(9)
+            self.assertEqual(list(prepper['a'].queue), [b'aa'])
+            self.assertIsNone(prepper.input_fd())
+            prepper.read(9)
+            self.assertEqual(list(prepper['a'].queue), [b'aa', b'ab'])
+            self.assertEqual(list(prepper['b'].queue), [b'ba'])
+            self.assertEqual(prepper.input_fd(), read_fd)
+            os.write(write_fd, b'ac\n')
+            prepper.read(9)
+            self.assertEqual(list(prepper['a'].queue), [b'aa', b'ab', b'ac'])
+
+    def test_input_fd_when_input_needed(self):
+        arg_seq = mock.MagicMock(name='arg_seq')
+        arg_seq.args_ready.return_value = False
+        arg_seq.input_fd.return_value = 5
+        prepper = self.InputPrepper()
+        prepper.add(arg_seq)
+        self.assertEqual(prepper.input_fd(), 5)
+        arg_seq.args_ready.return_value = True
+        self.assertIsNone(prepper.input_fd())
+
+    def test_no_input_fd_from_plain_sequence(self):
+        prepper = self.InputPrepper()
+        prepper.add(['ab'])
+        self.assertIsNone(prepper.input_fd())
+
+    def test_waiting_group_uses_new_group(self):
+        prepper = self.InputPrepper(new_group=xg.CompactArgsGroup)
+        prepper.add(['ab', 'ac'])
+        prepper.read()
+        prepper.read()
+        group = prepper['a']
+        self.assertIsInstance(group.queue, xg.CompactArgsGroup)
+        self.assertEqual(bytes(next(group)), b'ab')
+        prepper.add(['ad'])
+        prepper.read()
+        self.assertEqual(list(group.queue), [b'ad'])
+        self.assertEqual([bytes(arg) for arg in group], [b'ac', b'ad'])
+
+    def test_waiting_group_not_limited_by_buffer_size(self):
+        prepper = self.InputPrepper(new_group=xg.CompactArgsGroup)
+        prepper.add(['ab', 'ac', 'ad', 'ae'])
+        prepper.read(9)
+        prepper.read(9)
+        self.assertFalse(prepper.blocked())
+        self.assertEqual(len(prepper['a'].queue), 4)
+
+    def test_closed_waiting_group_discards_input(self):
+        prepper = self.InputPrepper(new_group=xg.CompactArgsGroup)
+        prepper.add(['ab', 'ac', 'ad'])
+        prepper.read(9)
+        group = prepper['a']
+        next(group)
+        group.close()
+        prepper.read(9)
+        self.assertEqual(list(group), [])
+
+    def test_waiting_groups_leave_spill_file(self):
+        spill_file = xg.SpillFile(1024)
+        prepper = self.InputPrepper(new_group=spill_file.new_group)
+        prepper.add(['ab', 'bc'])
+        prepper.read(9)
+        prepper.read(9)
+        self.assertEqual(len(spill_file.groups), 2)
+        next(prepper['a'])
+        prepper['b'].close()
+        self.assertEqual(list(spill_file.groups), [])
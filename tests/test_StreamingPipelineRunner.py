@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import unittest
+
+import xargs_groupby as xg
+from . import mock, mocks
+
+class FakeStreamingPrepper(object):
+    def __init__(self, keys_per_read, blocked_reads=0, input_fds=()):
+        self.keys_per_read = list(keys_per_read)
+        self.blocked_reads = blocked_reads
+        self.input_fds = list(input_fds)
+        self.new_keys = 0
+        self.read_count = 0
+
+    def done_reading(self):
+        return not self.keys_per_read
+
+    def new_keys_count(self):
+        return self.new_keys
+
+    def blocked(self):
+        if self.blocked_reads:
+            self.blocked_reads -= 1
+            return True
+        return False
+
+    def input_fd(self):
+        return self.input_fds.pop(0) if self.input_fds else None
+
+    def read(self, max_count=1):
+        self.read_count += 1
+        self.new_keys += self.keys_per_read.pop(0)
+
+
+class StreamingPipelineRunnerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.writer_fake = mocks.FakeMultiProcessWriter()
+        self.writer_mock = mock.Mock(wraps=self.writer_fake)
+        xg.StreamingPipelineRunner.MultiProcessWriter = mock.Mock(
+            return_value=self.writer_mock)
+
+    def pipelines_from(self, prepper, count):
+        for _ in range(count):
+            self.assertGreater(prepper.new_keys, 0)
+            prepper.new_keys -= 1
+            yield mocks.FakeProcessPipeline(
+                [mocks.FakeProcessWriter(need_writes=1)])
+
+    def run_pipelines(self, prepper, count, max_procs=4):
+        runner = xg.StreamingPipelineRunner(max_procs, prepper)
+        runner.run(self.pipelines_from(prepper, count))
+        return runner
+
+    def test_runs_all_pipelines(self):
+        prepper = FakeStreamingPrepper([1, 0, 2, 0])
+        runner = self.run_pipelines(prepper, 3)
+        self.assertEqual(runner.run_count(), 3)
+        self.assertEqual(runner.failures_count(), 0)
+        self.assertEqual(prepper.read_count, 4)
+
+    def test_starts_pipelines_before_input_done(self):
+        prepper = FakeStreamingPrepper([1, 0, 0])
+        started_counts = []
+        def read(max_count=1):
+            started_counts.append(runner.run_count())
+            FakeStreamingPrepper.read(prepper, max_count)
+        prepper.read = read
+        runner = xg.StreamingPipelineRunner(4, prepper)
+        runner.run(self.pipelines_from(prepper, 1))
+        self.assertEqual(started_counts, [0, 1, 1])
+
+    def test_only_starts_pipelines_for_seen_keys(self):
+        # pipelines_from asserts a key has been seen for each pipeline.
+        prepper = FakeStreamingPrepper([0, 0, 1])
+        runner = self.run_pipelines(prepper, 1)
+        self.assertEqual(runner.run_count(), 1)
+        self.assertEqual(prepper.read_count, 3)
+
+    def test_no_read_while_blocked(self):
+        prepper = FakeStreamingPrepper([1, 0], blocked_reads=2)
+        runner = self.run_pipelines(prepper, 1)
+        self.assertEqual(prepper.read_count, 2)
+        self.writer_mock.write_ready.assert_any_call(runner.WAIT_TIMEOUT)
+
+    def test_writes_while_waiting_for_input(self):
+        prepper = FakeStreamingPrepper([1, 0], input_fds=[None, 7])
+        runner = self.run_pipelines(prepper, 1)
+        self.assertEqual(prepper.read_count, 2)
+        self.writer_mock.write_until_readable.assert_called_once_with(
+            7, runner.WAIT_TIMEOUT)
+
+    def test_no_read_until_input_ready(self):
+        prepper = FakeStreamingPrepper([1, 0], input_fds=[7, 7])
+        self.writer_mock.write_until_readable.side_effect = [False, True]
+        runner = self.run_pipelines(prepper, 1)
+        self.assertEqual(prepper.read_count, 2)
+        self.assertEqual(self.writer_mock.write_until_readable.call_count, 2)
@@ -11,12 +11,17 @@ import io
 import itertools
 import os.path
 import re
+import sys
 import tarfile
+import threading
+import time
+import timeit
 import unittest
+import warnings
 import zipfile
 
 import xargs_groupby as xg
-from . import mock, FOREIGN_ENCODING
+from . import mock, FOREIGN_ENCODING, PY_MAJVER
 from .helpers import ExceptionWrapperTestHelper
 
 NONEXISTENT_PATH = os.path.join(__file__, '/_nonexistent/path')
@@ -68,6 +73,14 @@ class UserExpressionTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
         expr_s = 'lambda _: anything'
         self.test_syntax_error(expr_s, NameError, expr_s)
 
+    def test_comprehension_in_lambda(self):
+        expr = xg.UserExpression('lambda s: "".join(c for c in s if c.isdigit())')
+        self.assertEqual(expr('a1b2'), '12')
+
+    def test_comprehension_shortcut(self):
+        expr = xg.UserExpression('[c for c in _ if c.isdigit()]')
+        self.assertEqual(expr('a1b2'), ['1', '2'])
+
     def test_two_arbitrary_names_fail(self):
         expr_s = '_ * anything'
         self.test_syntax_error(expr_s, NameError, expr_s)
@@ -92,6 +105,15 @@ class UserExpressionTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
     def test_os_not_usable(self):
         self.test_syntax_error('os.abort', AttributeError)
 
+    def test_asyncio_subprocesses_not_usable(self):
+        self.test_syntax_error('asyncio.create_subprocess_exec', AttributeError)
+
+    def test_asyncio_sleep_not_usable(self):
+        self.test_syntax_error('asyncio.sleep', AttributeError)
+
+    def test_evaluation_error(self):
+        self.test_syntax_error('{}["x"].get', KeyError)
+
     def test_other_imported_module_not_usable(self):
         self.test_syntax_error('warnings.resetwarnings', NameError)
 
@@ -152,6 +174,133 @@ class UserExpressionTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
         self.test_zipfile_not_addable(class_name='zipfile.PyZipFile', method_name='extractall')
 
 
+class UserExpressionModuleLoadingTestCase(unittest.TestCase):
+    def test_concurrent_first_use_loads_once(self, module_name='colorsys'):
+        build_calls = []
+        orig_build = xg.UserExpression._build_whitelisted_module
+        def slow_build(module_name, names_whitelist):
+            build_calls.append(module_name)
+            time.sleep(0.05)
+            return orig_build(module_name, names_whitelist)
+        exprs = []
+        orig_sys_path = sys.path
+        with mock.patch.dict(xg.UserExpression._EVAL_VARS), \
+             mock.patch.object(xg.UserExpression, '_build_whitelisted_module',
+                               staticmethod(slow_build)):
+            xg.UserExpression._EVAL_VARS.pop(module_name, None)
+            threads = [threading.Thread(target=lambda: exprs.append(
+                xg.UserExpression(module_name + '.rgb_to_hsv'))) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(build_calls, [module_name])
+        self.assertEqual(len(exprs), 4)
+        self.assertIs(sys.path, orig_sys_path)
+
+
+class UserExpressionFastCallsTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
+    def test_fast_calls(self):
+        expr = xg.UserExpression('_.upper()')
+        with expr.fast_calls() as func:
+            self.assertEqual(func('test'), 'TEST')
+
+    def test_fast_calls_ignore_resource_warnings(self):
+        expr = xg.UserExpression('_.upper()')
+        with warnings.catch_warnings(record=True) as caught_warnings:
+            warnings.simplefilter('always')
+            with expr.fast_calls():
+                warnings.warn("test", ResourceWarning)
+            warnings.warn("test", ResourceWarning)
+        self.assertEqual(len(caught_warnings), 1)
+
+    def test_runtime_error(self):
+        expr = xg.UserExpression('1 // len(_)')
+        with self.assertRaisesWrapped(ZeroDivisionError, xg.UserExpressionRuntimeError, ''):
+            with expr.fast_calls() as func:
+                try:
+                    func('')
+                except Exception as error:
+                    raise expr.runtime_error('', error)
+
+    def test_prepper_error_reported_for_arg(self):
+        prepper = xg.InputPrepper(xg.UserExpression('1 // len(_)'), None, 'utf-8')
+        with self.assertRaisesWrapped(ZeroDivisionError, xg.UserExpressionRuntimeError, ''):
+            prepper.add(['a', '', 'b'])
+
+    def test_prepper_sets_up_warnings_once(self):
+        expr = xg.UserExpression('len')
+        prepper = xg.InputPrepper(expr, None, 'utf-8')
+        with mock.patch.object(xg.warnings, 'catch_warnings',
+                               wraps=warnings.catch_warnings) as catch_warnings:
+            prepper.add(['a', 'bb', 'cc'])
+        self.assertEqual(catch_warnings.call_count, 1)
+        self.assertEqual(sorted(prepper), [1, 2])
+
+    def test_benchmark_per_argument_overhead(self):
+        # Compare the per-argument cost of grouping with one call per
+        # argument, to grouping with fast_calls().
+        args = ['arg{}'.format(n) for n in range(2000)]
+        expr = xg.UserExpression('len')
+        def single_calls():
+            prepper = xg.InputPrepper(expr, None, 'utf-8')
+            prepper._fast_group_func = lambda: NoFastCalls()
+            prepper.add(args)
+        def fast_calls():
+            prepper = xg.InputPrepper(expr, None, 'utf-8')
+            prepper.add(args)
+        single_time = min(timeit.repeat(single_calls, number=1, repeat=5))
+        fast_time = min(timeit.repeat(fast_calls, number=1, repeat=5))
+        per_arg_msg = "per argument: {:.2f}us with single calls, {:.2f}us with fast_calls".format(
+            single_time * 1e6 / len(args), fast_time * 1e6 / len(args))
+        self.assertLess(fast_time, single_time, per_arg_msg)
+
+
+class UserExpressionMemoizeTestCase(unittest.TestCase, ExceptionWrapperTestHelper):
+    def test_memoized_results(self):
+        expr = xg.UserExpression('_.upper()')
+        expr.memoize(8)
+        self.assertEqual(list(map(expr, ['a', 'b', 'a'])), ['A', 'B', 'A'])
+        cache_info = expr.cache_info()
+        self.assertEqual((cache_info.hits, cache_info.misses), (1, 2))
+
+    def test_memoized_fast_calls(self):
+        expr = xg.UserExpression('_.upper()')
+        expr.memoize(8)
+        with expr.fast_calls() as func:
+            func('a')
+            func('a')
+        self.assertEqual(expr.cache_info().hits, 1)
+
+    def test_memoize_size_limit(self):
+        expr = xg.UserExpression('_.upper()')
+        expr.memoize(1)
+        for arg in ['a', 'b', 'a']:
+            expr(arg)
+        self.assertEqual(expr.cache_info().hits, 0)
+
+    def test_errors_not_memoized(self):
+        expr = xg.UserExpression('1 // len(_)')
+        expr.memoize(8)
+        for _ in range(2):
+            with self.assertRaisesWrapped(ZeroDivisionError, xg.UserExpressionRuntimeError, ''):
+                expr('')
+        self.assertEqual(expr.cache_info().misses, 2)
+
+    def test_no_cache_info_without_memoize(self):
+        expr = xg.UserExpression('_.upper()')
+        with self.assertRaises(AttributeError):
+            expr.cache_info()
+
+
+class NoFastCalls(object):
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        pass
+
+
 def IOWrapperTests(expr_func_name, bad_modes,
                    call_fmt='{0}(_, {1!r}).read(1)', src_func_name=None):
     if src_func_name is None:
@@ -202,3 +351,84 @@ TarOpenWrapperTest = IOWrapperTests('tarfile.open', TAR_BAD_MODES)
 TarFileWrapperTest = IOWrapperTests('tarfile.TarFile', TAR_BAD_MODES)
 ZipFileWrapperTest = IOWrapperTests('zipfile.ZipFile', 'wa')
 PyZipFileWrapperTest = IOWrapperTests('zipfile.PyZipFile', 'wa')
+
+
+class UserExpressionStatCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stat_func = mock.Mock(name='stat', wraps=os.stat)
+        self.lstat_func = mock.Mock(name='lstat', wraps=os.lstat)
+        self.stat_cache = xg.StatCache(self.stat_func, self.lstat_func)
+
+    def assertCached(self, expr_s, args, expected):
+        expr = xg.UserExpression(expr_s)
+        uncached = [expr(arg) for arg in args]
+        expr.use_stat_cache(self.stat_cache)
+        self.assertEqual([expr(arg) for arg in args], uncached)
+        self.assertEqual([expr(arg) for arg in args], expected)
+        self.assertEqual(self.stat_cache.misses, len(set(args)))
+
+    def test_stat(self):
+        self.assertCached('os.stat(_).st_size', [__file__], [os.stat(__file__).st_size])
+
+    def test_getsize(self):
+        self.assertCached('os.path.getsize', [__file__], [os.path.getsize(__file__)])
+
+    def test_getmtime(self):
+        self.assertCached('os.path.getmtime', [__file__], [os.path.getmtime(__file__)])
+
+    def test_isdir(self):
+        self.assertCached('os.path.isdir', [__file__, os.path.dirname(__file__),
+                                            NONEXISTENT_PATH], [False, True, False])
+
+    def test_isfile(self):
+        self.assertCached('os.path.isfile', [__file__, os.path.dirname(__file__),
+                                             NONEXISTENT_PATH], [True, False, False])
+
+    def test_exists(self):
+        self.assertCached('os.path.exists', [__file__, NONEXISTENT_PATH], [True, False])
+
+    def test_islink(self):
+        self.assertCached('os.path.islink', [__file__], [False])
+        self.assertFalse(self.stat_func.called)
+        self.lstat_func.assert_called_once_with(__file__)
+
+    def test_shared_across_calls(self):
+        expr = xg.UserExpression('(os.path.isdir(_), os.path.getsize(_), os.stat(_).st_mode)')
+        expr.use_stat_cache(self.stat_cache)
+        expr(__file__)
+        self.stat_func.assert_called_once_with(__file__)
+        self.assertEqual((self.stat_cache.hits, self.stat_cache.misses), (2, 1))
+
+    @unittest.skipIf(PY_MAJVER < 3, "os.stat follow_symlinks requires Python 3")
+    def test_stat_with_options_not_cached(self):
+        expr = xg.UserExpression('os.stat(_, follow_symlinks=False)')
+        expr.use_stat_cache(self.stat_cache)
+        self.assertEqual(expr(__file__), os.lstat(__file__))
+        self.assertEqual(self.stat_cache.misses, 0)
+
+    def test_not_shared_with_other_expressions(self):
+        expr = xg.UserExpression('os.path.getsize')
+        expr.use_stat_cache(self.stat_cache)
+        expr(__file__)
+        other_expr = xg.UserExpression('os.path.getsize')
+        other_expr(__file__)
+        with other_expr.fast_calls() as func:
+            func(__file__)
+        self.assertEqual((self.stat_cache.hits, self.stat_cache.misses), (0, 1))
+        self.assertIsNone(xg.UserExpression.stat_cache)
+
+    def test_only_active_during_calls(self):
+        expr = xg.UserExpression('os.path.getsize')
+        expr.use_stat_cache(self.stat_cache)
+        with expr.fast_calls() as func:
+            func(__file__)
+        expr.func(__file__)
+        self.assertEqual((self.stat_cache.hits, self.stat_cache.misses), (0, 1))
+
+    def test_error_cached(self):
+        expr = xg.UserExpression('os.path.getsize')
+        expr.use_stat_cache(self.stat_cache)
+        for _ in range(2):
+            with self.assertRaises(xg.UserExpressionRuntimeError):
+                expr(NONEXISTENT_PATH)
+        self.assertEqual((self.stat_cache.hits, self.stat_cache.misses), (1, 1))
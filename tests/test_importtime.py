@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import subprocess
+import sys
+import unittest
+
+import xargs_groupby as xg
+
+@unittest.skipIf(sys.version_info < (3, 7), "-X importtime requires Python 3.7")
+class ImportTimeTestCase(unittest.TestCase):
+    # xargs_groupby imports these itself when a run needs them.
+    DEFERRED_MODULES = frozenset([
+        'asyncio', 'inspect', 'multiprocessing', 'pickle', 'sqlite3',
+        'tempfile',
+    ])
+    # Before 3.8, subprocess imports threading, which imports traceback.
+    if sys.version_info >= (3, 8):
+        DEFERRED_MODULES |= frozenset(['traceback'])
+    # Every run needs argparse.  Everything xargs_groupby imports, argparse
+    # included, should take at most this many times as long.
+    BUDGET_RATIO = 3
+    RUNS_COUNT = 3
+
+    @classmethod
+    def import_times(cls):
+        proc = subprocess.Popen(
+            [sys.executable, '-X', 'importtime', '-c', 'import xargs_groupby'],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            cwd=os.path.dirname(os.path.abspath(xg.__file__)))
+        _, stderr = proc.communicate()
+        times = {}
+        for line in stderr.decode('utf-8').splitlines():
+            try:
+                self_us, cumulative_us, name = line.split(':', 1)[1].split('|')
+                times[name.strip()] = (int(self_us), int(cumulative_us))
+            except ValueError:
+                pass
+        return times
+
+    @classmethod
+    def setUpClass(cls):
+        cls.runs = [cls.import_times() for _ in range(cls.RUNS_COUNT)]
+
+    def test_deferred_modules_not_imported(self):
+        imported = set(name.split('.', 1)[0] for name in self.runs[0])
+        self.assertIn('xargs_groupby', imported)
+        self.assertEqual(imported & self.DEFERRED_MODULES, set())
+
+    def test_dependencies_within_budget(self):
+        # Compare the best run, to be less sensitive to a busy machine.
+        # xargs_groupby's own time is left out, because it includes
+        # compiling the module when bytecode isn't cached.
+        ratios = []
+        for times in self.runs:
+            self_us, cumulative_us = times['xargs_groupby']
+            ratios.append((cumulative_us - self_us) / times['argparse'][1])
+        self.assertLessEqual(min(ratios), self.BUDGET_RATIO)
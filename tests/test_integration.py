@@ -9,15 +9,20 @@ from __future__ import unicode_literals
 import contextlib
 import io
 import locale
+import os
+import select
+import shutil
 import subprocess
 import sys
 import tempfile
+import time
 import unittest
 
 from argparse import Namespace
 
 import xargs_groupby as xg
 from . import TEST_FLAGS
+from .helpers import unix_key_server
 
 try:
     unicode
@@ -44,7 +49,8 @@ def run_and_check(cmd, ok_exitcodes=ZERO_SET):
 runnable_tools = {
     'xargs': run_and_check(['xargs', '--version']),
     'echo': run_and_check(['echo', '--version']),
-    'test': run_and_check(['test', 'string'])
+    'test': run_and_check(['test', 'string']),
+    'sed': run_and_check(['sed', '--version']),
 }
 
 @unittest.skipUnless(TEST_FLAGS.want_integration,
@@ -57,10 +63,10 @@ class IntegrationTestCase(unittest.TestCase):
 
     @staticmethod
     @contextlib.contextmanager
-    def io_wrapper(file_obj, encoding=ENCODING):
+    def io_wrapper(file_obj, encoding=ENCODING, errors='surrogateescape'):
         mode = file_obj.mode.replace('b', '')
-        with file_obj, io.open(file_obj.fileno(), mode,
-                               encoding=encoding, closefd=False) as io_file:
+        with file_obj, io.open(file_obj.fileno(), mode, encoding=encoding,
+                               errors=errors, closefd=False) as io_file:
             yield io_file
 
     def require_tools(*tool_names):
@@ -133,6 +139,176 @@ class IntegrationTestCase(unittest.TestCase):
             "456 456789",
         )
 
+    @require_tools('echo')
+    def test_undecodable_null_delimited_input(self):
+        with tempfile.NamedTemporaryFile(prefix='xgtest') as argfile:
+            argfile.write(b'a\xff\x00b\x00a\xfe\x00')
+            argfile.flush()
+            self.run_xg(
+                ['--null', '--arg-file', argfile.name, 's[0]', 'echo'],
+                "unused stdin",
+            )
+        self.expect_stdout("a\udcff a\udcfe", "b")
+
+    @require_tools('echo')
+    def test_batch_group_code(self):
+        self.run_xg(
+            ['--batch-group-code', 'lambda words: map(len, words)', 'echo'],
+            "cat snake hedgehog\ndog horse\n",
+        )
+        self.expect_stdout("cat dog", "snake horse", "hedgehog")
+
+    @require_tools('echo')
+    def test_group_workers(self):
+        self.run_xg(
+            ['--group-workers', '2', 'len', 'echo'],
+            "cat snake hedgehog\ndog horse\n",
+        )
+        self.expect_stdout("cat dog", "snake horse", "hedgehog")
+
+    @require_tools('echo')
+    def test_group_threads(self):
+        self.run_xg(
+            ['--group-threads', '4', 'len', 'echo'],
+            "cat snake hedgehog\ndog horse\n",
+        )
+        self.expect_stdout("cat dog", "snake horse", "hedgehog")
+
+    @unittest.skipIf(xg.PY_MAJVER < 3, "--async-group-code requires Python 3")
+    @require_tools('echo')
+    def test_async_group_code(self):
+        with unix_key_server() as socket_path:
+            self.run_xg(
+                ['--async-group-code=4', '--query-socket', socket_path,
+                 'lambda s: asyncio.unix_query({!r}, b"0 " + s[-1:].encode())'.format(
+                     socket_path),
+                 'echo'],
+                "cat snake hedgehog\ndog horse\n",
+            )
+        self.expect_stdout("cat", "snake horse", "hedgehog dog")
+
+    @require_tools('echo')
+    def test_group_by(self):
+        self.run_xg(
+            ['--group-by', 'ext', 'echo'],
+            "a.py b.txt c.py\nd\n",
+        )
+        self.expect_stdout("a.py c.py", "b.txt", "d")
+
+    @require_tools('echo')
+    def test_keyed_input(self):
+        self.run_xg(
+            ['--keyed-input', 'echo'],
+            "s1\ta b\ns2\tc\ns1\td\n",
+        )
+        self.expect_stdout("a b d", "c")
+
+    @require_tools('echo', 'sed')
+    def test_group_cmd(self):
+        self.run_xg(
+            ['--group-cmd', 'sed', 's/.*[.]//', ';', 'echo'],
+            "a.txt b.py c.txt\n",
+        )
+        self.expect_stdout("a.txt c.txt", "b.py")
+
+    def start_server(self, tmpdir):
+        sock_path = os.path.join(tmpdir, 'xg.sock')
+        server = subprocess.Popen(
+            [sys.executable, xg.__file__, '--serve', sock_path, '-P', self.MAX_PROCS])
+        self.addCleanup(server.wait)
+        self.addCleanup(server.terminate)
+        for _ in range(100):
+            if os.path.exists(sock_path):
+                break
+            time.sleep(.05)
+        return sock_path
+
+    @unittest.skipIf(sys.version_info < (3,), "--serve requires Python 3")
+    @require_tools('echo')
+    def test_serve_connect(self):
+        tmpdir = tempfile.mkdtemp(prefix='xgtest')
+        self.addCleanup(shutil.rmtree, tmpdir)
+        sock_path = self.start_server(tmpdir)
+        for _ in range(2):
+            self.stdout_lines = []
+            self.run_xg(
+                ['--connect', sock_path, 'len', 'echo'],
+                "cat snake hedgehog\ndog horse\n",
+            )
+            self.expect_stdout("cat dog", "snake horse", "hedgehog")
+        self.run_xg(['--connect', sock_path, '(', 'echo'], "cat\n",
+                    ok_exitcodes=frozenset([3]))
+
+    @unittest.skipIf(sys.version_info < (3,), "--serve requires Python 3")
+    @require_tools('echo')
+    def test_connect_first_uses_client_directory(self):
+        tmpdir = tempfile.mkdtemp(prefix='xgtest')
+        self.addCleanup(shutil.rmtree, tmpdir)
+        sock_path = self.start_server(tmpdir)
+        for key in ['one', 'two']:
+            run_dir = os.path.join(tmpdir, key)
+            os.mkdir(run_dir)
+            with io.open(os.path.join(run_dir, 'map.json'), 'w') as map_file:
+                map_file.write('{{"cat": "{0}", "dog": "{0}"}}'.format(key))
+            proc = subprocess.Popen(
+                [sys.executable, xg.__file__, '--connect', sock_path,
+                 'json.load(io.open("map.json")).get', 'echo', '{}:'.format(key)],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=run_dir)
+            stdout, _ = proc.communicate(b"cat dog\n")
+            self.assertEqual(proc.returncode, 0)
+            self.assertEqual(stdout.decode('ascii'), "{}: cat dog\n".format(key))
+
+    @unittest.skipIf(sys.version_info < (3,), "--expand-dirs requires Python 3")
+    @require_tools('echo')
+    def test_expand_dirs(self):
+        tmpdir = tempfile.mkdtemp(prefix='xgtest')
+        self.addCleanup(shutil.rmtree, tmpdir)
+        os.mkdir(os.path.join(tmpdir, 'sub'))
+        for name in ['a.txt', 'b.py', os.path.join('sub', 'c.txt')]:
+            open(os.path.join(tmpdir, name), 'w').close()
+        self.run_xg(
+            ['--expand-dirs', 'os.path.splitext(_)[1]', 'echo'],
+            tmpdir + "\n",
+        )
+        self.expect_stdout(
+            " ".join(os.path.join(tmpdir, name) for name in ['a.txt', 'sub/c.txt']),
+            os.path.join(tmpdir, 'b.py'))
+
+    @require_tools('echo')
+    def test_key_cache(self):
+        tmpdir = tempfile.mkdtemp(prefix='xgtest')
+        try:
+            cache_path = os.path.join(tmpdir, 'keys.db')
+            for _ in range(2):
+                self.stdout_lines = []
+                self.run_xg(
+                    ['--key-cache', cache_path, 'len', 'echo'],
+                    "cat snake hedgehog\ndog horse\n",
+                )
+        finally:
+            shutil.rmtree(tmpdir)
+        self.expect_stdout("cat dog", "snake horse", "hedgehog")
+
+    @require_tools('echo')
+    def test_memoize_group_code(self):
+        self.run_xg(
+            ['--memoize-group-code', 'len', 'echo'],
+            "cat snake hedgehog\ndog horse cat\n",
+        )
+        self.expect_stdout("cat dog cat", "snake horse", "hedgehog")
+
+    @require_tools('echo')
+    def test_parse_workers(self):
+        with tempfile.NamedTemporaryFile(prefix='xgtest') as argfile:
+            argfile.write(b'apple\x00banana\x00avocado\x00cherry\x00blueberry\x00apricot')
+            argfile.flush()
+            self.run_xg(
+                ['--null', '--parse-workers', '2', '--arg-file', argfile.name,
+                 's[0]', 'echo'],
+                "unused stdin",
+            )
+        self.expect_stdout("apple avocado apricot", "banana blueberry", "cherry")
+
     @require_tools('echo')
     def test_arg_file_replace_str_multibyte_delimiter(self):
         with tempfile.NamedTemporaryFile(prefix='xgtest') as argfile:
@@ -157,6 +333,78 @@ class IntegrationTestCase(unittest.TestCase):
             "bb in B",
         )
 
+    @require_tools('echo')
+    def test_stream(self):
+        self.run_xg(
+            ['--stream', '--stream-buffer', '1', '--group-str', '{G}',
+             'w[0]', 'echo', '{G}:'],
+            "apple banana avocado\ncherry blueberry\n",
+        )
+        self.expect_stdout("a: apple avocado", "b: banana blueberry", "c: cherry")
+
+    def check_stream_latency(self, delimiter_args, group_args=['w[0]']):
+        # Each argument should reach its command before the next one
+        # is written, without waiting for more input.
+        proc = subprocess.Popen(
+            [sys.executable, xg.__file__, '--stream', '--max-procs', '2', '-n', '1']
+            + delimiter_args + group_args + ['echo'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+        try:
+            for arg in [b'apple', b'avocado', b'banana', b'blueberry']:
+                proc.stdin.write(arg + b'\n')
+                ready = select.select([proc.stdout], [], [], 10)[0]
+                self.assertTrue(ready, "no output for {!r}".format(arg))
+                self.assertEqual(proc.stdout.readline(), arg + b'\n')
+        finally:
+            proc.stdin.close()
+            proc.stdout.read()
+            proc.wait()
+
+    @require_tools('echo')
+    def test_stream_latency(self):
+        self.check_stream_latency(['--delimiter', '\\n'])
+
+    @require_tools('echo')
+    def test_stream_latency_whitespace(self):
+        self.check_stream_latency([])
+
+    @require_tools('echo')
+    def test_stream_latency_group_by(self):
+        self.check_stream_latency(['--delimiter', '\\n'], ['--group-by', 'ext'])
+
+    @require_tools('echo')
+    def test_stream_latency_batch_group_code(self):
+        self.check_stream_latency(
+            [], ['--batch-group-code', 'lambda words: [w[0] for w in words]'])
+
+    @require_tools('echo')
+    def test_args_via_file(self):
+        self.run_xg(
+            ['--args-via-file', 'w[0]', 'echo'],
+            "apple banana avocado\ncherry blueberry apricot\n",
+        )
+        self.expect_stdout("apple avocado apricot", "banana blueberry", "cherry")
+
+    @require_tools('echo')
+    def test_memory_limit(self):
+        self.run_xg(
+            ['--memory-limit', '8', 'w[0]', 'echo'],
+            "apple banana avocado\ncherry blueberry apricot\n",
+        )
+        self.expect_stdout("apple avocado apricot", "banana blueberry", "cherry")
+
+    @require_tools('echo')
+    def test_sorted_input(self):
+        self.run_xg(
+            ['--sorted-input', 'w[0]', 'echo'],
+            "apple avocado\nbanana blueberry\ncherry\n",
+        )
+        self.expect_stdout("apple avocado", "banana blueberry", "cherry")
+
+    @require_tools('echo')
+    def test_sorted_input_repeat_error(self):
+        self.run_xg(['--sorted-input', 'w[0]', 'echo'], "apple banana avocado", [3])
+
     @require_tools('test')
     def test_failures(self):
         self.run_xg(
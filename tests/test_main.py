@@ -13,14 +13,39 @@ from . import mock
 from .helpers import NoopMock
 
 class MainTestCase(unittest.TestCase):
+    def run_main(self, connect=None, serve=None):
+        self.arglist = NoopMock(name='arglist')
+        self.prog_mock = mock.Mock(name='Program')
+        self.program = self.prog_mock.from_arglist()
+        self.program.args.connect = connect
+        self.program.args.serve = serve
+        self.excepthook_mock = mock.Mock(name='ExceptHook')
+        self.server_mock = mock.Mock(name='JobServer')
+        self.client_mock = mock.Mock(name='JobClient')
+        return xg.main(self.arglist, self.prog_mock, self.excepthook_mock,
+                       self.server_mock, self.client_mock)
+
     def test_main_connections(self):
-        arglist = NoopMock(name='arglist')
-        prog_mock = mock.Mock(name='Program')
-        excepthook_mock = mock.Mock(name='ExceptHook')
-        exitcode = xg.main(arglist, prog_mock, excepthook_mock)
-        prog_mock.from_arglist.assert_called_with(arglist)
-        program = prog_mock.from_arglist()
-        excepthook_mock.with_sys_stderr.assert_called_with(program.args.encoding)
-        self.assertIs(excepthook_mock.with_sys_stderr().show_tb, program.args.debug)
+        exitcode = self.run_main()
+        self.prog_mock.from_arglist.assert_called_with(self.arglist)
+        program = self.program
+        self.excepthook_mock.with_sys_stderr.assert_called_with(program.args.encoding)
+        self.assertIs(self.excepthook_mock.with_sys_stderr().show_tb, program.args.debug)
         program.main.assert_called_with()
         self.assertIs(exitcode, program.main())
+        self.assertFalse(self.server_mock.called)
+        self.assertFalse(self.client_mock.called)
+
+    def test_main_connect(self):
+        exitcode = self.run_main(connect='/tmp/xg.sock')
+        self.client_mock.assert_called_with('/tmp/xg.sock')
+        self.client_mock().run.assert_called_with(self.arglist)
+        self.assertIs(exitcode, self.client_mock().run())
+        self.assertFalse(self.program.main.called)
+
+    def test_main_serve(self):
+        exitcode = self.run_main(serve='/tmp/xg.sock')
+        self.server_mock.assert_called_with('/tmp/xg.sock', self.program.args.max_procs)
+        self.server_mock().serve.assert_called_with()
+        self.assertIs(exitcode, self.server_mock().serve())
+        self.assertFalse(self.program.main.called)
@@ -21,27 +21,104 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>."""
 
+import os
+import struct
+import sys
+
+# A --connect run only sends its arguments to a --serve process, and most
+# of the time it would spend is importing the rest of this module.  So the
+# client side of the protocol comes first, and the script runs it before
+# anything else when --connect is its first option.  See JobServer.
+# A request is _JOB_HEADER, then its fields joined with NUL: cwd, the
+# number of arguments, each argument, then each environment variable.
+_JOB_HEADER = struct.Struct(str('!I'))
+_JOB_EXITCODE = struct.Struct(str('!i'))
+_JOB_STDIO_FDS = (0, 1, 2)
+
+def _encode_job_request(cwd, arglist, environ):
+    fields = [cwd, str(len(arglist)).encode('ascii')]
+    fields.extend(arglist)
+    fields.extend(key + b'=' + value for key, value in environ.items())
+    payload = b'\0'.join(fields)
+    return _JOB_HEADER.pack(len(payload)), payload
+
+def _recv_exactly(conn, size):
+    data = b''
+    while len(data) < size:
+        chunk = conn.recv(size - len(data))
+        if not chunk:
+            raise ValueError("connection closed early")
+        data += chunk
+    return data
+
+def _send_job(path, arglist):
+    # The socket module imports much more than this needs.
+    import _socket
+    header, payload = _encode_job_request(
+        os.fsencode(os.getcwd()), [os.fsencode(arg) for arg in arglist], os.environb)
+    sock = _socket.socket(_socket.AF_UNIX, _socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        fds = struct.pack(str('{}i'.format(len(_JOB_STDIO_FDS))), *_JOB_STDIO_FDS)
+        sock.sendmsg([header], [(_socket.SOL_SOCKET, _socket.SCM_RIGHTS, fds)])
+        sock.sendall(payload)
+        response = _recv_exactly(sock, _JOB_EXITCODE.size)
+    finally:
+        sock.close()
+    return _JOB_EXITCODE.unpack(response)[0]
+
+def _connect_main(arglist):
+    # Returns the run's exit status, or None if it should go through main().
+    if arglist[:1] == ['--connect']:
+        path = arglist[1:2]
+    elif arglist[:1] and arglist[0].startswith('--connect='):
+        path = [arglist[0][len('--connect='):]]
+    else:
+        return None
+    if (not path) or (not hasattr(os, 'fsencode')):
+        return None
+    try:
+        return _send_job(path[0], arglist)
+    except KeyboardInterrupt:
+        return 127
+    except (EnvironmentError, ValueError) as error:
+        sys.stderr.write("xargs_groupby: error using server socket {!r}: {}\n".format(
+            path[0], getattr(error, 'strerror', None) or error))
+        return 3
+
+if __name__ == '__main__':
+    _connect_exitcode = _connect_main(sys.argv[1:])
+    if _connect_exitcode is not None:
+        sys.exit(_connect_exitcode)
+
 import argparse
+import array
 import ast
+import codecs
 import collections
 import contextlib
 import errno
 import functools
-import imp
 import importlib
-import inspect
 import io
 import itertools
 import locale
-import os
+import mmap
+import posixpath
 import re
 import select
 import shlex
 import signal
+import stat
 import subprocess
-import sys
-import traceback
+import threading
+import types
 import warnings
+import weakref
+
+# Most runs don't need asyncio, inspect, multiprocessing, pickle, sqlite3,
+# tempfile, or traceback, and they're slow to import, so code that uses
+# them imports them itself.
 
 try:
     unicode
@@ -50,6 +127,17 @@ except NameError:
 
 ENCODING = locale.getpreferredencoding()
 PY_MAJVER = sys.version_info.major
+DECODE_ERRORS = 'surrogateescape' if (PY_MAJVER >= 3) else 'replace'
+
+# The array typecode for file offsets and sizes.  Python 2 doesn't have
+# 'Q', but its 'L' is 64 bits on most Unix systems.
+try:
+    array.array(str('Q'))
+except ValueError:
+    OFFSET_TYPECODE = str('L')
+else:
+    OFFSET_TYPECODE = str('Q')
+OFFSET_SIZE = array.array(OFFSET_TYPECODE).itemsize
 
 class UserInputError(ValueError):
     pass
@@ -77,6 +165,14 @@ class UserExpressionRuntimeError(UserExpressionError):
     pass
 
 
+class UserKeyCacheError(UserInputError):
+    pass
+
+
+class UserServerError(UserInputError):
+    pass
+
+
 class ExceptHook(object):
     HEADERS = {
         EnvironmentError: "error",
@@ -90,6 +186,8 @@ class ExceptHook(object):
         UserCommandError: "error running {!r}",
         UserExpressionCompileError: "error compiling group code {!r}",
         UserExpressionRuntimeError: "group code raised an error on argument {!r}",
+        UserKeyCacheError: "error using key cache {!r}",
+        UserServerError: "error using server socket {!r}",
     }
 
     def __init__(self, stderr):
@@ -120,7 +218,12 @@ class ExceptHook(object):
     def _report_OSError(self, exception):
         if exception.filename:
             yield self._stringify(exception.filename)
-        yield self._stringify(exception.strerror)
+        if exception.strerror is not None:
+            yield self._stringify(exception.strerror)
+        else:
+            # Like TimeoutError() from asyncio.wait_for().
+            for message in self._report_base_error(exception):
+                yield message
 
     _report_EnvironmentError = _report_OSError
 
@@ -137,10 +240,10 @@ class ExceptHook(object):
                 yield self._exception_message(exception)
 
     def _report_base_error(self, exception):
-        yield self._exception_message(exception)
+        yield self._exception_message(exception) or type(exception).__name__
 
     def _find_handler(self, exc_root, get_func, fail_errors, default):
-        for exc_class in inspect.getmro(exc_root):
+        for exc_class in exc_root.__mro__:
             try:
                 handler = get_func(exc_class)
             except fail_errors:
@@ -184,6 +287,7 @@ class ExceptHook(object):
             exception_type = type(exception)
         self.stderr.write("\n")
         if self.show_tb:
+            import traceback
             tb_output = traceback.format_exception(exc_type, exc_value, exc_tb)
             for s in tb_output:
                 self.stderr.write(self._stringify(s))
@@ -192,6 +296,7 @@ class ExceptHook(object):
 If you can, please rerun your command with the `--debug` option
 and send the full output as a bug report.  Thanks in advance!
 """)
+        self.stderr.flush()
         if issubclass(exc_type, UserInputError):
             exitcode = 3
         else:
@@ -283,8 +388,24 @@ class SignalBroadcaster(object):
                 raise
 
 
+def _readable_func(in_stream):
+    # Return a function that says whether in_stream has input to read now,
+    # as far as the OS can tell.  Files and streams without a file
+    # descriptor always do.
+    try:
+        fd = in_stream.fileno()
+        is_file = stat.S_ISREG(os.fstat(fd).st_mode)
+    except (AttributeError, EnvironmentError, TypeError, ValueError):
+        is_file = True
+    if is_file:
+        return lambda: True
+    select_args = ([fd], [], [], 0)
+    return lambda: bool(select.select(*select_args)[0])
+
+
 class InputShlexer(object):
     SHLEX_CODING = 'iso-8859-1'
+    READ_SIZE = 65536
 
     class _WordChars(object):
         def __init__(self, exclude_chars):
@@ -294,101 +415,595 @@ class InputShlexer(object):
             return char not in self.exclude_chars
 
 
+    class _PiecesReader(object):
+        # Just enough of a file for shlex to read from a sequence of strings.
+        def __init__(self, pieces):
+            self.pieces = iter(pieces)
+            self.current = io.StringIO()
+
+        def read(self, size=-1):
+            data = self.current.read(size)
+            while not data:
+                try:
+                    piece = next(self.pieces)
+                except StopIteration:
+                    break
+                self.current = io.StringIO(piece)
+                data = self.current.read(size)
+            return data
+
+
     def __init__(self, in_stream, eof_str):
         self.in_stream = in_stream
         self.eof_line = None if (eof_str is None) else (eof_str + '\n')
         self.shlex = shlex.shlex('', getattr(in_stream, 'name', None), posix=True)
         self.shlex.commenters = ''
         self.shlex.whitespace_split = True
-        exclude_chars = [getattr(self.shlex, name) for name in
-                         ['whitespace', 'quotes', 'escape']]
-        chars_type = type(exclude_chars[0])
-        exclude_chars = chars_type().join(exclude_chars)
-        if not issubclass(chars_type, unicode):
-            exclude_chars = exclude_chars.decode(self.SHLEX_CODING)
-        self.shlex.wordchars = self._WordChars(exclude_chars)
+        whitespace, quotes, escape = (
+            self._decode_chars(getattr(self.shlex, name))
+            for name in ['whitespace', 'quotes', 'escape'])
+        self.shlex.wordchars = self._WordChars(whitespace + quotes + escape)
+        # Lines without quotes, escapes, or whitespace that shlex wouldn't
+        # split on can be tokenized with str.split(), which is much faster.
+        self._needs_shlex = re.compile('[{}]|[^\\S{}]'.format(
+            re.escape(quotes + escape), re.escape(whitespace)), re.UNICODE).search
+        self._ready_count = 0
+        self.input_readable = _readable_func(in_stream)
+
+    def _decode_chars(self, chars):
+        if isinstance(chars, unicode):
+            return chars
+        else:
+            return chars.decode(self.SHLEX_CODING)
 
     @staticmethod
     def _is_backslash(char):
         return char == '\\'
 
-    def _line_tokens(self, line):
+    def _shlex_stream_tokens(self, stream):
+        self.shlex.state = ' '
+        self.shlex.token = ''
+        self.shlex.instream = stream
+        tokens = iter(self.shlex)
+        while True:
+            try:
+                yield next(tokens)
+            except (StopIteration, ValueError):
+                break
+
+    def _shlex_tokens(self, line):
         trailing_backslash_count = sum(
             1 for _ in itertools.takewhile(self._is_backslash, reversed(line)))
         if trailing_backslash_count % 2:
             line = line[:-1]
         with io.StringIO(line) as line_stream:
-            self.shlex.state = ' '
-            self.shlex.token = ''
-            self.shlex.instream = line_stream
-            tokens = iter(self.shlex)
-            while True:
-                try:
-                    yield next(tokens)
-                except (StopIteration, ValueError):
-                    break
+            for token in self._shlex_stream_tokens(line_stream):
+                yield token
+
+    def _line_tokens(self, line):
+        if self._needs_shlex(line):
+            return self._shlex_tokens(line)
+        else:
+            return line.split()
+
+    @staticmethod
+    def _strip_odd_backslash(pieces):
+        # Like the start of _shlex_tokens, for a line split into pieces.
+        backslash_count = 0
+        last_piece = None
+        for piece in pieces:
+            if last_piece is not None:
+                yield last_piece
+            stripped_len = len(piece.rstrip('\\'))
+            if stripped_len:
+                backslash_count = len(piece) - stripped_len
+            else:
+                backslash_count += len(piece)
+            last_piece = piece
+        if last_piece is not None:
+            yield last_piece[:-1] if (backslash_count % 2) else last_piece
+
+    def _pieces_tokens(self, pieces):
+        # Tokenize a line from pieces, holding at most one piece and the
+        # current token in memory.
+        partial = []
+        for piece in pieces:
+            if self._needs_shlex(piece):
+                pieces = itertools.chain(partial, [piece], pieces)
+                reader = self._PiecesReader(self._strip_odd_backslash(pieces))
+                for token in self._shlex_stream_tokens(reader):
+                    yield token
+                return
+            if partial and piece[0].isspace():
+                yield ''.join(partial)
+                partial = []
+            tokens = piece.split()
+            if not tokens:
+                continue
+            if partial:
+                partial.append(tokens[0])
+                if (len(tokens) == 1) and not piece[-1].isspace():
+                    continue
+                tokens[0] = ''.join(partial)
+                partial = []
+            if not piece[-1].isspace():
+                partial.append(tokens.pop())
+            for token in tokens:
+                yield token
+        if partial:
+            yield ''.join(partial)
+
+    @staticmethod
+    def _ends_line(piece, prev_piece):
+        # A line that ends with a backslash-newline continues on the next.
+        if not piece.endswith('\n'):
+            return False
+        elif len(piece) > 1:
+            return piece[-2] != '\\'
+        else:
+            return not prev_piece.endswith('\\')
+
+    def _line_rest(self, pre_lines, pieces):
+        prev_piece = ''
+        for piece in itertools.chain(pre_lines, pieces):
+            yield piece
+            if self._ends_line(piece, prev_piece):
+                break
+            prev_piece = piece
 
     def __iter__(self):
+        # Read lines in pieces, so a huge line doesn't have to be in memory
+        # all at once.  Once a line gets too long to be the EOF string,
+        # tokenize the rest of it piece by piece.
+        pieces = iter(functools.partial(self.in_stream.readline, self.READ_SIZE), '')
+        max_line_size = max(self.READ_SIZE, len(self.eof_line or ''))
         pre_lines = []
-        for line in self.in_stream:
-            if line.endswith('\\\n'):
-                pre_lines.append(line)
+        pre_size = 0
+        prev_piece = ''
+        for piece in pieces:
+            pre_lines.append(piece)
+            pre_size += len(piece)
+            if self._ends_line(piece, prev_piece):
+                line = ''.join(pre_lines) if (len(pre_lines) > 1) else piece
+                if line == self.eof_line:
+                    return
+                for token in self._ready_tokens(self._line_tokens(line)):
+                    yield token
+            elif pre_size > max_line_size:
+                line_rest = self._line_rest(pre_lines, pieces)
+                for token in self._pieces_tokens(line_rest):
+                    yield token
+                # Skip the rest of the line if shlex stopped early.
+                for _ in line_rest:
+                    pass
+            else:
+                prev_piece = piece
                 continue
-            elif pre_lines:
-                pre_lines.append(line)
-                line = ''.join(pre_lines)
-                pre_lines = []
-            if line == self.eof_line:
-                break
-            for token in self._line_tokens(line):
-                yield token
+            pre_lines = []
+            pre_size = 0
+            prev_piece = ''
         for token in self._line_tokens(''.join(pre_lines)):
             yield token
 
+    def _ready_tokens(self, tokens):
+        tokens = list(tokens)
+        self._ready_count = len(tokens)
+        for token in tokens:
+            self._ready_count -= 1
+            yield token
+
+    # Whether the next argument is split already, so getting it won't read.
+    def args_ready(self):
+        return self._ready_count > 0
+
 
 class InputSplitter(object):
+    READ_SIZE = 65536
+
+    # in_stream and delimiter can both be text, or both be bytes.
     def __init__(self, in_stream, delimiter):
         self.in_stream = in_stream
         self.delimiter = delimiter
+        # Take whatever input is ready, rather than waiting for READ_SIZE,
+        # so --stream can pass arguments on as they arrive.
+        self._read = getattr(in_stream, 'read1', in_stream.read)
+        self._ready_count = 0
+        self.input_readable = _readable_func(in_stream)
 
     def __iter__(self):
-        delimiter_len = len(self.delimiter)
+        delimiter = self.delimiter
+        delimiter_len = len(delimiter)
+        empty = delimiter[:0]
         pre_strings = []
-        for hunk in iter(lambda: self.in_stream.read(4096), ''):
-            try:
-                split_index = hunk.index(self.delimiter)
-            except ValueError:
-                pre_strings.append(hunk)
-                continue
-            yield ''.join(pre_strings) + hunk[:split_index]
-            pre_strings = []
-            while True:
-                start_index = split_index + delimiter_len
-                try:
-                    split_index = hunk.index(self.delimiter, start_index)
-                except ValueError:
-                    if start_index < len(hunk):
-                        pre_strings.append(hunk[start_index:])
-                    break
-                yield hunk[start_index:split_index]
-        if pre_strings:
-            yield ''.join(pre_strings)
+        # The end of one hunk and the start of the next might hold a
+        # multicharacter delimiter between them.  Carry the end of each hunk
+        # to the next to make sure we find it.
+        carry = empty
+        for hunk in iter(lambda: self._read(self.READ_SIZE), empty):
+            if carry:
+                hunk = carry + hunk
+            ready_args = hunk.split(delimiter)
+            rest = ready_args.pop()
+            if pre_strings and ready_args:
+                pre_strings.append(ready_args[0])
+                ready_args[0] = empty.join(pre_strings)
+                pre_strings = []
+            keep_index = max(0, len(rest) - delimiter_len + 1)
+            if keep_index > 0:
+                pre_strings.append(rest[:keep_index])
+            carry = rest[keep_index:]
+            self._ready_count = len(ready_args)
+            for arg in ready_args:
+                self._ready_count -= 1
+                yield arg
+        if pre_strings or carry:
+            pre_strings.append(carry)
+            yield empty.join(pre_strings)
+
+    # Whether the next argument is split already, so getting it won't read.
+    def args_ready(self):
+        return self._ready_count > 0
+
+    # The file descriptor to wait on when args_ready() is false, or None.
+    # Streams without read1() keep input buffered where we can't see it.
+    def input_fd(self):
+        if self._read == self.in_stream.read:
+            return None
+        return self.in_stream.fileno()
+
+
+class CompactArgsGroup(object):
+    # Store all of a group's arguments in one buffer, with an array of
+    # where each one ends, rather than one bytes object per argument.
+    def __init__(self):
+        self.args_bytes = bytearray()
+        self.ends = array.array(str('I'))
+
+    @staticmethod
+    def _iter_args(args_bytes, ends):
+        args_view = memoryview(args_bytes)
+        start_index = 0
+        for end_index in ends:
+            yield args_view[start_index:end_index]
+            start_index = end_index
+
+    def __iter__(self):
+        return self._iter_args(self.args_bytes, self.ends)
+
+    def __len__(self):
+        return len(self.ends)
+
+    def append(self, arg_bytes):
+        self.args_bytes.extend(arg_bytes)
+        try:
+            self.ends.append(len(self.args_bytes))
+        except OverflowError:
+            self.ends = array.array(OFFSET_TYPECODE, self.ends)
+            self.ends.append(len(self.args_bytes))
+
+
+class SpillFile(object):
+    # Groups created by new_group share one memory budget.  When they go
+    # over it, every live group writes the arguments it has in memory to the
+    # end of one anonymous temporary file, and remembers where that chunk is.
+    # A group stops being live when it's read or released, or when nothing
+    # else refers to it.
+    def __init__(self, memory_limit, new_file=None):
+        if new_file is None:
+            import tempfile
+            new_file = tempfile.TemporaryFile
+        self.memory_limit = memory_limit
+        self.new_file = new_file
+        self.memory_used = 0
+        self.groups = weakref.WeakSet()
+        self._file = None
+
+    def new_group(self):
+        group = SpillableArgsGroup(self)
+        self.groups.add(group)
+        return group
+
+    def release(self, group):
+        if group in self.groups:
+            self.groups.discard(group)
+            self.memory_used = max(0, self.memory_used - group.memory_size())
+
+    def reserve(self, byte_count):
+        self.memory_used += byte_count
+        if self.memory_used > self.memory_limit:
+            self.spill()
+
+    def spill(self):
+        if self._file is None:
+            self._file = self.new_file()
+        for group in self.groups:
+            group.spill()
+        self.memory_used = 0
+
+    def write(self, *byte_seqs):
+        self._file.seek(0, io.SEEK_END)
+        offset = self._file.tell()
+        for byte_seq in byte_seqs:
+            self._file.write(byte_seq)
+        return offset
+
+    def read(self, offset, size):
+        self._file.seek(offset)
+        return self._file.read(size)
+
+
+class SpillableArgsGroup(CompactArgsGroup):
+    def __init__(self, spill_file):
+        super(SpillableArgsGroup, self).__init__()
+        self.spill_file = spill_file
+        self.spilled_chunks = []
+        self.spilled_count = 0
+
+    def __iter__(self):
+        # Reading means the group is done growing, so it won't spill again.
+        self.release()
+        # Read spilled chunks back one at a time, as they're needed.
+        for offset, count, size in self.spilled_chunks:
+            ends_size = count * OFFSET_SIZE
+            ends = array.array(OFFSET_TYPECODE, self.spill_file.read(offset, ends_size))
+            args_bytes = self.spill_file.read(offset + ends_size, size)
+            for arg in self._iter_args(args_bytes, ends):
+                yield arg
+        for arg in super(SpillableArgsGroup, self).__iter__():
+            yield arg
+
+    def __len__(self):
+        return self.spilled_count + len(self.ends)
+
+    def append(self, arg_bytes):
+        super(SpillableArgsGroup, self).append(arg_bytes)
+        self.spill_file.reserve(len(arg_bytes) + self.ends.itemsize)
+
+    def memory_size(self):
+        return len(self.args_bytes) + (len(self.ends) * self.ends.itemsize)
+
+    def release(self):
+        self.spill_file.release(self)
+
+    def spill(self):
+        count = len(self.ends)
+        if not count:
+            return
+        offset = self.spill_file.write(array.array(OFFSET_TYPECODE, self.ends), self.args_bytes)
+        self.spilled_chunks.append((offset, count, len(self.args_bytes)))
+        self.spilled_count += count
+        self.args_bytes = bytearray()
+        self.ends = array.array(str('I'))
+
+
+class MappedArg(bytes):
+    def __new__(cls, arg_bytes, offset):
+        self = super(MappedArg, cls).__new__(cls, arg_bytes)
+        self.offset = offset
+        return self
+
+    def __reduce__(self):
+        return (MappedArg, (bytes(self), self.offset))
+
+
+class MappedArgsGroup(object):
+    # Store where each argument is in the mapped file, rather than its bytes.
+    def __init__(self, mapping):
+        self.mapping = mapping
+        self.offsets = array.array(OFFSET_TYPECODE)
+        self.lengths = array.array(OFFSET_TYPECODE)
+
+    def __iter__(self):
+        mapping_view = memoryview(self.mapping)
+        for offset, length in zip(self.offsets, self.lengths):
+            yield mapping_view[offset:offset + length]
+
+    def __len__(self):
+        return len(self.offsets)
+
+    # Groups are pickled without the mapping, to send them between processes
+    # that have the same file mapped.  The receiver sets the mapping.
+    def __getstate__(self):
+        return self.offsets, self.lengths
+
+    def __setstate__(self, state):
+        self.mapping = None
+        self.offsets, self.lengths = state
+
+    def append(self, mapped_arg):
+        self.offsets.append(mapped_arg.offset)
+        self.lengths.append(len(mapped_arg))
+
+    def extend(self, other_group):
+        self.offsets.extend(other_group.offsets)
+        self.lengths.extend(other_group.lengths)
+
+
+class MappedInputSplitter(object):
+    def __init__(self, mapping, delimiter):
+        self.mapping = mapping
+        self.delimiter = delimiter
+
+    def __iter__(self):
+        return self.iter_range(0, len(self.mapping))
+
+    # end_index must be the end of the mapping, or just after a delimiter.
+    def iter_range(self, start_index, end_index):
+        mapping = self.mapping
+        delimiter = self.delimiter
+        delimiter_len = len(delimiter)
+        while start_index < end_index:
+            split_index = mapping.find(delimiter, start_index, end_index)
+            if split_index < 0:
+                split_index = end_index
+            yield MappedArg(mapping[start_index:split_index], start_index)
+            start_index = split_index + delimiter_len
+
+    def new_group(self):
+        return MappedArgsGroup(self.mapping)
+
+
+def _fork_pool(*args, **kwargs):
+    import multiprocessing
+    try:
+        context = multiprocessing.get_context('fork')
+    except AttributeError:
+        # Python 2 always forks.
+        context = multiprocessing
+    return context.Pool(*args, **kwargs)
+
+def _thread_pool(*args, **kwargs):
+    import multiprocessing.pool
+    return multiprocessing.pool.ThreadPool(*args, **kwargs)
+
+
+class ParallelMappedInputSplitter(MappedInputSplitter):
+    # Split the mapped file into ranges that end at delimiters, and prepare
+    # each range in a worker process.  Workers are forked, so they have the
+    # group function and mapping without pickling them.
+    RANGES_PER_WORKER = 4
+    Pool = staticmethod(_fork_pool)
+    worker_args = None
+
+    def __init__(self, mapping, delimiter, workers_count):
+        super(ParallelMappedInputSplitter, self).__init__(mapping, delimiter)
+        self.workers_count = workers_count
+
+    def _delimiter_overlaps(self):
+        # If the end of one delimiter can start another, where a range ends
+        # might not match where a serial split would find a delimiter.
+        delimiter = self.delimiter
+        return any(delimiter[:n] == delimiter[-n:] for n in range(1, len(delimiter)))
+
+    def ranges(self):
+        mapping = self.mapping
+        end_index = len(mapping)
+        ranges_count = self.workers_count * self.RANGES_PER_WORKER
+        start_index = 0
+        for range_num in range(1, ranges_count):
+            split_index = mapping.find(
+                self.delimiter, max(start_index, end_index * range_num // ranges_count))
+            if split_index < 0:
+                break
+            split_index += len(self.delimiter)
+            yield start_index, split_index
+            start_index = split_index
+        if start_index < end_index:
+            yield start_index, end_index
+
+    # new_prepper is called with no arguments to make each range's prepper.
+    def add_to(self, prepper, new_prepper):
+        if (self.workers_count < 2) or self._delimiter_overlaps():
+            prepper.add(self)
+            return
+        pool = self.Pool(self.workers_count, _start_range_worker, (self, new_prepper))
+        try:
+            for range_result, error in pool.imap(_prep_range, self.ranges()):
+                if error is not None:
+                    exception, exception.__cause__ = error
+                    raise exception
+                groups, groups_present = range_result
+                for group in groups.values():
+                    group.mapping = self.mapping
+                prepper.merge(groups, groups_present)
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+def _start_range_worker(splitter, new_prepper):
+    ParallelMappedInputSplitter.worker_args = (splitter, new_prepper)
+
+def _prep_range(range_bounds):
+    splitter, new_prepper = ParallelMappedInputSplitter.worker_args
+    prepper = new_prepper()
+    try:
+        prepper.add(splitter.iter_range(*range_bounds))
+    except Exception as error:
+        # Send the cause along, so the parent can report it normally.
+        return None, (error, getattr(error, '__cause__', None))
+    return prepper.export(), None
 
 
 class NameChecker(ast.NodeVisitor):
+    # Names bound inside the expression, by lambda parameters and
+    # comprehension targets, are neither used nor unknown.
     def __init__(self, names):
         self.names = names
 
     def check(self, parsed_ast):
         self._used_names = set()
         self._unknown_names = set()
+        self._scopes = [set()]
         self.visit(parsed_ast)
         used_names = self._used_names
         unknown_names = self._unknown_names
-        del self._used_names, self._unknown_names
+        del self._used_names, self._unknown_names, self._scopes
         return used_names, unknown_names
 
+    @staticmethod
+    def _bind_targets(target, scope):
+        for node in ast.walk(target):
+            if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+                scope.add(node.id)
+
+    def visit_Lambda(self, node):
+        args = node.args
+        # Defaults are evaluated outside the lambda.
+        for default in args.defaults + getattr(args, 'kw_defaults', []):
+            if default is not None:
+                self.visit(default)
+        scope = set()
+        for arg in (getattr(args, 'posonlyargs', []) + args.args
+                    + getattr(args, 'kwonlyargs', []) + [args.vararg, args.kwarg]):
+            if arg is None:
+                pass
+            elif not isinstance(arg, ast.AST):
+                # Python 2 *args and **kwargs names.
+                scope.add(arg)
+            elif isinstance(arg, (ast.Name, ast.Tuple)):
+                # Python 2 parameters, which may unpack tuples.
+                self._bind_targets(arg, scope)
+            else:
+                scope.add(arg.arg)
+        self._scopes.append(scope)
+        self.visit(node.body)
+        self._scopes.pop()
+
+    def _visit_comprehension(self, node, *elements):
+        generators = node.generators
+        # The first iterable is evaluated outside the comprehension.
+        self.visit(generators[0].iter)
+        scope = set()
+        self._scopes.append(scope)
+        for index, generator in enumerate(generators):
+            if index:
+                self.visit(generator.iter)
+            self._bind_targets(generator.target, scope)
+            self.visit(generator.target)
+            for condition in generator.ifs:
+                self.visit(condition)
+        for element in elements:
+            self.visit(element)
+        self._scopes.pop()
+
+    def visit_ListComp(self, node):
+        self._visit_comprehension(node, node.elt)
+
+    visit_SetComp = visit_ListComp
+    visit_GeneratorExp = visit_ListComp
+
+    def visit_DictComp(self, node):
+        self._visit_comprehension(node, node.key, node.value)
+
+    def visit_NamedExpr(self, node):
+        self.visit(node.value)
+        self._scopes[-1].add(node.target.id)
+
     def visit_Name(self, node):
+        if (not isinstance(node.ctx, ast.Load)
+              or any(node.id in scope for scope in self._scopes)):
+            return
         if node.id in self.names:
             record_set = self._used_names
         else:
@@ -400,6 +1015,7 @@ MODULE_ALL = object()
 class UserExpression(object):
     SOURCE = '<user expression>'
     MODULE_WHITELIST = {
+        'asyncio': ['gather', 'shield', 'wait_for'],
         'binascii': MODULE_ALL,
         'bz2': MODULE_ALL,
         'codecs': MODULE_ALL,
@@ -468,22 +1084,30 @@ class UserExpression(object):
             except AttributeError:
                 names_whitelist = (name for name in dir(src_module)
                                    if not name.startswith('_'))
-        new_module = imp.new_module(module_name)
+        new_module = types.ModuleType(str(module_name))
         for name in names_whitelist:
             setattr(new_module, name, getattr(src_module, name))
         return new_module
 
-    def _load_whitelisted_module(self, module_name):
-        names_whitelist = self.MODULE_WHITELIST[module_name]
-        with self.clean_sys_path():
-            new_module = self._build_whitelisted_module(module_name, names_whitelist)
-        try:
-            load_callback = getattr(self, '_{}_module_loaded'.format(module_name))
-        except AttributeError:
-            pass
-        else:
-            load_callback(new_module)
-        self._EVAL_VARS[module_name] = new_module
+    # Loading swaps sys.path, and load callbacks change the source modules'
+    # classes, so only load one module at a time, and each only once.
+    _load_lock = threading.RLock()
+
+    @classmethod
+    def _load_whitelisted_module(cls, module_name):
+        names_whitelist = cls.MODULE_WHITELIST[module_name]
+        with cls._load_lock:
+            if module_name in cls._EVAL_VARS:
+                return
+            with cls.clean_sys_path():
+                new_module = cls._build_whitelisted_module(module_name, names_whitelist)
+            try:
+                load_callback = getattr(cls, '_{}_module_loaded'.format(module_name))
+            except AttributeError:
+                pass
+            else:
+                load_callback(new_module)
+            cls._EVAL_VARS[module_name] = new_module
 
     def _check_open_mode(argname='mode', argindex=1, allowed='rbtU', default='r'):
         def check_open_mode_decorator(orig_func):
@@ -502,65 +1126,153 @@ class UserExpression(object):
             return check_open_mode
         return check_open_mode_decorator
 
-    def _module_with_openers_loaded(self, new_module, *opener_names):
+    @classmethod
+    def _module_with_openers_loaded(cls, new_module, *opener_names):
         if not opener_names:
             opener_names = ('open',)
         for opener_name in opener_names:
             opener = getattr(new_module, opener_name)
-            setattr(new_module, opener_name, self._check_open_mode()(opener))
+            setattr(new_module, opener_name, cls._check_open_mode()(opener))
 
     _codecs_module_loaded = _module_with_openers_loaded
     _io_module_loaded = _module_with_openers_loaded
 
-    def _bz2_module_loaded(self, bz2_module):
-        self._module_with_openers_loaded(bz2_module, 'BZ2File')
+    @classmethod
+    def _asyncio_module_loaded(cls, asyncio_module):
+        # For --async-group-code.  Like time.sleep, asyncio.sleep is left
+        # out: waiting does no work toward a key.
+        asyncio_module.unix_query = UnixQuery.start
+
+    @classmethod
+    def _bz2_module_loaded(cls, bz2_module):
+        cls._module_with_openers_loaded(bz2_module, 'BZ2File')
+
+    @classmethod
+    def _gzip_module_loaded(cls, gzip_module):
+        cls._module_with_openers_loaded(gzip_module, 'GzipFile', 'open')
+
+    # Set on an expression by use_stat_cache() for --stat-cache.  While the
+    # expression is called, _calling_state.stat_cache holds it for this
+    # thread, and the sandboxed os and os.path functions below look it up.
+    stat_cache = None
+    _calling_state = threading.local()
+
+    def _stat_cached(orig_func, stat_attr=None, follow_symlinks=True):
+        # Wrap a function that returns a path's stat result, or one of its
+        # attributes, to get the result from the stat cache.
+        @functools.wraps(orig_func)
+        def stat_cached(path, *args, **kwargs):
+            stat_cache = getattr(UserExpression._calling_state, 'stat_cache', None)
+            if (stat_cache is None) or args or kwargs:
+                return orig_func(path, *args, **kwargs)
+            result = stat_cache.stat(path, follow_symlinks)
+            return result if (stat_attr is None) else getattr(result, stat_attr)
+        return stat_cached
+
+    def _stat_tested(orig_func, mode_test=None, follow_symlinks=True):
+        # Wrap a function that returns whether a path exists, and its mode
+        # passes mode_test, to check the stat cache.
+        @functools.wraps(orig_func)
+        def stat_tested(path):
+            stat_cache = getattr(UserExpression._calling_state, 'stat_cache', None)
+            if stat_cache is None:
+                return orig_func(path)
+            try:
+                mode = stat_cache.mode(path, follow_symlinks)
+            except (EnvironmentError, ValueError):
+                return False
+            return (mode_test is None) or mode_test(mode)
+        return stat_tested
 
-    def _gzip_module_loaded(self, gzip_module):
-        self._module_with_openers_loaded(gzip_module, 'GzipFile', 'open')
+    @classmethod
+    def _os_module_loaded(cls, os_module):
+        os_module.stat = cls._stat_cached(os.stat)
+        path_module = cls._build_whitelisted_module(os.path.__name__, MODULE_ALL)
+        for name in ['getatime', 'getctime', 'getmtime', 'getsize']:
+            setattr(path_module, name, cls._stat_cached(
+                getattr(os.path, name), 'st_' + name[len('get'):]))
+        path_module.exists = cls._stat_tested(os.path.exists)
+        path_module.lexists = cls._stat_tested(os.path.lexists, follow_symlinks=False)
+        path_module.isdir = cls._stat_tested(os.path.isdir, stat.S_ISDIR)
+        path_module.isfile = cls._stat_tested(os.path.isfile, stat.S_ISREG)
+        path_module.islink = cls._stat_tested(os.path.islink, stat.S_ISLNK, False)
+        os_module.path = path_module
 
-    def _tarfile_module_loaded(self, tar_module):
+    @classmethod
+    def _tarfile_module_loaded(cls, tar_module):
         for attr_name in dir(tar_module.TarFile):
             if attr_name.startswith(('add', 'extract')):
                 delattr(tar_module.TarFile, attr_name)
-        check_tar_mode = self._check_open_mode(allowed='r:|gbz2')
+        check_tar_mode = cls._check_open_mode(allowed='r:|gbz2')
         tar_module.open = check_tar_mode(tar_module.open)
         tar_module.TarFile = check_tar_mode(tar_module.TarFile)
 
-    def _time_module_loaded(self, time_module):
+    @classmethod
+    def _time_module_loaded(cls, time_module):
         del time_module.sleep, time_module.tzset
 
-    def _zipfile_module_loaded(self, zip_module):
+    @classmethod
+    def _zipfile_module_loaded(cls, zip_module):
         for klass in [zip_module.ZipFile, zip_module.PyZipFile]:
             for attr_name in dir(klass):
                 if attr_name.startswith(('extract', 'setpassword', 'write')):
                     delattr(klass, attr_name)
-        check_zip_mode = self._check_open_mode(allowed='r')
+        check_zip_mode = cls._check_open_mode(allowed='r')
         zip_module.ZipFile = check_zip_mode(zip_module.ZipFile)
         zip_module.PyZipFile = check_zip_mode(zip_module.PyZipFile)
 
-    _builtins_modname = '__builtin__' if (PY_MAJVER < 3) else 'builtins'
-    _builtins_module = importlib.import_module(_builtins_modname)
-    _builtins_whitelist = [name for name in dir(_builtins_module)
-                           if not (name.startswith('_') or (name in set(
-                                   ['eval', 'exec', 'exit', 'file', 'open', 'quit'])))]
-    _builtins = _build_whitelisted_module(_builtins_modname, _builtins_whitelist)
-    _builtins.open = _check_open_mode()(io.open)
-    _EVAL_VARS = vars(_builtins)
-    _EVAL_VARS[_builtins_modname] = _builtins
-    _EVAL_VARS['__builtins__'] = _builtins
-    del _builtins, _builtins_modname, _builtins_module, _builtins_whitelist
-
-    def __init__(self, expr_s):
+    # The sandboxed builtins, and whitelisted modules as they're loaded.
+    # Built by _load_eval_vars() when the first expression is compiled.
+    _EVAL_VARS = None
+
+    @classmethod
+    def _load_eval_vars(cls):
+        with cls._load_lock:
+            if UserExpression._EVAL_VARS is not None:
+                return
+            builtins_modname = '__builtin__' if (PY_MAJVER < 3) else 'builtins'
+            builtins_module = importlib.import_module(builtins_modname)
+            builtins_whitelist = [name for name in dir(builtins_module)
+                                  if not (name.startswith('_') or (name in set(
+                                      ['eval', 'exec', 'exit', 'file', 'open', 'quit'])))]
+            builtins = cls._build_whitelisted_module(builtins_modname, builtins_whitelist)
+            builtins.open = cls._check_open_mode()(io.open)
+            eval_vars = vars(builtins)
+            eval_vars[builtins_modname] = builtins
+            eval_vars['__builtins__'] = builtins
+            UserExpression._EVAL_VARS = eval_vars
+
+    @staticmethod
+    def _module_exists(module_name):
+        try:
+            import importlib.util
+        except ImportError:
+            # Python 2
+            import imp
+            try:
+                module_file = imp.find_module(module_name)[0]
+            except ImportError:
+                return False
+            if module_file is not None:
+                module_file.close()
+            return True
+        return importlib.util.find_spec(module_name) is not None
+
+    # Check and compile the source, loading any modules it uses.
+    # Pass the result to the constructor to skip this work.
+    @classmethod
+    def compile(cls, expr_s):
         exception_wrapper = functools.partial(ExceptionWrapper,
                                               UserExpressionCompileError(expr_s))
         with exception_wrapper(SyntaxError):
-            parsed_ast = ast.parse(expr_s, self.SOURCE, 'eval')
-        name_checker = NameChecker(self._EVAL_VARS)
+            parsed_ast = ast.parse(expr_s, cls.SOURCE, 'eval')
+        cls._load_eval_vars()
+        name_checker = NameChecker(cls._EVAL_VARS)
         _, unloaded_names = name_checker.check(parsed_ast)
         unknown_names = set()
         for name in unloaded_names:
             try:
-                self._load_whitelisted_module(name)
+                cls._load_whitelisted_module(name)
             except KeyError:
                 unknown_names.add(name)
         unknown_names_count = len(unknown_names)
@@ -573,13 +1285,7 @@ class UserExpression(object):
             name_error = NameError("name {!r} is not defined".format(unknown_name))
             # If the name refers to a module that isn't in _EVAL_VARS,
             # always treat it as an error, rather than overloading the name.
-            try:
-                module_file = imp.find_module(unknown_name)[0]
-            except ImportError:
-                pass
-            else:
-                if module_file is not None:
-                    module_file.close()
+            if cls._module_exists(unknown_name):
                 with exception_wrapper(NameError):
                     raise name_error
             # Ensure the unknown name is the argument of a callable.
@@ -589,7 +1295,7 @@ class UserExpression(object):
             except AttributeError:
                 parsed_ast = ast.parse(
                     'lambda {}: {}'.format(unknown_name, expr_s),
-                    self.SOURCE, 'eval')
+                    cls.SOURCE, 'eval')
             except IndexError:
                 with exception_wrapper(ValueError):
                     raise ValueError("callable expression accepts no argument")
@@ -601,129 +1307,1519 @@ class UserExpression(object):
                 if unknown_name != arg_name:
                     with exception_wrapper(NameError):
                         raise name_error
-        expr_code = compile(parsed_ast, self.SOURCE, 'eval')
-        with exception_wrapper(AttributeError):
+        return compile(parsed_ast, cls.SOURCE, 'eval')
+
+    def __init__(self, expr_s, expr_code=None):
+        if expr_code is None:
+            expr_code = self.compile(expr_s)
+        exception_wrapper = functools.partial(ExceptionWrapper,
+                                              UserExpressionCompileError(expr_s))
+        with exception_wrapper(Exception):
             self.func = eval(expr_code, self._EVAL_VARS)
         if not callable(self.func):
             with exception_wrapper(ValueError):
                 raise ValueError("{!r} expression is not callable".
                                  format(type(self.func)))
 
-    def __call__(self, arg):
+    @staticmethod
+    @contextlib.contextmanager
+    def _warnings_filtered():
         with warnings.catch_warnings():
             try:
                 warnings.filterwarnings('ignore', category=ResourceWarning)
             except NameError:
                 pass
+            yield
+
+    # Make this expression's stat cache the one the sandboxed functions
+    # use in this thread, until the call is done.
+    @contextlib.contextmanager
+    def _calling(self):
+        calling_state = UserExpression._calling_state
+        orig_stat_cache = getattr(calling_state, 'stat_cache', None)
+        calling_state.stat_cache = self.stat_cache
+        try:
+            with self._warnings_filtered():
+                yield
+        finally:
+            calling_state.stat_cache = orig_stat_cache
+
+    def __call__(self, arg):
+        with self._calling():
             with ExceptionWrapper(UserExpressionRuntimeError(arg), Exception):
                 return self.func(arg)
 
+    # To call the expression many times in a row, set up the warnings filter
+    # and stat cache once with fast_calls(), and call the function it yields
+    # directly.  Pass anything it raises to runtime_error() to report it.
+    @contextlib.contextmanager
+    def fast_calls(self):
+        with self._calling():
+            yield self.func
+
+    # Cache results for the most recent max_size arguments.
+    def memoize(self, max_size):
+        self.func = functools.lru_cache(max_size)(self.func)
+
+    def cache_info(self):
+        return self.func.cache_info()
+
+    def use_key_cache(self, key_cache):
+        self.func = key_cache.wrap(self.func)
+
+    def use_stat_cache(self, stat_cache):
+        self.stat_cache = stat_cache
+
+    @staticmethod
+    def runtime_error(arg, error):
+        new_error = UserExpressionRuntimeError(arg)
+        new_error.__cause__ = error
+        return new_error
+
     _build_whitelisted_module = staticmethod(_build_whitelisted_module)
     _check_open_mode = staticmethod(_check_open_mode)
+    _stat_cached = staticmethod(_stat_cached)
+    _stat_tested = staticmethod(_stat_tested)
 
 
-class InputPrepper(object):
-    NO_GROUP_KEY = object()
+class BatchUserExpression(UserExpression):
+    # The expression takes a list of arguments, and returns a sequence of
+    # their keys in the same order.  Calling it once per batch saves the
+    # per-call overhead of UserExpression.__call__.
+    BATCH_SIZE = 1024
 
-    class DelimiterFinder(object):
-        def __init__(self):
-            if PY_MAJVER < 3:
-                self.eligible = set(chr(n) for n in xrange(256))
-            else:
-                self.eligible = set(bytes(range(256)))
+    def __init__(self, expr_s, expr_code=None):
+        super(BatchUserExpression, self).__init__(expr_s, expr_code)
+        batch_func = self.func
+        # Build the list inside __call__, so errors from a lazy map() or
+        # generator are reported like any other.
+        self.func = lambda args: list(batch_func(args))
 
-        def exclude(self, bytes_arg):
-            self.eligible.difference_update(bytes_arg)
-            if not self.eligible:
-                raise UserArgumentsError("input arguments span all bytes - no delimiter available")
+    def __call__(self, arg):
+        return self.group_keys([arg])[0]
 
-        def delimiter(self):
-            return next(iter(self.eligible))
+    def use_key_cache(self, key_cache):
+        self.func = key_cache.wrap_batch(self.func)
+
+    def group_keys(self, args):
+        try:
+            keys = super(BatchUserExpression, self).__call__(args)
+        except UserExpressionRuntimeError as batch_error:
+            raise self._arg_error(args, batch_error)
+        if len(keys) != len(args):
+            with ExceptionWrapper(UserExpressionRuntimeError(args[0]), ValueError):
+                raise ValueError("group code returned {} keys for {} arguments".format(
+                    len(keys), len(args)))
+        return keys
+
+    def _arg_error(self, args, batch_error):
+        # Find the first argument that fails on its own, to report it.
+        # If they all work alone, blame the first one in the batch.
+        for arg in args:
+            try:
+                super(BatchUserExpression, self).__call__([arg])
+            except UserExpressionRuntimeError as error:
+                new_error = UserExpressionRuntimeError(arg)
+                new_error.__cause__ = error.__cause__
+                return new_error
+        new_error = UserExpressionRuntimeError(args[0])
+        new_error.__cause__ = batch_error.__cause__
+        return new_error
+
+
+class PooledUserExpression(object):
+    # Evaluate group code in a pool of worker processes.  Each worker
+    # compiles the same source, and group_keys() sends them CHUNK_SIZE
+    # arguments at a time.  Keys come back in input order.
+    CHUNK_SIZE = 64
+    Pool = staticmethod(ParallelMappedInputSplitter.Pool)
+    worker_expr = None
+
+    def __init__(self, expr_s, workers_count, constructor=UserExpression):
+        # Compile the code here too, to report errors before starting workers.
+        self.expr = constructor(expr_s)
+        self.expr_s = expr_s
+        self.workers_count = workers_count
+        self.constructor = constructor
+        # Enough arguments to give each worker a few chunks.
+        self.BATCH_SIZE = self.CHUNK_SIZE * workers_count * 4
+        self.func = self._pool_keys
+        self._pool = None
 
+    def __call__(self, arg):
+        return self.group_keys([arg])[0]
 
-    def __init__(self, group_func, delimiter=None, encoding=ENCODING):
-        self.group_func = group_func
-        self.encoding = encoding
+    def group_keys(self, args):
+        return self.func(args)
+
+    def _new_pool(self):
+        return self.Pool(self.workers_count, _start_group_worker,
+                         (self.constructor, self.expr_s))
+
+    # Yields the function to call in a worker with each chunk of arguments.
+    @contextlib.contextmanager
+    def _chunk_func(self):
+        yield _group_chunk
+
+    def _pool_keys(self, args):
+        if self._pool is None:
+            self._pool = self._new_pool()
+        chunk_size = self.CHUNK_SIZE
+        chunks = [args[index:index + chunk_size]
+                  for index in range(0, len(args), chunk_size)]
+        keys = []
+        with self._chunk_func() as group_chunk:
+            for chunk_keys, error in self._pool.imap(group_chunk, chunks):
+                if error is not None:
+                    exception, exception.__cause__ = error
+                    raise exception
+                keys.extend(chunk_keys)
+        return keys
+
+    def use_key_cache(self, key_cache):
+        self.func = key_cache.wrap_batch(self.func)
+
+    def use_stat_cache(self, stat_cache):
+        self.expr.use_stat_cache(stat_cache)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+def _start_group_worker(constructor, expr_s):
+    PooledUserExpression.worker_expr = constructor(expr_s)
+
+def _group_chunk(args):
+    expr = PooledUserExpression.worker_expr
+    try:
         try:
-            delimiter_b = delimiter.encode(self.encoding)
-        except (AttributeError, UnicodeEncodeError):
-            delimiter_b = b''
-        if len(delimiter_b) == 1:
-            self._delimiter = delimiter_b[0]
+            group_keys = expr.group_keys
+        except AttributeError:
+            keys = list(map(expr, args))
         else:
-            self._delimiter = None
-            self._delimiter_finder = self.DelimiterFinder()
-        self._groups = collections.defaultdict(list)
+            keys = group_keys(args)
+    except UserExpressionError as error:
+        # Send the cause along, so the parent can report it normally.
+        return None, (error, error.__cause__)
+    return keys, None
 
-    def __iter__(self):
-        return iter(self._groups)
 
-    def __getitem__(self, key):
-        return self._groups[key]
+class ThreadedUserExpression(PooledUserExpression):
+    # Like PooledUserExpression, but all the workers are threads that call
+    # this process' compiled group code.  That's enough to overlap group
+    # code that mostly waits on I/O.
+    CHUNK_SIZE = 16
+    Pool = staticmethod(_thread_pool)
 
-    def __len__(self):
-        return len(self._groups)
+    def _new_pool(self):
+        return self.Pool(self.workers_count)
 
-    def add(self, arg_seq):
-        for arg in arg_seq:
-            key = self.group_func(arg)
-            # I *believe* it is impossible for a UnicodeEncodeError to occur
-            # here, as long as we continue to use the same encoding to both
-            # read input and write to xargs.  Since we read arg in *from* this
-            # encoding, it must be possible to write it back out in the same
-            # encoding.
-            # If I'm mistaken or an assumption changes, this might be a good
-            # place to wrap UnicodeEncodeError for better error reporting.
-            arg_bytes = arg.encode(self.encoding)
-            self[key].append(arg_bytes)
-            if self._delimiter is None:
-                try:
-                    self._delimiter_finder.exclude(arg_bytes)
-                except UserArgumentsError:
-                    self._groups_delimiter_finders = collections.defaultdict(self.DelimiterFinder)
-                    for group_key in self:
-                        for group_bytes in self[group_key]:
-                            self._groups_delimiter_finders[group_key].exclude(group_bytes)
-                    self._delimiter_finder = None
-                except AttributeError:
-                    self._groups_delimiter_finders[key].exclude(arg_bytes)
+    # Set up the warnings filter here, since catch_warnings() isn't
+    # thread-safe.
+    @contextlib.contextmanager
+    def _chunk_func(self):
+        with self.expr.fast_calls() as func:
+            yield functools.partial(self._group_chunk, func)
 
-    def delimiter(self, group_key=NO_GROUP_KEY):
-        if self._delimiter is not None:
-            delimiter = self._delimiter
-        elif self._delimiter_finder is not None:
-            delimiter = self._delimiter_finder.delimiter()
-        elif group_key is self.NO_GROUP_KEY:
-            raise ValueError("no usable delimiter for all groups")
-        else:
-            delimiter = self._groups_delimiter_finders[group_key].delimiter()
-        return delimiter
+    def _group_chunk(self, func, args):
+        keys = []
+        for arg in args:
+            try:
+                keys.append(func(arg))
+            except Exception as error:
+                return None, (self.expr.runtime_error(arg, error), error)
+        return keys, None
+
+
+class UnixQuery(object):
+    # asyncio.unix_query(path, request=b'') in group code: send the request
+    # to a Unix socket, then get a future for the whole response, up to EOF.
+    # Writing to a socket can have side effects, so only sockets the user
+    # listed with --query-socket can be queried.  An AsyncUserExpression
+    # allows its sockets in its thread while it runs a batch.
+    # This is an asyncio protocol, written with callbacks so the module
+    # still parses on Python 2.
+    _allowed_state = threading.local()
+
+    def __init__(self, request, done):
+        self.request = request
+        self.done = done
+        self.chunks = []
 
+    @staticmethod
+    def allowed_paths(paths):
+        return frozenset(os.path.realpath(path) for path in paths)
 
-class GroupCommand(object):
-    def __init__(self, command, key_string):
-        self.template = list(command)
-        self.key_string = key_string
+    @classmethod
+    @contextlib.contextmanager
+    def allowing(cls, allowed_paths):
+        allowed_state = cls._allowed_state
+        orig_paths = getattr(allowed_state, 'paths', frozenset())
+        allowed_state.paths = allowed_paths
+        try:
+            yield
+        finally:
+            allowed_state.paths = orig_paths
 
-    def command(self, group_key):
-        if self.key_string is None:
-            return list(self.template)
+    @classmethod
+    def start(cls, path, request=b''):
+        allowed_paths = getattr(cls._allowed_state, 'paths', frozenset())
+        if os.path.realpath(os.fsdecode(path)) not in allowed_paths:
+            raise ValueError("socket not allowed: {!r} (see --query-socket)".format(path))
+        if not isinstance(request, bytes):
+            raise TypeError("unix_query request must be bytes, not {}".format(
+                type(request).__name__))
+        import asyncio
+        loop = asyncio.get_event_loop()
+        done = loop.create_future()
+        connecting = loop.create_task(
+            loop.create_unix_connection(lambda: cls(request, done), path))
+        connecting.add_done_callback(functools.partial(cls._connected, done))
+        done.add_done_callback(functools.partial(cls._finished, connecting))
+        return done
+
+    @staticmethod
+    def _connected(done, connecting):
+        if connecting.cancelled():
+            return
+        error = connecting.exception()
+        if (error is not None) and not done.done():
+            done.set_exception(error)
+
+    @staticmethod
+    def _finished(connecting, done):
+        # Stop talking to the socket if the query was cancelled.
+        if not connecting.done():
+            connecting.cancel()
+        elif not (connecting.cancelled() or connecting.exception()):
+            transport, _ = connecting.result()
+            transport.close()
+
+    def connection_made(self, transport):
+        transport.write(self.request)
+        transport.write_eof()
+
+    def data_received(self, data):
+        self.chunks.append(data)
+
+    def eof_received(self):
+        return False
+
+    def connection_lost(self, error):
+        if self.done.done():
+            pass
+        elif error is None:
+            self.done.set_result(b''.join(self.chunks))
         else:
-            return list(arg.replace(self.key_string, group_key)
-                        for arg in self.template)
+            self.done.set_exception(error)
+
+    def pause_writing(self):
+        pass
+
+    def resume_writing(self):
+        pass
+
+
+class AsyncUserExpression(object):
+    # The group code may return awaitables, like coroutines.  group_keys()
+    # runs a batch of them on an event loop, awaiting at most `concurrency`
+    # at a time.  Results that aren't awaitable are used as keys directly.
+    BATCH_SIZE = 1024
+
+    class Batch(object):
+        def __init__(self, loop, func, runtime_error, args):
+            import asyncio
+            import inspect
+            self.ensure_future = functools.partial(asyncio.ensure_future, loop=loop)
+            self.isawaitable = inspect.isawaitable
+            self.loop = loop
+            self.func = func
+            self.runtime_error = runtime_error
+            self.keys = [None] * len(args)
+            self.args_iter = iter(enumerate(args))
+            self.futures = set()
+            self.done = loop.create_future()
+
+        # Returns a future for the list of keys.  Group code is first
+        # called from inside the loop, so it can find the loop running.
+        def start(self, concurrency):
+            for _ in range(concurrency):
+                self.loop.call_soon(self._start_next)
+            return self.done
+
+        def _start_next(self):
+            if self.done.done():
+                return
+            for index, arg in self.args_iter:
+                try:
+                    key = self.func(arg)
+                except Exception as error:
+                    return self._fail(arg, error)
+                if self.isawaitable(key):
+                    future = self.ensure_future(key)
+                    self.futures.add(future)
+                    future.add_done_callback(functools.partial(self._finish, index, arg))
+                    return
+                self.keys[index] = key
+            if not (self.futures or self.done.done()):
+                self.done.set_result(self.keys)
+
+        def _finish(self, index, arg, future):
+            self.futures.discard(future)
+            if self.done.done():
+                return
+            try:
+                self.keys[index] = future.result()
+            except Exception as error:
+                return self._fail(arg, error)
+            self._start_next()
+
+        def _fail(self, arg, error):
+            for future in self.futures:
+                future.cancel()
+            if not self.done.done():
+                self.done.set_exception(self.runtime_error(arg, error))
+
+    def __init__(self, expr_s, concurrency, constructor=UserExpression, query_sockets=()):
+        self.expr = constructor(expr_s)
+        self.concurrency = concurrency
+        self.query_sockets = UnixQuery.allowed_paths(query_sockets)
+        # Keep every await slot busy for a while between batches.
+        self.BATCH_SIZE = max(self.BATCH_SIZE, concurrency * 4)
+        self.func = self._await_keys
+        self._loop = None
 
+    def __call__(self, arg):
+        return self.group_keys([arg])[0]
+
+    def group_keys(self, args):
+        return self.func(args)
+
+    def _await_keys(self, args):
+        if self._loop is None:
+            import asyncio
+            self._loop = asyncio.new_event_loop()
+        with self.expr.fast_calls() as func, UnixQuery.allowing(self.query_sockets):
+            batch = self.Batch(self._loop, func, self.expr.runtime_error, args)
+            return self._loop.run_until_complete(batch.start(self.concurrency))
+
+    def use_key_cache(self, key_cache):
+        self.func = key_cache.wrap_batch(self.func)
+
+    def use_stat_cache(self, stat_cache):
+        self.expr.use_stat_cache(stat_cache)
+
+    def close(self):
+        if self._loop is not None:
+            # Let awaits cancelled by a failed batch finish, so they can
+            # close their connections.
+            import asyncio
+            try:
+                pending = asyncio.all_tasks(self._loop)
+            except AttributeError:
+                pending = asyncio.Task.all_tasks(self._loop)
+            if pending:
+                self._loop.run_until_complete(asyncio.wait(pending))
+            self._loop.close()
+            self._loop = None
 
-class XargsCommand(object):
-    def __init__(self, xargs_base, group_cmd):
-        self.xargs_base = list(xargs_base)
-        self.group_cmd = group_cmd
-        self.switches = {'--max-procs': '1'}
 
-    def set_options(self, args):
-        args_dict = vars(args)
-        for key in args_dict:
-            switch_name = '{}{}'.format(
-                '-' if (len(key) == 1) else '--',
+class KeyExtractor(object):
+    # Built-in group functions for --group-by.  Each computes a whole batch
+    # of keys with str methods, skipping the group code machinery, and gives
+    # the same keys as the group code in its comment.
+    BATCH_SIZE = 1024
+    NAMES = frozenset(['dirname', 'ext', 'component', 'field', 'regex'])
+
+    @classmethod
+    def parse_spec(cls, spec):
+        name, _, params_s = spec.partition(':')
+        if name not in cls.NAMES:
+            raise ValueError("unknown key extractor {!r}".format(name))
+        if name in ('dirname', 'ext'):
+            if params_s:
+                raise ValueError("{} takes no parameters".format(name))
+            return name, ()
+        elif name == 'regex':
+            regex = re.compile(params_s)
+            if regex.groups > 1:
+                raise ValueError("regex may have at most one group")
+            return name, (params_s,)
+        elif name == 'component':
+            return name, ('/', int(params_s))
+        sep, _, index_s = params_s.rpartition(':')
+        if not sep:
+            raise ValueError("field needs a separator and an index, like field:,:2")
+        return name, (sep, int(index_s))
+
+    def __init__(self, spec, group_bytes=False, encoding=ENCODING):
+        name, params = self.parse_spec(spec)
+        if group_bytes:
+            params = [param.encode(encoding) if isinstance(param, unicode) else param
+                      for param in params]
+            self._str_type = bytes
+        else:
+            self._str_type = unicode
+        build_func = getattr(self, '_{}_keys'.format('field' if name == 'component' else name))
+        self.func = build_func(*params)
+
+    def _sep(self, char):
+        return char.encode('ascii') if (self._str_type is bytes) else char
+
+    # os.path.dirname(_)
+    def _dirname_keys(self):
+        rfind = self._str_type.rfind
+        sep = self._sep('/')
+        dirname = posixpath.dirname
+        # Most paths have a slash after a non-slash character.  Leave other
+        # cases, like trailing slashes or the root directory, to dirname().
+        return lambda args: [
+            arg[:index] if ((index > 0) and (arg[index - 1:index] != sep)) else dirname(arg)
+            for arg, index in [(arg, rfind(arg, sep)) for arg in args]]
+
+    # os.path.splitext(_)[1]
+    def _ext_keys(self):
+        rfind = self._str_type.rfind
+        sep = self._sep('/')
+        dot = self._sep('.')
+        splitext = posixpath.splitext
+        # Most extensions follow a non-dot character in the file's name.
+        return lambda args: [
+            arg[dot_index:] if ((dot_index > sep_index + 1)
+                                and (arg[dot_index - 1:dot_index] != dot))
+            else splitext(arg)[1]
+            for arg, dot_index, sep_index in [
+                (arg, rfind(arg, dot), rfind(arg, sep)) for arg in args]]
+
+    # _.split(sep)[index]
+    def _field_keys(self, sep, index):
+        if index >= 0:
+            return lambda args: [arg.split(sep, index + 1)[index] for arg in args]
+        else:
+            return lambda args: [arg.rsplit(sep, -index)[index] for arg in args]
+
+    # re.search(pattern, _).group(1), or .group(0) without a group
+    def _regex_keys(self, pattern):
+        regex = re.compile(pattern)
+        search = regex.search
+        group_num = regex.groups
+        def regex_keys(args):
+            try:
+                return [search(arg).group(group_num) for arg in args]
+            except AttributeError:
+                raise ValueError("regex {!r} does not match".format(pattern))
+        return regex_keys
+
+    def __call__(self, arg):
+        return self.group_keys([arg])[0]
+
+    def group_keys(self, args):
+        try:
+            return self.func(args)
+        except Exception as batch_error:
+            raise self._arg_error(args, batch_error)
+
+    def _arg_error(self, args, batch_error):
+        # Find the first argument that fails on its own, to report it.
+        for arg in args:
+            try:
+                self.func([arg])
+            except Exception as error:
+                return UserExpression.runtime_error(arg, error)
+        return UserExpression.runtime_error(args[0], batch_error)
+
+    def use_key_cache(self, key_cache):
+        self.func = key_cache.wrap_batch(self.func)
+
+
+class InputKeys(object):
+    # For --keyed-input: each input record is KEY<sep>ARGUMENT.  Instead of
+    # running group code, InputPrepper uses the key from split_record().
+    def __init__(self, sep, encoding=ENCODING):
+        self.sep = sep
+        self.encoding = encoding
+        self.bytes_sep = sep.encode(encoding)
+
+    def split_record(self, record):
+        sep = self.bytes_sep if isinstance(record, bytes) else self.sep
+        key, found_sep, arg = record.partition(sep)
+        if not found_sep:
+            if isinstance(record, bytes):
+                record = record.decode(self.encoding, DECODE_ERRORS)
+            raise UserArgumentsError("argument {!r} has no key separator {!r}".format(
+                record, self.sep))
+        if isinstance(record, MappedArg):
+            arg = MappedArg(arg, record.offset + len(key) + len(sep))
+        return key, arg
+
+
+class CoprocessKeys(object):
+    # For --group-cmd: start one command, write each argument to it on its
+    # own line, and read each argument's key back as a line of its output.
+    # Writes and reads are interleaved with poll, like MultiProcessWriter,
+    # so neither side blocks when a pipe fills.
+    Popen = subprocess.Popen
+    Poll = select.poll
+    PIPE_BUF = select.PIPE_BUF
+    READ_SIZE = 65536
+
+    def __init__(self, command, group_bytes=False, encoding=ENCODING):
+        self.command = list(command)
+        self.group_bytes = group_bytes
+        self.encoding = encoding
+
+    def _command_error(self, message):
+        with ExceptionWrapper(UserCommandError(self.command[0]), ValueError):
+            raise ValueError(message)
+
+    def _check_arg(self, arg_bytes):
+        if b'\n' in arg_bytes:
+            raise UserArgumentsError(
+                "argument {!r} has a newline, so --group-cmd can't key it".format(
+                    arg_bytes.decode(self.encoding, DECODE_ERRORS)))
+
+    def _key(self, line):
+        if self.group_bytes:
+            return line
+        return line.decode(self.encoding, DECODE_ERRORS)
+
+    # Takes an iterable of argument bytes, and yields their keys in order.
+    # Arguments are only read as the command is ready to take them.
+    def stream_keys(self, args_bytes):
+        with ExceptionWrapper(UserCommandError(self.command[0]), EnvironmentError):
+            proc = self.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        try:
+            for key in self._exchange(proc, iter(args_bytes)):
+                yield key
+        finally:
+            proc.stdin.close()
+            proc.stdout.close()
+            if proc.poll() is None:
+                proc.kill()
+            proc.wait()
+
+    def _exchange(self, proc, args_iter):
+        newline = b'\n'[0]
+        in_fd = proc.stdin.fileno()
+        out_fd = proc.stdout.fileno()
+        poller = self.Poll()
+        poller.register(in_fd, select.POLLOUT)
+        poller.register(out_fd, select.POLLIN)
+        write_buffer = bytearray()
+        read_buffer = b''
+        input_done = False
+        write_error = False
+        args_count = 0
+        keys_count = 0
+        output_done = False
+        while not output_done:
+            for fd, _ in poller.poll():
+                if fd == in_fd:
+                    while (not input_done) and (len(write_buffer) < self.PIPE_BUF):
+                        try:
+                            arg_bytes = next(args_iter)
+                        except StopIteration:
+                            input_done = True
+                        else:
+                            self._check_arg(arg_bytes)
+                            write_buffer.extend(arg_bytes)
+                            write_buffer.append(newline)
+                            args_count += 1
+                    try:
+                        del write_buffer[:os.write(in_fd, write_buffer[:self.PIPE_BUF])]
+                    except EnvironmentError:
+                        # The command stopped reading.  Report that after
+                        # reading the keys it did write.
+                        write_error = True
+                    if write_error or (input_done and not write_buffer):
+                        poller.unregister(in_fd)
+                        proc.stdin.close()
+                    continue
+                data = os.read(out_fd, self.READ_SIZE)
+                if data:
+                    lines = (read_buffer + data).split(b'\n')
+                    read_buffer = lines.pop()
+                else:
+                    lines = [read_buffer] if read_buffer else []
+                    output_done = True
+                for line in lines:
+                    keys_count += 1
+                    if keys_count > args_count:
+                        self._command_error("wrote more keys than it read arguments")
+                    yield self._key(line)
+                if output_done:
+                    break
+        proc.stdin.close()
+        returncode = proc.wait()
+        if returncode != 0:
+            self._command_error("exited with status {}".format(returncode))
+        elif write_error or not input_done:
+            self._command_error("stopped reading arguments after writing {} keys".format(
+                keys_count))
+        elif keys_count != args_count:
+            self._command_error("wrote {} keys for {} arguments".format(
+                keys_count, args_count))
+
+
+class KeyCache(object):
+    # Store group keys in an SQLite database, so later runs can skip the
+    # group code for arguments they've seen before.  When an argument names
+    # a file, the key is only reused while the file's mtime and size match.
+    # New keys are written FLUSH_SIZE at a time.
+    FLUSH_SIZE = 1024
+    PICKLE_PROTOCOL = 2
+    MISSING = object()
+
+    def __init__(self, path, code_s, connect=None):
+        import sqlite3
+        if connect is None:
+            connect = sqlite3.connect
+        self.path = path
+        self.code_s = code_s
+        self.hits = 0
+        self.misses = 0
+        # Errors after the database is open stop caching, and are raised
+        # from close().  That way they aren't reported as group code errors.
+        self.error = None
+        self._pending = {}
+        with ExceptionWrapper(UserKeyCacheError(path), sqlite3.Error):
+            self._db = connect(path)
+            self._db.execute("""CREATE TABLE IF NOT EXISTS group_keys (
+                code TEXT NOT NULL, arg BLOB NOT NULL, mtime, size, key BLOB NOT NULL,
+                PRIMARY KEY (code, arg))""")
+            self._db.commit()
+
+    @staticmethod
+    def _arg_id(arg):
+        import sqlite3
+        if isinstance(arg, bytes):
+            arg_id = b'b' + arg
+        else:
+            arg_id = b'u' + arg.encode('utf-8', DECODE_ERRORS)
+        return sqlite3.Binary(arg_id)
+
+    @staticmethod
+    def _file_stat(arg):
+        try:
+            stat = os.stat(arg)
+        except (EnvironmentError, TypeError, ValueError):
+            return (None, None)
+        return (getattr(stat, 'st_mtime_ns', stat.st_mtime), stat.st_size)
+
+    def _get(self, arg_id, file_stat):
+        import pickle
+        import sqlite3
+        if self.error is not None:
+            return self.MISSING
+        try:
+            entry = self._pending[arg_id]
+        except KeyError:
+            try:
+                entry = self._db.execute(
+                    "SELECT mtime, size, key FROM group_keys WHERE code = ? AND arg = ?",
+                    (self.code_s, arg_id)).fetchone()
+            except sqlite3.Error as error:
+                self.error = error
+                return self.MISSING
+        if (entry is None) or ((entry[0], entry[1]) != file_stat):
+            self.misses += 1
+            return self.MISSING
+        try:
+            key = pickle.loads(bytes(entry[2]))
+        # Unpickling can fail many ways, like when a key's class is gone.
+        # Treat those like any other stale entry.
+        except Exception:
+            self.misses += 1
+            return self.MISSING
+        self.hits += 1
+        return key
+
+    def _put(self, arg_id, file_stat, key):
+        import pickle
+        import sqlite3
+        if self.error is not None:
+            return
+        try:
+            key_blob = pickle.dumps(key, self.PICKLE_PROTOCOL)
+        except (pickle.PicklingError, AttributeError, TypeError):
+            return
+        self._pending[arg_id] = file_stat + (sqlite3.Binary(key_blob),)
+        if len(self._pending) >= self.FLUSH_SIZE:
+            try:
+                self.flush()
+            except sqlite3.Error as error:
+                self.error = error
+
+    def wrap(self, func):
+        def cached_func(arg):
+            arg_id = self._arg_id(arg)
+            file_stat = self._file_stat(arg)
+            key = self._get(arg_id, file_stat)
+            if key is self.MISSING:
+                key = func(arg)
+                self._put(arg_id, file_stat, key)
+            return key
+        return cached_func
+
+    def wrap_batch(self, batch_func):
+        def cached_batch_func(args):
+            arg_ids = list(map(self._arg_id, args))
+            file_stats = list(map(self._file_stat, args))
+            keys = list(map(self._get, arg_ids, file_stats))
+            miss_indexes = [index for index, key in enumerate(keys)
+                            if key is self.MISSING]
+            if not miss_indexes:
+                return keys
+            new_keys = batch_func([args[index] for index in miss_indexes])
+            if len(new_keys) != len(miss_indexes):
+                # Let the caller report the bad result.
+                return new_keys
+            for index, key in zip(miss_indexes, new_keys):
+                keys[index] = key
+                self._put(arg_ids[index], file_stats[index], key)
+            return keys
+        return cached_batch_func
+
+    def flush(self):
+        if self._pending:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO group_keys (code, arg, mtime, size, key)"
+                " VALUES (?, ?, ?, ?, ?)",
+                [(self.code_s, arg_id) + entry
+                 for arg_id, entry in self._pending.items()])
+            self._db.commit()
+            self._pending.clear()
+
+    def close(self):
+        import sqlite3
+        with ExceptionWrapper(UserKeyCacheError(self.path), sqlite3.Error):
+            try:
+                if self.error is not None:
+                    raise self.error
+                self.flush()
+            finally:
+                self._db.close()
+
+
+class StatCache(object):
+    # For --stat-cache: remember the result of stat'ing each path, including
+    # errors, so group code's os and os.path calls stat each path at most
+    # once per run.  DirectoryExpander adds the entries it finds, so file
+    # type checks on them don't need a system call at all.
+    def __init__(self, stat_func=os.stat, lstat_func=os.lstat):
+        self.stat_funcs = {True: stat_func, False: lstat_func}
+        self.hits = 0
+        self.misses = 0
+        self._results = {}
+        self._entries = {}
+
+    @staticmethod
+    def _cache_path(path):
+        try:
+            return os.fspath(path)
+        except AttributeError:
+            return path
+
+    def add_entry(self, path, entry):
+        # entry is an os.DirEntry for path.
+        self._entries[path] = entry
+
+    def stat(self, path, follow_symlinks=True):
+        # File descriptors can be reused for other files, so never cache them.
+        if isinstance(path, int):
+            return self.stat_funcs[follow_symlinks](path)
+        path = self._cache_path(path)
+        cache_key = (path, follow_symlinks)
+        try:
+            result = self._results[cache_key]
+        except KeyError:
+            self.misses += 1
+            entry = self._entries.get(path)
+            try:
+                if entry is None:
+                    result = self.stat_funcs[follow_symlinks](path)
+                else:
+                    result = entry.stat(follow_symlinks=follow_symlinks)
+            except EnvironmentError as error:
+                result = error
+            self._results[cache_key] = result
+        else:
+            self.hits += 1
+        if isinstance(result, EnvironmentError):
+            # Raise a copy, so tracebacks don't pile up on the cached error.
+            raise type(result)(result.errno, result.strerror, result.filename)
+        return result
+
+    @staticmethod
+    def _entry_mode(entry, follow_symlinks):
+        if (not follow_symlinks) and entry.is_symlink():
+            return stat.S_IFLNK
+        elif entry.is_dir(follow_symlinks=follow_symlinks):
+            return stat.S_IFDIR
+        elif entry.is_file(follow_symlinks=follow_symlinks):
+            return stat.S_IFREG
+        return None
+
+    # Returns the path's mode.  Only its file type bits are sure to be set.
+    def mode(self, path, follow_symlinks=True):
+        if not isinstance(path, int):
+            entry = self._entries.get(self._cache_path(path))
+            if entry is not None:
+                try:
+                    mode = self._entry_mode(entry, follow_symlinks)
+                except EnvironmentError:
+                    mode = None
+                if mode is not None:
+                    self.hits += 1
+                    return mode
+        return self.stat(path, follow_symlinks).st_mode
+
+
+class DirectoryExpander(object):
+    # For --expand-dirs: walk each input argument that names a directory,
+    # and yield the paths of the files under it instead.  Other arguments
+    # pass through.  A pool of threads reads each level of the tree, and
+    # the entries found go to the stat cache for group code to use.
+    # Paths are walked as bytes, so any file name can be passed on.
+    # Like find, a directory that can't be read is reported on stderr and
+    # skipped; errors_count says how many there were.
+    Pool = staticmethod(_thread_pool)
+
+    def __init__(self, roots, max_depth=None, name_pattern=None, follow_symlinks=False,
+                 threads_count=4, stat_cache=None, encoding=ENCODING, decode_paths=True,
+                 stderr=None):
+        self.roots = roots
+        self.max_depth = max_depth
+        if name_pattern is None:
+            self.name_pattern = None
+        else:
+            self.name_pattern = name_pattern.encode(encoding, DECODE_ERRORS)
+        self.follow_symlinks = follow_symlinks
+        self.threads_count = threads_count
+        self.stat_cache = stat_cache
+        self.encoding = encoding
+        self.decode_paths = decode_paths
+        self.stderr = stderr
+        self.errors_count = 0
+
+    def _root_bytes(self, root):
+        if isinstance(root, bytes):
+            return bytes(root)
+        return root.encode(self.encoding, DECODE_ERRORS)
+
+    @staticmethod
+    def _scan(dir_path):
+        return list(os.scandir(dir_path))
+
+    # Runs in the pool, so errors are returned to be reported in order.
+    def _try_scan(self, dir_path):
+        try:
+            return self._scan(dir_path)
+        except EnvironmentError as error:
+            return error
+
+    def _report_error(self, path, error):
+        self.errors_count += 1
+        stderr = sys.stderr if (self.stderr is None) else self.stderr
+        print("xargs_groupby: error reading directory {}: {}".format(
+            path.decode(self.encoding, DECODE_ERRORS), error.strerror or error),
+              file=stderr)
+
+    def _cache_entry(self, entry):
+        # Add the entry under the path group code will see.
+        path = entry.path
+        if self.decode_paths:
+            path = path.decode(self.encoding, DECODE_ERRORS)
+        self.stat_cache.add_entry(path, entry)
+
+    def _walk(self, pool, root):
+        import fnmatch
+        if not os.path.isdir(root):
+            yield root
+            return
+        # With follow_symlinks, each directory comes with the ids of the
+        # directories above it, to stop at symlink loops.
+        if self.follow_symlinks:
+            try:
+                root_stat = os.stat(root)
+            except EnvironmentError as error:
+                self._report_error(root, error)
+                return
+            dirs = [(root, frozenset([(root_stat.st_dev, root_stat.st_ino)]))]
+        else:
+            dirs = [(root, None)]
+        depth = 1
+        while dirs:
+            next_dirs = []
+            scanned = pool.imap(self._try_scan, [dir_path for dir_path, _ in dirs])
+            for (dir_path, parent_ids), entries in zip(dirs, scanned):
+                if isinstance(entries, EnvironmentError):
+                    self._report_error(dir_path, entries)
+                    continue
+                for entry in entries:
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=self.follow_symlinks)
+                        if is_dir and self.follow_symlinks:
+                            entry_stat = entry.stat()
+                    except EnvironmentError as error:
+                        self._report_error(entry.path, error)
+                        continue
+                    if is_dir:
+                        if (self.max_depth is not None) and (depth >= self.max_depth):
+                            continue
+                        dir_ids = None
+                        if self.follow_symlinks:
+                            dir_id = (entry_stat.st_dev, entry_stat.st_ino)
+                            if dir_id in parent_ids:
+                                continue
+                            dir_ids = parent_ids | frozenset([dir_id])
+                        next_dirs.append((entry.path, dir_ids))
+                    elif ((self.name_pattern is None)
+                          or fnmatch.fnmatchcase(entry.name, self.name_pattern)):
+                        if self.stat_cache is not None:
+                            self._cache_entry(entry)
+                        yield entry.path
+            dirs = next_dirs
+            depth += 1
+
+    def __iter__(self):
+        pool = self.Pool(self.threads_count)
+        try:
+            for root in self.roots:
+                for path in self._walk(pool, self._root_bytes(root)):
+                    yield path
+        finally:
+            pool.close()
+            pool.join()
+
+
+class InputPrepper(object):
+    NO_GROUP_KEY = object()
+
+    class DelimiterFinder(object):
+        # Track which bytes appear in a group's arguments.  present_bytes
+        # has every byte seen, and works as a delete table for
+        # bytes.translate(), which drops the bytes already seen from each
+        # new argument in one pass.  It can repeat bytes until it's as long
+        # as ALL_BYTES; then repeats are dropped, so it's only that long
+        # when every byte is present.
+        ALL_BYTES = bytes(bytearray(range(256)))
+
+        def __init__(self):
+            self.present_bytes = b''
+
+        # Returns the bytes from bytes_arg that weren't present before.
+        def update(self, bytes_arg):
+            new_bytes = bytes_arg.translate(None, self.present_bytes)
+            if new_bytes:
+                present_bytes = self.present_bytes + new_bytes
+                if len(present_bytes) >= len(self.ALL_BYTES):
+                    # Deleting the absent bytes from ALL_BYTES leaves
+                    # each present byte once.
+                    present_bytes = self.ALL_BYTES.translate(
+                        None, self.ALL_BYTES.translate(None, present_bytes))
+                self.present_bytes = present_bytes
+            return new_bytes
+
+        def exclude(self, bytes_arg):
+            new_bytes = self.update(bytes_arg)
+            if len(self.present_bytes) == len(self.ALL_BYTES):
+                raise UserArgumentsError("input arguments span all bytes - no delimiter available")
+            return new_bytes
+
+        def delimiter(self):
+            absent_bytes = self.ALL_BYTES.translate(None, self.present_bytes)
+            return absent_bytes[0] if absent_bytes else None
+
+
+    def __init__(self, group_func, delimiter=None, encoding=ENCODING, decode_args=True,
+                 new_group=list):
+        self.group_func = group_func
+        self.encoding = encoding
+        self.decode_args = decode_args
+        self.new_group = new_group
+        try:
+            delimiter_b = delimiter.encode(self.encoding)
+        except (AttributeError, UnicodeEncodeError):
+            delimiter_b = b''
+        if len(delimiter_b) == 1:
+            self._delimiter = delimiter_b[0]
+        else:
+            self._delimiter = None
+        # Without a delimiter, each group tracks the bytes in its arguments,
+        # and _all_finder tracks the bytes in every group.
+        self._delimiter_finders = collections.defaultdict(self.DelimiterFinder)
+        self._all_finder = self.DelimiterFinder()
+        self._groups = collections.defaultdict(self.new_group)
+
+    def __iter__(self):
+        return iter(self._groups)
+
+    def __getitem__(self, key):
+        return self._groups[key]
+
+    def __len__(self):
+        return len(self._groups)
+
+    def _arg_and_bytes(self, arg):
+        # Arguments from a bytes stream are kept as-is, and only decoded
+        # to pass to the group function when it wants text.
+        if isinstance(arg, bytes):
+            arg_bytes = arg
+            if self.decode_args:
+                arg = arg.decode(self.encoding, DECODE_ERRORS)
+        else:
+            # I *believe* it is impossible for a UnicodeEncodeError to occur
+            # here, as long as we continue to use the same encoding to both
+            # read input and write to xargs.  Since we read arg in *from* this
+            # encoding, it must be possible to write it back out in the same
+            # encoding.
+            # If I'm mistaken or an assumption changes, this might be a good
+            # place to wrap UnicodeEncodeError for better error reporting.
+            arg_bytes = arg.encode(self.encoding)
+            if not self.decode_args:
+                arg = arg_bytes
+        return arg, arg_bytes
+
+    def _key_and_bytes(self, arg):
+        arg, arg_bytes = self._arg_and_bytes(arg)
+        return self.group_func(arg), arg_bytes
+
+    @contextlib.contextmanager
+    def _fast_group_func(self):
+        try:
+            fast_calls = self.group_func.fast_calls
+        except AttributeError:
+            yield None
+        else:
+            with fast_calls() as group_func:
+                yield group_func
+
+    # fast_func is a group function from _fast_group_func(), or None.
+    def _keys_and_bytes(self, arg_seq, fast_func=None):
+        try:
+            stream_keys = self.group_func.stream_keys
+        except AttributeError:
+            pass
+        else:
+            return self._stream_keys_and_bytes(arg_seq, stream_keys)
+        try:
+            split_record = self.group_func.split_record
+        except AttributeError:
+            pass
+        else:
+            return self._record_keys_and_bytes(arg_seq, split_record)
+        try:
+            group_keys = self.group_func.group_keys
+        except AttributeError:
+            pass
+        else:
+            return self._batch_keys_and_bytes(arg_seq, group_keys)
+        if fast_func is None:
+            return (self._key_and_bytes(arg) for arg in arg_seq)
+        else:
+            return self._fast_keys_and_bytes(arg_seq, fast_func)
+
+    def _fast_keys_and_bytes(self, arg_seq, fast_func):
+        arg_and_bytes = self._arg_and_bytes
+        runtime_error = self.group_func.runtime_error
+        for arg in arg_seq:
+            arg, arg_bytes = arg_and_bytes(arg)
+            try:
+                key = fast_func(arg)
+            except Exception as error:
+                raise runtime_error(arg, error)
+            yield key, arg_bytes
+
+    def _record_keys_and_bytes(self, record_seq, split_record):
+        arg_and_bytes = self._arg_and_bytes
+        for record in record_seq:
+            key, arg = split_record(record)
+            # Give the key the same type group code would return for it.
+            yield arg_and_bytes(key)[0], arg_and_bytes(arg)[1]
+
+    def _stream_keys_and_bytes(self, arg_seq, stream_keys):
+        # stream_keys reads ahead of the keys it yields, so keep the bytes
+        # of arguments that are waiting for their key.
+        pending_bytes = collections.deque()
+        encoding = self.encoding
+        def iter_args_bytes():
+            for arg in arg_seq:
+                arg_bytes = arg if isinstance(arg, bytes) else arg.encode(encoding)
+                pending_bytes.append(arg_bytes)
+                yield arg_bytes
+        for key in stream_keys(iter_args_bytes()):
+            yield key, pending_bytes.popleft()
+
+    def _batch_args_and_bytes(self, batch):
+        # Like _arg_and_bytes for each argument, without per-argument calls
+        # when the batch is all bytes or all text.
+        bytes_count = sum([isinstance(arg, bytes) for arg in batch])
+        if bytes_count == len(batch):
+            args_bytes = batch
+            if self.decode_args:
+                encoding = self.encoding
+                batch = [arg.decode(encoding, DECODE_ERRORS) for arg in batch]
+        elif bytes_count == 0:
+            encoding = self.encoding
+            args_bytes = [arg.encode(encoding) for arg in batch]
+            if not self.decode_args:
+                batch = args_bytes
+        else:
+            batch, args_bytes = map(list, zip(*map(self._arg_and_bytes, batch)))
+        return batch, args_bytes
+
+    def _batch_keys_and_bytes(self, arg_seq, group_keys):
+        arg_iter = iter(arg_seq)
+        batch_size = self.group_func.BATCH_SIZE
+        batches = iter(lambda: list(itertools.islice(arg_iter, batch_size)), [])
+        return itertools.chain.from_iterable(
+            zip(group_keys(args), args_bytes)
+            for args, args_bytes in map(self._batch_args_and_bytes, batches))
+
+    def _exclude_delimiter(self, key, arg_bytes):
+        new_bytes = self._delimiter_finders[key].exclude(arg_bytes)
+        if new_bytes:
+            self._all_finder.update(new_bytes)
+
+    def add(self, arg_seq):
+        with self._fast_group_func() as fast_func:
+            for key, arg_bytes in self._keys_and_bytes(arg_seq, fast_func):
+                self[key].append(arg_bytes)
+                if self._delimiter is None:
+                    self._exclude_delimiter(key, arg_bytes)
+
+    def export(self):
+        # Return what merge() needs to add these groups to another prepper.
+        if self._delimiter is None:
+            groups_present = {key: finder.present_bytes
+                              for key, finder in self._delimiter_finders.items()}
+        else:
+            groups_present = None
+        return dict(self._groups), groups_present
+
+    def merge(self, groups, groups_present=None):
+        for key in groups:
+            self[key].extend(groups[key])
+        if self._delimiter is not None:
+            pass
+        elif groups_present is not None:
+            for key, present_bytes in groups_present.items():
+                self._exclude_delimiter(key, present_bytes)
+        else:
+            for key in groups:
+                for arg_bytes in groups[key]:
+                    self._exclude_delimiter(key, bytes(arg_bytes))
+
+    def delimiter(self, group_key=NO_GROUP_KEY):
+        # Use one delimiter for every group when there is one.
+        if self._delimiter is not None:
+            delimiter = self._delimiter
+        else:
+            delimiter = self._all_finder.delimiter()
+        if delimiter is not None:
+            return delimiter
+        elif group_key is self.NO_GROUP_KEY:
+            raise ValueError("no usable delimiter for all groups")
+        else:
+            return self._delimiter_finders[group_key].delimiter()
+
+
+class SortedInputPrepper(InputPrepper):
+    ON_REPEAT_ERROR = 'error'
+    ON_REPEAT_RERUN = 'rerun'
+
+    # The number of groups isn't known until all input has been read.
+    __len__ = None
+
+    def __init__(self, group_func, delimiter=None, encoding=ENCODING, decode_args=True,
+                 new_group=list, on_repeat=ON_REPEAT_ERROR):
+        super(SortedInputPrepper, self).__init__(
+            group_func, delimiter, encoding, decode_args, new_group)
+        self.on_repeat = on_repeat
+        self._keyed_args = iter(())
+        self._closed_keys = set()
+        self._groups = collections.defaultdict(collections.deque)
+        self._delimiters = {}
+
+    def __iter__(self):
+        group_key = self.NO_GROUP_KEY
+        group_args = self.new_group()
+        with ExceptionWrapper(UserArgumentsError, EnvironmentError, UnicodeDecodeError):
+            for key, arg_bytes in self._keyed_args:
+                if key != group_key:
+                    if group_args:
+                        yield self._close_group(group_key, group_args)
+                    self._check_repeat(key)
+                    group_key = key
+                    group_args = self.new_group()
+                    if self._delimiter is None:
+                        self._delimiter_finder = self.DelimiterFinder()
+                group_args.append(arg_bytes)
+                if self._delimiter is None:
+                    self._delimiter_finder.exclude(arg_bytes)
+            if group_args:
+                yield self._close_group(group_key, group_args)
+
+    def _check_repeat(self, key):
+        if (key in self._closed_keys) and (self.on_repeat != self.ON_REPEAT_RERUN):
+            raise UserArgumentsError(
+                "input is not sorted: group key {!r} appeared again".format(key))
+
+    def _close_group(self, key, group_args):
+        if self._delimiter is None:
+            delimiter = self._delimiter_finder.delimiter()
+        else:
+            delimiter = self._delimiter
+        self._groups[key].append((group_args, delimiter))
+        self._closed_keys.add(key)
+        return key
+
+    def __getitem__(self, key):
+        # Hand off each group as it's claimed, so we only keep groups in
+        # memory while they wait for their pipeline to start.
+        pending_groups = self._groups[key]
+        group_args, self._delimiters[key] = pending_groups.popleft()
+        if not pending_groups:
+            del self._groups[key]
+        return group_args
+
+    def add(self, arg_seq):
+        self._keyed_args = itertools.chain(self._keyed_args, self._keys_and_bytes(arg_seq))
+
+    def delimiter(self, group_key=InputPrepper.NO_GROUP_KEY):
+        if self._delimiter is not None:
+            return self._delimiter
+        elif group_key is self.NO_GROUP_KEY:
+            raise ValueError("no usable delimiter for all groups")
+        else:
+            return self._delimiters.pop(group_key)
+
+
+INPUT_PENDING = object()
+class StreamingInputPrepper(InputPrepper):
+    class GroupStream(object):
+        # Until its command starts, a group keeps its arguments in storage
+        # from new_group, which can spill them to disk for --memory-limit.
+        # After that, at most max_size arguments wait in queue.
+        def __init__(self, max_size, new_group=collections.deque):
+            self.max_size = max_size
+            self.queue = new_group()
+            self._waiting_args = None
+            self.started = False
+            self.finished = False
+            self.discarded = False
+
+        def __iter__(self):
+            return self
+
+        def __next__(self):
+            if not self.started:
+                self.started = True
+                if not isinstance(self.queue, collections.deque):
+                    self._waiting_args = iter(self.queue)
+                    self.queue = collections.deque()
+            if self._waiting_args is not None:
+                try:
+                    return next(self._waiting_args)
+                except StopIteration:
+                    self._waiting_args = None
+            try:
+                return self.queue.popleft()
+            except IndexError:
+                if self.finished:
+                    raise StopIteration
+                return INPUT_PENDING
+        next = __next__
+
+        def append(self, arg_bytes):
+            if not self.discarded:
+                self.queue.append(arg_bytes)
+
+        def close(self):
+            self.discarded = True
+            self._waiting_args = None
+            try:
+                release = self.queue.release
+            except AttributeError:
+                pass
+            else:
+                release()
+            self.queue = collections.deque()
+
+        def full(self):
+            return self.started and (len(self.queue) >= self.max_size)
+
+
+    # The number of groups isn't known until all input has been read.
+    __len__ = None
+
+    def __init__(self, group_func, delimiter=None, encoding=ENCODING, decode_args=True,
+                 new_group=collections.deque, buffer_size=1024):
+        super(StreamingInputPrepper, self).__init__(group_func, delimiter, encoding, decode_args)
+        # Commands start before we've seen all the arguments, so we can't
+        # search for a delimiter.  Use NUL, and refuse arguments with it.
+        if self._delimiter is None:
+            self._delimiter = b'\0'[0]
+            self._excluded_delimiter = b'\0'
+        else:
+            self._excluded_delimiter = None
+        self.buffer_size = buffer_size
+        self.new_group = new_group
+        self._groups = {}
+        self._new_keys = collections.deque()
+        self._arg_seq = None
+        self._args_ready = self._input_readable = lambda: True
+        self._keyed_args = iter(())
+        self._unread_keys = 0
+        self._full_group = None
+        self._done = False
+
+    def __iter__(self):
+        while self._new_keys or not self._done:
+            if self._new_keys:
+                yield self._new_keys.popleft()
+            else:
+                self.read()
+
+    def add(self, arg_seq):
+        self._arg_seq = arg_seq
+        self._keyed_args = itertools.chain(self._keyed_args, self._keys_and_bytes(arg_seq))
+        self._done = False
+        # Splitters say whether getting their next argument will wait for
+        # input.  Assume other sequences won't.
+        try:
+            args_ready = arg_seq.args_ready
+            self._input_readable = arg_seq.input_readable
+        except AttributeError:
+            self._args_ready = self._input_readable = lambda: True
+        else:
+            # Keys left from a batch are ready without more input.
+            self._args_ready = lambda: (self._unread_keys > 0) or args_ready()
+
+    # Batched group functions would otherwise wait for a full batch of
+    # arguments.  Cut each batch short when its next argument would wait
+    # for input, so groups start with what's been read.
+    def _batch_keys_and_bytes(self, arg_seq, group_keys):
+        try:
+            args_ready = arg_seq.args_ready
+            input_readable = arg_seq.input_readable
+        except AttributeError:
+            return super(StreamingInputPrepper, self)._batch_keys_and_bytes(
+                arg_seq, group_keys)
+        return self._short_batch_keys_and_bytes(
+            arg_seq, group_keys, lambda: not (args_ready() or input_readable()))
+
+    def _short_batch_keys_and_bytes(self, arg_seq, group_keys, input_stalled):
+        arg_iter = iter(arg_seq)
+        batch_size = self.group_func.BATCH_SIZE
+        batch = []
+        while True:
+            for arg in arg_iter:
+                batch.append(arg)
+                if (len(batch) >= batch_size) or input_stalled():
+                    break
+            if not batch:
+                break
+            args, args_bytes = self._batch_args_and_bytes(batch)
+            batch = []
+            keys = group_keys(args)
+            self._unread_keys = len(args_bytes)
+            for key, arg_bytes in zip(keys, args_bytes):
+                self._unread_keys -= 1
+                yield key, arg_bytes
+
+    # The file descriptor to wait on before the next read(), or None if
+    # there's no telling.  See InputSplitter.input_fd().
+    def input_fd(self):
+        if self._done:
+            return None
+        try:
+            if not self._args_ready():
+                return self._arg_seq.input_fd()
+        except AttributeError:
+            pass
+        return None
+
+    def _add_arg(self, key, arg_bytes):
+        if (self._excluded_delimiter is not None) and (self._excluded_delimiter in arg_bytes):
+            raise UserArgumentsError("input arguments include NUL - cannot stream with no delimiter")
+        try:
+            group = self._groups[key]
+        except KeyError:
+            group = self.GroupStream(self.buffer_size, self.new_group)
+            self._groups[key] = group
+            self._new_keys.append(key)
+            new_group = True
+        else:
+            new_group = False
+        group.append(arg_bytes)
+        if group.full():
+            self._full_group = group
+            return True
+        return new_group
+
+    # Read up to max_count arguments, stopping early at a new group or
+    # a full one.  After the first argument, stop rather than wait for
+    # more input, so the runner can pass on what we have.
+    def read(self, max_count=64):
+        with ExceptionWrapper(UserArgumentsError, EnvironmentError, UnicodeDecodeError):
+            args_ready = self._args_ready
+            input_readable = self._input_readable
+            for count in range(max_count):
+                if count and not (args_ready() or input_readable()):
+                    break
+                try:
+                    key, arg_bytes = next(self._keyed_args)
+                except StopIteration:
+                    self._done = True
+                    for group in self._groups.values():
+                        group.finished = True
+                    break
+                if self._add_arg(key, arg_bytes):
+                    break
+
+    def done_reading(self):
+        return self._done
+
+    def new_keys_count(self):
+        return len(self._new_keys)
+
+    def blocked(self):
+        if (self._full_group is not None) and not self._full_group.full():
+            self._full_group = None
+        return self._full_group is not None
+
+
+class GroupCommand(object):
+    def __init__(self, command, key_string, encoding=ENCODING):
+        self.template = list(command)
+        self.key_string = key_string
+        self.encoding = encoding
+
+    def command(self, group_key):
+        if self.key_string is None:
+            return list(self.template)
+        if isinstance(group_key, bytes):
+            group_key = group_key.decode(self.encoding, DECODE_ERRORS)
+        return list(arg.replace(self.key_string, group_key)
+                    for arg in self.template)
+
+
+class XargsCommand(object):
+    def __init__(self, xargs_base, group_cmd):
+        self.xargs_base = list(xargs_base)
+        self.group_cmd = group_cmd
+        self.switches = {'--max-procs': '1'}
+
+    def set_options(self, args):
+        args_dict = vars(args)
+        for key in args_dict:
+            switch_name = '{}{}'.format(
+                '-' if (len(key) == 1) else '--',
                 key.replace('_', '-'))
             self.switches[switch_name] = args_dict[key]
 
@@ -769,25 +2865,46 @@ class ProcessWriter(object):
     def __init__(self, cmd, input_seq, sep_byte):
         with self.sync_process(), \
              ExceptionWrapper(UserCommandError(cmd[0]), EnvironmentError):
-            self.proc = self.Popen(cmd, stdin=subprocess.PIPE)
+            # Unbuffered, so each write reaches the command right away.
+            # write() only gets as much as the pipe has room for.
+            self.proc = self.Popen(cmd, stdin=subprocess.PIPE, bufsize=0)
             self.process_registry.add(self.proc)
         self.input_seq = iter(input_seq)
         self.sep_byte = sep_byte
         self.returncode = None
         self.write_error = None
         self.write_buffer = bytearray()
-        if not self._fill_buffer():
-            self.proc.stdin.close()
+        self.input_done = False
+        if not (self._fill_buffer() or self.input_pending()):
+            self._close_stdin()
 
     def _fill_buffer(self):
         try:
-            self.write_buffer.extend(next(self.input_seq))
+            next_input = next(self.input_seq)
         except StopIteration:
+            self.input_done = True
+            return False
+        if next_input is INPUT_PENDING:
             return False
+        self.write_buffer.extend(next_input)
+        if self.sep_byte is not None:
+            self.write_buffer.append(self.sep_byte)
+        return True
+
+    def _close_stdin(self):
+        self.proc.stdin.close()
+        try:
+            close_input = self.input_seq.close
+        except AttributeError:
+            pass
         else:
-            if self.sep_byte is not None:
-                self.write_buffer.append(self.sep_byte)
-            return True
+            close_input()
+
+    def input_pending(self):
+        return not (self.input_done or self.write_buffer)
+
+    def waiting_for_input(self):
+        return self.input_pending() and not self._fill_buffer() and not self.input_done
 
     def write(self, bytecount):
         while (len(self.write_buffer) < bytecount) and self._fill_buffer():
@@ -803,8 +2920,9 @@ class ProcessWriter(object):
         except EnvironmentError as error:
             self.write_error = error
         self.write_buffer = next_buffer
-        if self.write_error or not (self.write_buffer or self._fill_buffer()):
-            self.proc.stdin.close()
+        if self.write_error or not (self.write_buffer or self._fill_buffer()
+                                    or self.input_pending()):
+            self._close_stdin()
 
     def done_writing(self):
         return self.proc.stdin.closed
@@ -824,12 +2942,60 @@ class ProcessWriter(object):
         return self.proc.stdin.fileno()
 
 
+class FileProcessWriter(ProcessWriter):
+    # Write all of a group's arguments to an anonymous file before starting
+    # the command, and give it that file as stdin.  xargs reads it at memory
+    # speed, and we don't have to poll and refill a pipe for it.
+    # This can't be used with streaming input.
+    WRITE_SIZE = 65536
+
+    @staticmethod
+    def new_arg_file():
+        try:
+            fd = os.memfd_create('xargs_groupby')
+        except (AttributeError, EnvironmentError):
+            # No memfd_create in this Python or on this platform.
+            import tempfile
+            return tempfile.TemporaryFile()
+        return io.open(fd, 'w+b')
+
+    def __init__(self, cmd, input_seq, sep_byte):
+        self.input_seq = iter(input_seq)
+        self.sep_byte = sep_byte
+        self.returncode = None
+        self.write_error = None
+        self.write_buffer = bytearray()
+        self.input_done = False
+        with ExceptionWrapper(UserCommandError(cmd[0]), EnvironmentError), \
+             self.new_arg_file() as arg_file:
+            self._write_arg_file(arg_file)
+            with self.sync_process():
+                self.proc = self.Popen(cmd, stdin=arg_file)
+                self.process_registry.add(self.proc)
+
+    def _write_arg_file(self, arg_file):
+        while self._fill_buffer():
+            if len(self.write_buffer) >= self.WRITE_SIZE:
+                arg_file.write(self.write_buffer)
+                del self.write_buffer[:]
+        arg_file.write(self.write_buffer)
+        del self.write_buffer[:]
+        arg_file.seek(0)
+
+    def write(self, bytecount):
+        pass
+
+    def done_writing(self):
+        return True
+
+
 class MultiProcessWriter(object):
     Poll = select.poll
     PIPE_BUF = select.PIPE_BUF
 
     def __init__(self):
         self.procs = {}
+        self.idle_fds = set()
         self.poller = self.Poll()
 
     def add(self, proc_writer):
@@ -838,15 +3004,52 @@ class MultiProcessWriter(object):
             self.poller.register(fd, select.POLLOUT)
             self.procs[fd] = proc_writer
 
+    def _wake_idle(self):
+        # Writers that ran out of input are idle so poll doesn't spin on
+        # their writable pipes.  Start polling them again once input arrives.
+        woken_fds = [fd for fd in self.idle_fds
+                     if not self.procs[fd].waiting_for_input()]
+        for fd in woken_fds:
+            self.poller.modify(fd, select.POLLOUT)
+            self.idle_fds.remove(fd)
+
     def write_ready(self, timeout=None):
         if not self.procs:
             return
-        for fd, _ in self.poller.poll(timeout):
+        if self.idle_fds:
+            self._wake_idle()
+        self._write_fds(fd for fd, _ in self.poller.poll(timeout))
+
+    # Keep writing to commands until read_fd has input to read, and return
+    # True.  Return False if timeout passes with nothing to do.
+    def write_until_readable(self, read_fd, timeout=None):
+        self.poller.register(read_fd, select.POLLIN)
+        try:
+            while True:
+                if self.idle_fds:
+                    self._wake_idle()
+                ready_fds = [fd for fd, _ in self.poller.poll(timeout)]
+                if not ready_fds:
+                    return False
+                elif read_fd in ready_fds:
+                    ready_fds.remove(read_fd)
+                    self._write_fds(ready_fds)
+                    return True
+                self._write_fds(ready_fds)
+        finally:
+            self.poller.unregister(read_fd)
+
+    def _write_fds(self, fds):
+        for fd in fds:
             proc = self.procs[fd]
             proc.write(self.PIPE_BUF)
             if proc.done_writing():
                 self.poller.unregister(fd)
                 del self.procs[fd]
+                self.idle_fds.discard(fd)
+            elif proc.waiting_for_input():
+                self.poller.modify(fd, 0)
+                self.idle_fds.add(fd)
 
     def writing_count(self):
         return len(self.procs)
@@ -881,18 +3084,67 @@ class ProcessPipeline(object):
         return self._success
 
 
+class FileProcessPipeline(ProcessPipeline):
+    ProcessWriter = FileProcessWriter
+
+
+class JobTokens(object):
+    # A pipe holding one byte for each pipeline that may run at once, shared
+    # by every job that a --serve process forks, like make's jobserver.
+    # Runners take a byte before starting a pipeline, and put it back when
+    # the pipeline finishes.
+    TOKEN = b'+'
+
+    def __init__(self, count):
+        import fcntl
+        self.read_fd, self.write_fd = os.pipe()
+        flags = fcntl.fcntl(self.read_fd, fcntl.F_GETFL)
+        fcntl.fcntl(self.read_fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        os.write(self.write_fd, self.TOKEN * count)
+        self.held = 0
+
+    def take(self, block=False):
+        while True:
+            try:
+                if os.read(self.read_fd, 1):
+                    self.held += 1
+                    return True
+            except EnvironmentError as error:
+                if error.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    raise
+            if not block:
+                return False
+            select.select([self.read_fd], [], [])
+
+    def put(self):
+        os.write(self.write_fd, self.TOKEN)
+        self.held -= 1
+
+    def put_all(self):
+        if self.held:
+            os.write(self.write_fd, self.TOKEN * self.held)
+            self.held = 0
+
+    def close(self):
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+
+
 class PipelineRunner(object):
     MultiProcessWriter = MultiProcessWriter
 
-    def __init__(self, max_procs=1):
+    def __init__(self, max_procs=1, job_tokens=None):
         self.multi_writer = self.MultiProcessWriter()
         self.max_procs = max_procs
+        self.job_tokens = job_tokens
+        self._next_pipeline = None
         self._run_count = 0
         self._failures_count = 0
 
     def run(self, pipelines):
-        pipelines_to_run = iter(pipelines)
-        running_pipelines = set()
+        self._run_pipelines(iter(pipelines), set())
+
+    def _run_pipelines(self, pipelines_to_run, running_pipelines):
         while True:
             self._start_pipelines(pipelines_to_run, running_pipelines)
             if not running_pipelines:
@@ -900,16 +3152,25 @@ class PipelineRunner(object):
             self._write_ready(running_pipelines)
             self._advance_pipelines(running_pipelines)
 
+    def _start_count(self, running_pipelines):
+        return self.max_procs - len(running_pipelines)
+
     def _start_pipelines(self, pipelines_to_run, running_pipelines):
-        while len(running_pipelines) < self.max_procs:
-            try:
-                next_pipeline = next(pipelines_to_run)
-            except StopIteration:
+        for _ in range(self._start_count(running_pipelines)):
+            if self._next_pipeline is None:
+                try:
+                    self._next_pipeline = next(pipelines_to_run)
+                except StopIteration:
+                    break
+            # Only wait for a token when nothing is running.  Otherwise,
+            # keep feeding our running pipelines, and try again later.
+            if ((self.job_tokens is not None)
+                  and not self.job_tokens.take(block=not running_pipelines)):
                 break
-            else:
-                running_pipelines.add(next_pipeline)
-                self.multi_writer.add(next_pipeline.next_proc())
-                self._run_count += 1
+            next_pipeline, self._next_pipeline = self._next_pipeline, None
+            running_pipelines.add(next_pipeline)
+            self.multi_writer.add(next_pipeline.next_proc())
+            self._run_count += 1
 
     def _write_ready(self, running_pipelines):
         running_count = len(running_pipelines)
@@ -934,6 +3195,8 @@ class PipelineRunner(object):
                 if not pipeline.success():
                     self._failures_count += 1
                 done_pipelines.add(pipeline)
+                if self.job_tokens is not None:
+                    self.job_tokens.put()
             else:
                 self.multi_writer.add(new_proc)
         running_pipelines.difference_update(done_pipelines)
@@ -945,10 +3208,50 @@ class PipelineRunner(object):
         return self._failures_count
 
 
+class StreamingPipelineRunner(PipelineRunner):
+    READ_COUNT = 64
+    # In milliseconds, like poll().
+    WAIT_TIMEOUT = 100
+
+    def __init__(self, max_procs, input_prepper, job_tokens=None):
+        super(StreamingPipelineRunner, self).__init__(max_procs, job_tokens)
+        self.input_prepper = input_prepper
+
+    def run(self, pipelines):
+        pipelines_to_run = iter(pipelines)
+        running_pipelines = set()
+        while not self.input_prepper.done_reading():
+            self._start_pipelines(pipelines_to_run, running_pipelines)
+            if self.input_prepper.blocked():
+                self.multi_writer.write_ready(self.WAIT_TIMEOUT)
+            elif self._input_ready():
+                self.input_prepper.read(self.READ_COUNT)
+            self._advance_pipelines(running_pipelines)
+        self._run_pipelines(pipelines_to_run, running_pipelines)
+
+    def _input_ready(self):
+        input_fd = self.input_prepper.input_fd()
+        if input_fd is None:
+            self.multi_writer.write_ready(0)
+            return True
+        # Feed commands while we wait for input, rather than block on the
+        # read with their arguments in hand.
+        return self.multi_writer.write_until_readable(input_fd, self.WAIT_TIMEOUT)
+
+    def _start_count(self, running_pipelines):
+        start_count = super(StreamingPipelineRunner, self)._start_count(running_pipelines)
+        if self.input_prepper.done_reading():
+            return start_count
+        else:
+            # Only start pipelines for keys we've already seen, so we don't
+            # block reading input while other pipelines are waiting on it.
+            return min(start_count, self.input_prepper.new_keys_count())
+
+
 class VersionAction(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
-        print("{} {}".format(parser.prog, VERSION), COPYRIGHT, LICENSE,
-              sep="\n\n")
+        parser._print_message("{} {}\n\n{}\n\n{}\n".format(
+            parser.prog, VERSION, COPYRIGHT, LICENSE), sys.stdout)
         parser.exit(0)
 
 
@@ -995,7 +3298,7 @@ class ArgumentParser(argparse.ArgumentParser):
             help="Display version and license information")
         self.add_argument(
             '--debug', action='store_true',
-            help="Display debugging details about errors")
+            help="Display debugging details about errors, and statistics")
         self.add_argument(
             '--arg-file', '-a', metavar='FILE',
             help="Read arguments from file instead of stdin")
@@ -1013,17 +3316,126 @@ class ArgumentParser(argparse.ArgumentParser):
             '--null', '-0',
             dest='delimiter', action='store_const', const=r'\0',
             help="Use the null character as the delimiter")
+        self.add_argument(
+            '--args-via-file', action='store_true',
+            help="Pass each group's arguments to xargs in a temporary file"
+            " instead of a pipe")
+        self.add_argument(
+            '--async-group-code', metavar='LIMIT', nargs='?', type=int, const=64,
+            help="Group code may return awaitables, like those from"
+            " asyncio.unix_query() with --query-socket; await up to this many"
+            " at once (default %(const)s)")
+        self.add_argument(
+            '--batch-group-code', action='store_true',
+            help="Group code takes a list of arguments, and returns a"
+            " sequence of their keys")
+        self.add_argument(
+            '--connect', metavar='SOCKET',
+            help="Send this run to the xargs_groupby --serve process"
+            " listening on this socket.  Give this option first, so the"
+            " client starts without loading the rest of xargs_groupby")
+        self.add_argument(
+            '--expand-dirs', action='store_true',
+            help="Walk each argument that names a directory, and group the"
+            " files found under it instead.  Directories that can't be read"
+            " are reported and skipped, and the run exits 3.  Implies --stat-cache")
+        self.add_argument(
+            '--expand-depth', metavar='NUM', type=int,
+            help="With --expand-dirs, descend at most this many levels"
+            " below each directory")
+        self.add_argument(
+            '--expand-follow', action='store_true',
+            help="With --expand-dirs, follow symbolic links to directories")
+        self.add_argument(
+            '--expand-name', metavar='PATTERN',
+            help="With --expand-dirs, only use files whose names match"
+            " this shell pattern")
+        self.add_argument(
+            '--expand-threads', metavar='NUM', type=int, default=4,
+            help="Number of threads to read directories with for --expand-dirs")
+        self.add_argument(
+            '--group-by', metavar='KEY', type=self._parse_group_by,
+            help="Group by a built-in key instead of group code: dirname, ext,"
+            " component:N, field:SEP:N, or regex:PATTERN")
+        self.add_argument(
+            '--group-bytes', action='store_true',
+            help="Pass arguments to group code as bytes instead of strings")
+        self.add_argument(
+            '--group-threads', metavar='NUM', type=int, default=1,
+            help="Number of threads to run group code in, for code that"
+            " mostly waits on I/O")
+        self.add_argument(
+            '--group-workers', metavar='NUM', type=int, default=1,
+            help="Number of processes to run group code in")
         self.add_argument(
             '--group-str', '-G', metavar='STR',
             help="Replace this string in commands with the group key")
         self.add_argument(
-            '--max-procs', '-P', metavar='NUM', type=int, default=1,
-            help="Maximum number of processes to run at once")
+            '--keyed-input', metavar='=SEP', nargs='?', const='\t',
+            help="Each input line (or delimited record) is a key, SEP, and an"
+            " argument; group by the key instead of group code"
+            " (default separator is a tab; give another as --keyed-input=SEP)")
+        self.add_argument(
+            '--key-cache', metavar='PATH',
+            help="Save group keys in this database file, and reuse them in"
+            " later runs with the same group code")
+        self.add_argument(
+            '--max-procs', '-P', metavar='NUM', type=int,
+            help="Maximum number of processes to run at once"
+            " (default 1, or the number of CPUs with --serve)")
+        self.add_argument(
+            '--memoize-group-code', metavar='SIZE', nargs='?',
+            type=self._parse_size, const=65536,
+            help="Cache the group code's result for this many recent"
+            " arguments (default %(const)s)")
+        self.add_argument(
+            '--memory-limit', metavar='SIZE', type=self._parse_size,
+            help="Write grouped arguments to a temporary file after they use"
+            " this much memory (suffixes K, M, G are allowed)")
+        order_group = self.add_mutually_exclusive_group()
+        order_group.add_argument(
+            '--sorted-input',
+            action='store_const', const=SortedInputPrepper.ON_REPEAT_ERROR,
+            help="Input is grouped by key; run each group when the key changes,"
+            " and stop with an error if a key appears again")
+        order_group.add_argument(
+            '--sorted-input-rerun', dest='sorted_input',
+            action='store_const', const=SortedInputPrepper.ON_REPEAT_RERUN,
+            help="Like --sorted-input, but run a group's commands again"
+            " if its key appears again")
+        order_group.add_argument(
+            '--stream', action='store_true',
+            help="Start each group's commands as soon as its key first appears")
+        self.add_argument(
+            '--stream-buffer', metavar='NUM', type=int, default=1024,
+            help="Maximum arguments to buffer for a running group with --stream."
+            "  Groups waiting to start are buffered under --memory-limit")
+        self.add_argument(
+            '--parse-workers', metavar='NUM', type=int, default=1,
+            help="Number of processes to group arguments from a delimited"
+            " --arg-file with")
+        self.add_argument(
+            '--query-socket', metavar='PATH', action='append',
+            help="Let --async-group-code send requests to this Unix socket"
+            " with asyncio.unix_query(path, request); can be repeated")
+        self.add_argument(
+            '--serve', metavar='SOCKET',
+            help="Listen on this Unix socket, and run each --connect run"
+            " sent to it.  --max-procs limits processes across all runs")
+        self.add_argument(
+            '--stat-cache', action='store_true',
+            help="Stat each path at most once when group code calls os.stat"
+            " or os.path functions like getsize and isdir")
+        self.add_command_argument(
+            '--group-cmd',
+            help="Command that reads arguments, one per line, and writes each"
+            " one's group key on a line; use it instead of group code."
+            " Terminate it with ';'")
         self.add_command_argument(
             '--preexec', '--pre',
             help="Command to run per group before the main command, terminated with ';'")
         self.add_argument(
-            'group_code',
+            'group_code', nargs='?',
             help="Python expression or callable to group arguments")
         self.add_argument(
             'command', nargs=argparse.REMAINDER, metavar='command',
@@ -1045,6 +3457,23 @@ class ArgumentParser(argparse.ArgumentParser):
         else:
             return eval('u"\\{}"'.format(groups[0]), {})
 
+    @staticmethod
+    def _parse_size(size_s):
+        match = re.match(r'^\s*([0-9]+)\s*([kmg]?)i?b?\s*$', size_s, re.IGNORECASE)
+        if match is None:
+            raise argparse.ArgumentTypeError("invalid size: {!r}".format(size_s))
+        number, suffix = match.groups()
+        return int(number) * (1024 ** ' kmg'.index(suffix.lower() or ' '))
+
+    @staticmethod
+    def _parse_group_by(spec):
+        try:
+            KeyExtractor.parse_spec(spec)
+        except (ValueError, re.error) as error:
+            raise argparse.ArgumentTypeError(
+                "invalid key {!r}: {}".format(spec, error))
+        return spec
+
     def _parse_escapes(self, delimiter_s):
         return re.subn(r'\\([abfnrtv]|([0-9]{1,3})|x([0-9a-fA-F]{1,2}))',
                        self._parse_escape, delimiter_s)[0]
@@ -1073,6 +3502,40 @@ class ArgumentParser(argparse.ArgumentParser):
             setattr(namespace, dest, arglist[start_index + 1:end_index])
             del arglist[start_index:end_index + 1]
 
+    @staticmethod
+    def _is_option_value(action, value_s):
+        try:
+            action.type(value_s)
+        except (argparse.ArgumentTypeError, TypeError, ValueError):
+            return False
+        return True
+
+    def fill_optional_values(self, arglist):
+        # argparse would take the group code as the value of an option with
+        # an optional value, so give those options their value explicitly,
+        # unless the next word is a valid value for the option's type.
+        # Untyped values, like --keyed-input's separator, can't be told
+        # apart from the command, so they must be given as OPT=VALUE.
+        index = 0
+        while index < len(arglist):
+            switch = arglist[index]
+            if (switch == '--') or not switch.startswith('-'):
+                break
+            try:
+                action = self._option_string_actions[switch]
+            except KeyError:
+                pass
+            else:
+                if action.nargs == '?':
+                    if ((action.type is not None) and (index + 1 < len(arglist))
+                          and self._is_option_value(action, arglist[index + 1])):
+                        index += 1
+                    else:
+                        arglist[index] = '{}={}'.format(switch, action.const)
+                elif action.nargs is None:
+                    index += 1
+            index += 1
+
     def parse_args(self, arglist, namespace=None):
         if PY_MAJVER < 3:
             arglist = [arg.decode(self.ARGV_ENCODING) for arg in arglist]
@@ -1081,6 +3544,7 @@ class ArgumentParser(argparse.ArgumentParser):
         if namespace is None:
             namespace = argparse.Namespace()
         self.parse_command_options(arglist, namespace)
+        self.fill_optional_values(arglist)
         args = super(ArgumentParser, self).parse_args(arglist, namespace)
         xargs_opts = self.xargs_parser.parse_args([])
         for xargs_optname in vars(xargs_opts):
@@ -1088,10 +3552,124 @@ class ArgumentParser(argparse.ArgumentParser):
             delattr(args, xargs_optname)
         if args.delimiter is not None:
             args.delimiter = self._parse_escapes(args.delimiter)
+        key_sources = [args.group_by, args.keyed_input, args.group_cmd]
+        key_sources_count = sum(source is not None for source in key_sources)
+        if key_sources_count:
+            # There's no group code, so the first positional argument
+            # starts the command.
+            if args.group_code is not None:
+                args.command.insert(0, args.group_code)
+                args.group_code = None
+            if (args.batch_group_code or (args.group_workers > 1) or (args.group_threads > 1)
+                  or (args.async_group_code is not None)
+                  or (args.memoize_group_code is not None) or args.stat_cache):
+                self.error("--group-by, --group-cmd, and --keyed-input can't be"
+                           " used with options for group code")
+        if key_sources_count > 1:
+            self.error("only one of --group-by, --group-cmd, and --keyed-input"
+                       " can be used")
+        if args.group_cmd is not None:
+            if not args.group_cmd:
+                self.error("--group-cmd command can't be empty")
+            if args.key_cache is not None:
+                self.error("--group-cmd can't be used with --key-cache")
+            if args.parse_workers > 1:
+                self.error("--group-cmd can't be used with --parse-workers")
+            if args.stream:
+                self.error("--group-cmd can't be used with --stream")
+        if args.keyed_input is not None:
+            args.keyed_input = self._parse_escapes(args.keyed_input)
+            if not args.keyed_input:
+                self.error("--keyed-input separator can't be empty")
+            if args.key_cache is not None:
+                self.error("--keyed-input can't be used with --key-cache")
+            # Keys usually come one per line, and the default separator
+            # is whitespace that would split a record into words.
+            if args.delimiter is None:
+                args.delimiter = '\n'
+        if args.serve is not None:
+            if (args.group_code is not None) or key_sources_count:
+                self.error("--serve takes group code and commands from --connect runs")
+            if args.connect is not None:
+                self.error("--serve can't be used with --connect")
+        elif (args.group_code is None) and not key_sources_count:
+            self.error("the following arguments are required: group_code")
+        if (args.serve is not None) or (args.connect is not None):
+            import socket
+            if not hasattr(socket.socket, 'sendmsg'):
+                self.error("--serve and --connect require Python 3")
+        if args.max_procs is None:
+            if args.serve is None:
+                args.max_procs = 1
+            else:
+                args.max_procs = os.cpu_count() or 1
+        if args.args_via_file and args.stream:
+            self.error("--args-via-file can't be used with --stream")
+        if args.memoize_group_code is not None:
+            if args.batch_group_code:
+                self.error("--memoize-group-code can't be used with --batch-group-code")
+            if (args.group_workers > 1) or (args.group_threads > 1):
+                self.error("--memoize-group-code can't be used with"
+                           " --group-workers or --group-threads")
+            if not hasattr(functools, 'lru_cache'):
+                self.error("--memoize-group-code requires Python 3")
+        if args.parse_workers > 1:
+            # Forked parse workers would share the key cache's database
+            # connection, and keep memoize counters --debug can't see.
+            if args.key_cache is not None:
+                self.error("--key-cache can't be used with --parse-workers")
+            if args.memoize_group_code is not None:
+                self.error("--memoize-group-code can't be used with --parse-workers")
+        if args.expand_dirs:
+            if not hasattr(os, 'scandir'):
+                self.error("--expand-dirs requires Python 3")
+            if args.keyed_input is not None:
+                self.error("--expand-dirs can't be used with --keyed-input")
+            if args.parse_workers > 1:
+                self.error("--expand-dirs can't be used with --parse-workers")
+            if (args.expand_depth is not None) and (args.expand_depth < 1):
+                self.error("--expand-depth must be at least 1")
+            if args.expand_threads < 1:
+                self.error("--expand-threads must be at least 1")
+            # The walk's directory entries answer group code's stat calls.
+            if (args.group_code is not None) and (args.group_workers == 1):
+                args.stat_cache = True
+        elif ((args.expand_depth is not None) or args.expand_follow
+              or (args.expand_name is not None)):
+            self.error("--expand-depth, --expand-follow, and --expand-name"
+                       " require --expand-dirs")
+        if args.stat_cache and ((args.group_workers > 1) or (args.parse_workers > 1)):
+            # Each worker process would have its own cache, out of reach
+            # of the --debug counters.
+            self.error("--stat-cache can't be used with --group-workers or --parse-workers")
+        if (args.parse_workers > 1) and (args.stream or args.sorted_input):
+            self.error("--parse-workers can't be used with --stream or --sorted-input")
+        if (args.group_workers > 1) and (args.parse_workers > 1):
+            self.error("--group-workers can't be used with --parse-workers")
+        if args.group_threads > 1:
+            if args.group_workers > 1:
+                self.error("--group-threads can't be used with --group-workers")
+            if args.batch_group_code:
+                self.error("--group-threads can't be used with --batch-group-code")
+        if args.async_group_code is not None:
+            try:
+                import asyncio
+            except ImportError:
+                self.error("--async-group-code requires Python 3")
+            if (args.batch_group_code or (args.group_workers > 1)
+                  or (args.group_threads > 1) or (args.memoize_group_code is not None)):
+                self.error("--async-group-code can't be used with --batch-group-code,"
+                           " --group-workers, --group-threads, or --memoize-group-code")
+        elif args.query_socket is not None:
+            self.error("--query-socket requires --async-group-code")
         return args, xargs_opts
 
 
 class Program(object):
+    # Input in these encodings can be split on an encoded delimiter,
+    # because the delimiter's bytes can't appear inside another character.
+    BYTES_SPLIT_ENCODINGS = frozenset(['ascii', 'iso8859-1', 'utf-8'])
+
     def __init__(self, args, xargs_opts):
         self.args = args
         self.xargs_opts = xargs_opts
@@ -1102,31 +3680,188 @@ class Program(object):
         args, xargs_opts = parser.parse_args(arglist)
         return cls(args, xargs_opts)
 
-    def group_function(self, constructor=UserExpression):
-        return constructor(self.args.group_code)
+    def key_cache(self, cache_class=KeyCache):
+        if self.args.key_cache is None:
+            return None
+        # The same source can give different keys in each mode, or for
+        # arguments decoded differently, so those are part of the code.
+        if self.args.group_by is not None:
+            cache_opts = ['--group-by', self.args.group_by]
+        elif self.args.batch_group_code:
+            cache_opts = ['--batch-group-code']
+        elif self.args.async_group_code is not None:
+            cache_opts = ['--async-group-code']
+        else:
+            cache_opts = []
+        if self.args.group_bytes:
+            cache_opts.append('--group-bytes')
+        else:
+            cache_opts.append('--encoding=' + codecs.lookup(self.args.encoding).name)
+        if self.args.group_by is None:
+            cache_opts.append(self.args.group_code)
+        return cache_class(self.args.key_cache, ' '.join(cache_opts))
+
+    def stat_cache(self, cache_class=StatCache):
+        if not self.args.stat_cache:
+            return None
+        return cache_class()
+
+    def group_function(self, constructor=UserExpression,
+                       batch_constructor=BatchUserExpression,
+                       pooled_constructor=PooledUserExpression,
+                       threaded_constructor=ThreadedUserExpression,
+                       async_constructor=AsyncUserExpression,
+                       extractor_constructor=KeyExtractor,
+                       keys_constructor=InputKeys, coprocess_constructor=CoprocessKeys,
+                       key_cache=None, stat_cache=None):
+        if self.args.batch_group_code:
+            constructor = batch_constructor
+        if self.args.keyed_input is not None:
+            return keys_constructor(self.args.keyed_input, self.args.encoding)
+        elif self.args.group_cmd is not None:
+            return coprocess_constructor(
+                self.args.group_cmd, self.args.group_bytes, self.args.encoding)
+        elif self.args.group_by is not None:
+            group_func = extractor_constructor(
+                self.args.group_by, self.args.group_bytes, self.args.encoding)
+        elif self.args.group_workers > 1:
+            group_func = pooled_constructor(
+                self.args.group_code, self.args.group_workers, constructor)
+        elif self.args.group_threads > 1:
+            group_func = threaded_constructor(
+                self.args.group_code, self.args.group_threads, constructor)
+        elif self.args.async_group_code is not None:
+            group_func = async_constructor(
+                self.args.group_code, self.args.async_group_code, constructor,
+                self.args.query_socket or ())
+        else:
+            group_func = constructor(self.args.group_code)
+        if stat_cache is not None:
+            group_func.use_stat_cache(stat_cache)
+        if key_cache is not None:
+            group_func.use_key_cache(key_cache)
+        if self.args.memoize_group_code is not None:
+            group_func.memoize(self.args.memoize_group_code)
+        return group_func
+
+    def debug_stats(self, group_func, key_cache=None, stat_cache=None):
+        try:
+            cache_info = group_func.cache_info()
+        except AttributeError:
+            pass
+        else:
+            yield "group code cache: {} hits, {} misses".format(
+                cache_info.hits, cache_info.misses)
+        if key_cache is not None:
+            yield "key cache: {} hits, {} misses".format(
+                key_cache.hits, key_cache.misses)
+        if stat_cache is not None:
+            yield "stat cache: {} hits, {} misses".format(
+                stat_cache.hits, stat_cache.misses)
+
+    def bytes_delimiter(self):
+        if self.args.delimiter is None:
+            return None
+        elif codecs.lookup(self.args.encoding).name not in self.BYTES_SPLIT_ENCODINGS:
+            return None
+        try:
+            return self.args.delimiter.encode(self.args.encoding)
+        except UnicodeEncodeError:
+            return None
 
-    def input_file(self, open_func=io.open):
+    def input_file(self, open_func=io.open, map_func=mmap.mmap):
         source = sys.stdin.fileno() if (self.args.arg_file is None) else self.args.arg_file
+        if self.bytes_delimiter() is None:
+            open_kwargs = {'encoding': self.args.encoding}
+        else:
+            open_kwargs = {'mode': 'rb'}
         with ExceptionWrapper(UserArgumentsError, EnvironmentError):
-            return open_func(source, encoding=self.args.encoding)
-
-    def input_parser(self, input_file, shlexer=InputShlexer, splitter=InputSplitter):
+            input_file = open_func(source, **open_kwargs)
+        # Python 2 can't make a memoryview of a mapping.
+        if (self.args.arg_file is None) or ('mode' not in open_kwargs) or (PY_MAJVER < 3):
+            return input_file
+        # Map regular files, so arguments can be kept as offsets into the
+        # page cache.  Files that can't be mapped (pipes, empty files)
+        # are read normally.
+        try:
+            mapping = map_func(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (EnvironmentError, ValueError):
+            return input_file
+        input_file.close()
+        return mapping
+
+    def input_parser(self, input_file, shlexer=InputShlexer, splitter=InputSplitter,
+                     mapped_splitter=MappedInputSplitter,
+                     parallel_splitter=ParallelMappedInputSplitter):
         if self.args.delimiter is None:
             return shlexer(input_file, self.args.eof_str)
+        delimiter = self.bytes_delimiter()
+        if delimiter is None:
+            delimiter = self.args.delimiter
+        elif not isinstance(input_file, mmap.mmap):
+            pass
+        elif self.args.parse_workers > 1:
+            return parallel_splitter(input_file, delimiter, self.args.parse_workers)
+        else:
+            return mapped_splitter(input_file, delimiter)
+        return splitter(input_file, delimiter)
+
+    def expand_input(self, input_seq, stat_cache=None, expander=DirectoryExpander):
+        if not self.args.expand_dirs:
+            return input_seq
+        return expander(input_seq, self.args.expand_depth, self.args.expand_name,
+                        self.args.expand_follow, self.args.expand_threads, stat_cache,
+                        self.args.encoding, not self.args.group_bytes)
+
+    @staticmethod
+    def expand_errors_count(input_seq):
+        return getattr(input_seq, 'errors_count', 0)
+
+    def prepper_class(self, new_group=CompactArgsGroup):
+        prepper_kwargs = {
+            'decode_args': not self.args.group_bytes,
+            'new_group': new_group,
+        }
+        if self.args.sorted_input is not None:
+            new_prepper = SortedInputPrepper
+            prepper_kwargs['on_repeat'] = self.args.sorted_input
+        elif self.args.stream:
+            new_prepper = StreamingInputPrepper
+            prepper_kwargs['buffer_size'] = self.args.stream_buffer
         else:
-            return splitter(input_file, self.args.delimiter)
+            new_prepper = InputPrepper
+        return functools.partial(new_prepper, **prepper_kwargs)
 
-    def prep_input(self, group_func, input_seq, new_prepper=InputPrepper):
+    def group_storage(self, input_seq, spill_file=SpillFile):
+        try:
+            return input_seq.new_group
+        except AttributeError:
+            pass
+        if self.args.memory_limit is None:
+            return CompactArgsGroup
+        else:
+            return spill_file(self.args.memory_limit).new_group
+
+    def prep_input(self, group_func, input_seq, new_prepper=None):
+        if new_prepper is None:
+            new_prepper = self.prepper_class(self.group_storage(input_seq))
         prepper = new_prepper(group_func, self.args.delimiter, self.args.encoding)
         with ExceptionWrapper(UserArgumentsError, EnvironmentError, UnicodeDecodeError):
-            prepper.add(input_seq)
+            try:
+                add_to = input_seq.add_to
+            except AttributeError:
+                prepper.add(input_seq)
+            else:
+                add_to(prepper, functools.partial(
+                    new_prepper, group_func, self.args.delimiter, self.args.encoding))
         return prepper
 
     def command_templates(self, group_cmd=GroupCommand, xargs_cmd=XargsCommand):
         templates = []
         if self.args.preexec is not None:
-            templates.append(group_cmd(self.args.preexec, self.args.group_str))
-        xargs_subcmd = group_cmd(self.args.command, self.args.group_str)
+            templates.append(group_cmd(self.args.preexec, self.args.group_str,
+                                       self.args.encoding))
+        xargs_subcmd = group_cmd(self.args.command, self.args.group_str, self.args.encoding)
         xargs_template = xargs_cmd(['xargs'], xargs_subcmd)
         xargs_template.set_options(self.xargs_opts)
         templates.append(xargs_template)
@@ -1145,22 +3880,56 @@ class Program(object):
             yield cmd_src.command(group_key), input_seq, delimiter
 
     def iter_pipelines(self, cmd_templates, input_prepper,
-                       source_func=None, pipeline_class=ProcessPipeline):
+                       source_func=None, pipeline_class=None):
         if source_func is None:
             source_func = self.pipeline_sources
-        cmd_templates[-1].set_parallel(self.args.max_procs, len(input_prepper))
+        if pipeline_class is None:
+            if self.args.args_via_file:
+                pipeline_class = FileProcessPipeline
+            else:
+                pipeline_class = ProcessPipeline
+        try:
+            groups_count = len(input_prepper)
+        except TypeError:
+            # Streaming preppers don't know how many groups they'll have.
+            pass
+        else:
+            cmd_templates[-1].set_parallel(self.args.max_procs, groups_count)
         for group_key in input_prepper:
             yield pipeline_class(source_func(cmd_templates, input_prepper, group_key))
 
-    def main(self, runner_class=PipelineRunner):
-        group_func = self.group_function()
+    def main(self, runner_class=PipelineRunner,
+             stream_runner_class=StreamingPipelineRunner, expression_cache=None):
+        key_cache = self.key_cache()
+        stat_cache = self.stat_cache()
+        if expression_cache is None:
+            group_func = self.group_function(key_cache=key_cache, stat_cache=stat_cache)
+        else:
+            group_func = self.group_function(
+                expression_cache.constructor(UserExpression),
+                expression_cache.constructor(BatchUserExpression),
+                key_cache=key_cache, stat_cache=stat_cache)
         input_file = self.input_file()
-        parser = self.input_parser(input_file)
+        parser = self.expand_input(self.input_parser(input_file), stat_cache)
         input_prepper = self.prep_input(group_func, parser)
         cmd_templates = self.command_templates()
         pipelines_src = self.iter_pipelines(cmd_templates, input_prepper)
-        pipeline_runner = runner_class(self.args.max_procs)
+        if self.args.stream:
+            pipeline_runner = stream_runner_class(self.args.max_procs, input_prepper)
+        else:
+            pipeline_runner = runner_class(self.args.max_procs)
         pipeline_runner.run(pipelines_src)
+        try:
+            close_group_func = group_func.close
+        except AttributeError:
+            pass
+        else:
+            close_group_func()
+        if key_cache is not None:
+            key_cache.close()
+        if self.args.debug:
+            for stats_line in self.debug_stats(group_func, key_cache, stat_cache):
+                print("xargs_groupby:", stats_line, file=sys.stderr)
         failures_count = pipeline_runner.failures_count()
         if not failures_count:
             exitcode = 0
@@ -1168,10 +3937,281 @@ class Program(object):
             exitcode = 100
         else:
             exitcode = min(10 + failures_count, 99)
+        if (not exitcode) and self.expand_errors_count(parser):
+            # Like find, fail after skipping directories that couldn't be read.
+            exitcode = 3
         return exitcode
 
 
-def main(arglist, program_class=Program, excepthook_class=ExceptHook):
+class ExpressionCache(object):
+    # Compiled group code for --serve, by class and source.  The server
+    # compiles each run's group code before it forks the run, so later runs
+    # with the same code inherit it, along with the modules it loaded.
+    # Each run evaluates the code itself, after it switches to its client's
+    # working directory and environment.
+    MAX_SIZE = 256
+
+    def __init__(self):
+        self._codes = collections.OrderedDict()
+
+    def compile(self, constructor, expr_s):
+        cache_key = (constructor, expr_s)
+        try:
+            expr_code = self._codes.pop(cache_key)
+        except KeyError:
+            expr_code = constructor.compile(expr_s)
+            if len(self._codes) >= self.MAX_SIZE:
+                self._codes.popitem(last=False)
+        self._codes[cache_key] = expr_code
+        return expr_code
+
+    def get(self, constructor, expr_s):
+        return constructor(expr_s, self.compile(constructor, expr_s))
+
+    def constructor(self, constructor):
+        return functools.partial(self.get, constructor)
+
+
+class JobServer(object):
+    # For --serve: accept runs from --connect clients on a Unix socket, and
+    # run each one in a forked child.  The client sends its stdin, stdout,
+    # and stderr, with its working directory, environment, and arguments;
+    # the child sends back the exit status.  All children share JobTokens,
+    # so together they run at most max_procs pipelines.
+    HEADER = _JOB_HEADER
+    EXITCODE = _JOB_EXITCODE
+    STDIO_FDS = _JOB_STDIO_FDS
+    BACKLOG = 64
+    REAP_INTERVAL = 1
+    REQUEST_TIMEOUT = 10
+
+    class QuietArgumentParser(ArgumentParser):
+        def _print_message(self, message, file=None):
+            pass
+
+    def __init__(self, path, max_procs, program_class=Program):
+        self.path = path
+        self.program_class = program_class
+        self.job_tokens = JobTokens(max_procs)
+        self.expression_cache = ExpressionCache()
+        self.parser = self.QuietArgumentParser()
+        self.listener = None
+        # Running children's pids, mapped to the connection to their client,
+        # or None after the client hung up.
+        self.jobs = {}
+
+    encode_request = staticmethod(_encode_job_request)
+
+    @classmethod
+    def decode_request(cls, payload):
+        fields = payload.split(b'\0')
+        if len(fields) < 2:
+            raise ValueError("request is missing fields")
+        args_end = int(fields[1]) + 2
+        if len(fields) < args_end:
+            raise ValueError("request has too few arguments")
+        environ = dict(field.split(b'=', 1) for field in fields[args_end:])
+        return fields[0], fields[2:args_end], environ
+
+    recv_exactly = staticmethod(_recv_exactly)
+
+    def _recv_header(self, conn):
+        import socket
+        fds = array.array(str('i'))
+        header, ancdata, _, _ = conn.recvmsg(
+            self.HEADER.size, socket.CMSG_SPACE(len(self.STDIO_FDS) * fds.itemsize))
+        for level, msg_type, data in ancdata:
+            if (level == socket.SOL_SOCKET) and (msg_type == socket.SCM_RIGHTS):
+                fds.frombytes(data[:len(data) - (len(data) % fds.itemsize)])
+        return list(fds), header
+
+    def _read_request(self, conn):
+        conn.settimeout(self.REQUEST_TIMEOUT)
+        fds, header = self._recv_header(conn)
+        try:
+            if (len(fds) != len(self.STDIO_FDS)) or (len(header) != self.HEADER.size):
+                raise ValueError("request is missing stdio")
+            payload = self.recv_exactly(conn, self.HEADER.unpack(header)[0])
+            request = self.decode_request(payload)
+        except (EnvironmentError, ValueError):
+            for fd in fds:
+                os.close(fd)
+            raise
+        conn.settimeout(None)
+        return fds, request
+
+    def _warm(self, arglist):
+        # Compile the run's group code here, so this and later children
+        # don't have to.  The child reports any errors.
+        try:
+            args, _ = self.parser.parse_args(arglist)
+            if args.group_code is None:
+                return
+            constructor = BatchUserExpression if args.batch_group_code else UserExpression
+            self.expression_cache.compile(constructor, args.group_code)
+        except (Exception, SystemExit):
+            pass
+
+    @staticmethod
+    def _interrupt_job(signum, frame):
+        raise KeyboardInterrupt
+
+    @staticmethod
+    def _exitcode(code):
+        if code is None:
+            return 0
+        elif isinstance(code, int):
+            return code
+        else:
+            return 1
+
+    def _job_exitcode(self, cwd, arglist, environ):
+        excepthook = ExceptHook.with_sys_stderr()
+        try:
+            os.chdir(cwd)
+            os.environb.clear()
+            os.environb.update(environ)
+            program = self.program_class.from_arglist(arglist)
+            excepthook = ExceptHook.with_sys_stderr(program.args.encoding)
+            excepthook.show_tb = program.args.debug
+            return program.main(
+                functools.partial(PipelineRunner, job_tokens=self.job_tokens),
+                functools.partial(StreamingPipelineRunner, job_tokens=self.job_tokens),
+                self.expression_cache)
+        except SystemExit as error:
+            return self._exitcode(error.code)
+        except BaseException:
+            try:
+                excepthook(*sys.exc_info())
+            except SystemExit as error:
+                return self._exitcode(error.code)
+        return 1
+
+    def _run_job(self, conn, fds, cwd, arglist, environ):
+        exitcode = 1
+        try:
+            signal.signal(signal.SIGTERM, self._interrupt_job)
+            self.listener.close()
+            for other_conn in self.jobs.values():
+                if other_conn is not None:
+                    other_conn.close()
+            for stdio_fd, fd in zip(self.STDIO_FDS, fds):
+                os.dup2(fd, stdio_fd)
+                os.close(fd)
+            exitcode = self._job_exitcode(
+                cwd, [os.fsdecode(arg) for arg in arglist], environ)
+        finally:
+            self.job_tokens.put_all()
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                conn.sendall(self.EXITCODE.pack(exitcode))
+            finally:
+                os._exit(0)
+
+    def _start_job(self, conn):
+        try:
+            fds, (cwd, arglist, environ) = self._read_request(conn)
+        except (EnvironmentError, ValueError):
+            conn.close()
+            return
+        self._warm([os.fsdecode(arg) for arg in arglist])
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            self._run_job(conn, fds, cwd, arglist, environ)
+        for fd in fds:
+            os.close(fd)
+        # Give the job its own process group, so we can stop everything
+        # it started if its client goes away.
+        try:
+            os.setpgid(pid, pid)
+        except EnvironmentError:
+            pass
+        self.jobs[pid] = conn
+
+    def _reap_jobs(self):
+        while self.jobs:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except EnvironmentError as error:
+                if error.errno != errno.ECHILD:
+                    raise
+                break
+            if pid == 0:
+                break
+            conn = self.jobs.pop(pid, None)
+            if conn is not None:
+                conn.close()
+
+    def _stop_job(self, pid):
+        # The client hung up before its run finished.
+        self.jobs[pid].close()
+        self.jobs[pid] = None
+        try:
+            os.killpg(pid, signal.SIGTERM)
+        except EnvironmentError:
+            pass
+
+    def _bind(self, listener):
+        import socket
+        try:
+            listener.bind(self.path)
+        except EnvironmentError as error:
+            if error.errno != errno.EADDRINUSE:
+                raise
+            # Replace the socket if no server is listening on it anymore.
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except EnvironmentError:
+                os.unlink(self.path)
+                listener.bind(self.path)
+            else:
+                raise error
+            finally:
+                probe.close()
+
+    @staticmethod
+    def _exit(signum, frame):
+        exit(0)
+
+    def serve(self):
+        import socket
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        with ExceptionWrapper(UserServerError(self.path), EnvironmentError):
+            self._bind(self.listener)
+            self.listener.listen(self.BACKLOG)
+        signal.signal(signal.SIGTERM, self._exit)
+        try:
+            while True:
+                conn_pids = {conn: pid for pid, conn in self.jobs.items() if conn is not None}
+                ready = select.select([self.listener] + list(conn_pids), [], [],
+                                      self.REAP_INTERVAL)[0]
+                for sock in ready:
+                    if sock is self.listener:
+                        self._start_job(self.listener.accept()[0])
+                    elif not sock.recv(1):
+                        self._stop_job(conn_pids[sock])
+                self._reap_jobs()
+        finally:
+            self.listener.close()
+            os.unlink(self.path)
+
+
+class JobClient(object):
+    # For --connect: send this run to a JobServer, and return its exit status.
+    def __init__(self, path):
+        self.path = path
+
+    def run(self, arglist):
+        with ExceptionWrapper(UserServerError(self.path), EnvironmentError, ValueError):
+            return _send_job(self.path, arglist)
+
+
+def main(arglist, program_class=Program, excepthook_class=ExceptHook,
+         server_class=JobServer, client_class=JobClient):
     """Run xargs_groupby as a script.
 
     This function expects xargs_groupby is __main__, and changes the
@@ -1181,6 +4221,10 @@ def main(arglist, program_class=Program, excepthook_class=ExceptHook):
     program = program_class.from_arglist(arglist)
     sys.excepthook = excepthook_class.with_sys_stderr(program.args.encoding)
     sys.excepthook.show_tb = program.args.debug
+    if program.args.connect is not None:
+        return client_class(program.args.connect).run(arglist)
+    elif program.args.serve is not None:
+        return server_class(program.args.serve, program.args.max_procs).serve()
     return program.main()
 
 if __name__ == '__main__':